@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Small mpi4py ping-pong between rank 0 and rank 1, used by mympirun --autodevice
+to measure the latency and bandwidth of a device. Rank 0 prints one line
+
+    MYMPINGPONG latency_us=<float> bandwidth_MBs=<float>
+
+@author: Stijn De Weirdt
+"""
+import sys
+import time
+
+from mpi4py import MPI
+
+LATENCY_SIZE = 1  # bytes
+BANDWIDTH_SIZE = 4 * 1024 * 1024  # bytes
+ITERATIONS = 20
+WARMUP = 2
+
+
+def pingpong(comm, size, iterations):
+    """Return the average time of one roundtrip with messages of size bytes between rank 0 and 1"""
+    buf = bytearray(size)
+    other = 1 - comm.rank
+    start = 0
+    for it in range(WARMUP + iterations):
+        if it == WARMUP:
+            comm.Barrier()
+            start = time.time()
+        if comm.rank == 0:
+            comm.Send([buf, MPI.BYTE], dest=other)
+            comm.Recv([buf, MPI.BYTE], source=other)
+        else:
+            comm.Recv([buf, MPI.BYTE], source=other)
+            comm.Send([buf, MPI.BYTE], dest=other)
+    return (time.time() - start) / iterations
+
+
+if __name__ == '__main__':
+    comm = MPI.COMM_WORLD
+    if comm.size < 2:
+        sys.stderr.write("mympingpong: needs at least 2 ranks, got %s\n" % comm.size)
+        sys.exit(1)
+
+    if comm.rank < 2:
+        group = comm.Split(0, comm.rank)
+        latency = pingpong(group, LATENCY_SIZE, ITERATIONS) / 2
+        bandwidth = 2 * BANDWIDTH_SIZE / pingpong(group, BANDWIDTH_SIZE, ITERATIONS)
+        if comm.rank == 0:
+            print "MYMPINGPONG latency_us=%.3f bandwidth_MBs=%.3f" % (latency * 1e6, bandwidth / 1024 / 1024)
+    else:
+        comm.Split(MPI.UNDEFINED, comm.rank)
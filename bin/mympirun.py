@@ -43,12 +43,16 @@ TODO:
 
 import sys
 import os
+import time
 
 from vsc.utils import fancylogger
+from vsc.mympirun.launchprofile import launch_profile
 from vsc.mympirun.mpi.factory import getinstance
-from vsc.mympirun.mpi.mpi import whatMPI
+from vsc.mympirun.mpi.mpi import TEARDOWN_EXITCODE_BASE, TeardownException, whatMPI
 from vsc.mympirun.option import MympirunOption
 from vsc.mympirun.rm.sched import whatSched
+from vsc.mympirun.stall import STALL_EXITCODE, StallException
+from vsc.mympirun.walltime import WALLTIME_EXITCODE, WalltimeException
 
 _logger = fancylogger.getLogger()
 
@@ -60,13 +64,19 @@ class ExitException(Exception):
 
 def get_mpi_and_sched_and_options():
     """Parses the mpi and scheduler based on current environment and guesses the best one to use"""
+    start = time.time()
     scriptname, mpi, found_mpi = whatMPI(sys.argv[0])
+    whatmpi_walltime = time.time() - start
 
     ismpirun = scriptname == 'mpirun'
 
     mo = MympirunOption(ismpirun=ismpirun)
 
-    if mo.args is None or len(mo.args) == 0:
+    if mo.options.profilelaunch or mo.options.cprofilelaunch:
+        launch_profile.enable(cprofile=mo.options.cprofilelaunch)
+        launch_profile.add_phase('whatMPI', whatmpi_walltime)
+
+    if (mo.args is None or len(mo.args) == 0) and mo.options.farm is None and mo.options.mpmd is None:
         mo.parser.print_shorthelp()
         raise ExitException("Exit no args provided")
 
@@ -111,6 +121,12 @@ def main():
         ec = 0
     except ExitException:
         ec = 0
+    except StallException:
+        ec = STALL_EXITCODE
+    except WalltimeException:
+        ec = WALLTIME_EXITCODE
+    except TeardownException, err:
+        ec = TEARDOWN_EXITCODE_BASE + err.signum
     except:
         # # TODO: cleanup, only catch known exceptions
         if os.environ.get('MYMPIRUN_MAIN_EXCEPTION', 0) == '1':
@@ -0,0 +1,258 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Per rank resource usage accounting (--accounting)
+
+Each rank is started by this module as a script (through the accounting wrapper in the mympirundir):
+
+    accounting.py recorddir command [args]
+
+It runs the command, waits for it with wait4 and writes one record with the resource usage of the rank
+in recorddir. The record is one line (about 60 bytes) in its own file, so there is no locking between ranks
+(eg 10k ranks make 10k records of less than 1 block). Signals are forwarded to the command and the exit code
+(or signal) of the command is passed on.
+
+The records are merged in one summary: per node max RSS, cputime efficiency ((user + sys) / wall)
+and the imbalance of the cputime over the ranks.
+
+Only uses the standard library, it runs on all nodes.
+
+@author: Stijn De Weirdt
+"""
+
+import errno
+import os
+import signal
+import socket
+import sys
+import time
+
+# environment variables with the (global) rank and the local rank on the node, first found is used
+RANK_VARIABLES = ['PMI_RANK', 'OMPI_COMM_WORLD_RANK', 'MV2_COMM_WORLD_RANK', 'PMIX_RANK', 'PMI_ID', 'PSC_MPI_RANK']
+LOCALRANK_VARIABLES = ['MPI_LOCALRANKID', 'OMPI_COMM_WORLD_LOCAL_RANK', 'MV2_COMM_WORLD_LOCAL_RANK',
+                       'PMI_LOCAL_RANK', 'PSC_MPI_NODE_RANK']
+
+FORWARD_SIGNALS = [signal.SIGHUP, signal.SIGINT, signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2, signal.SIGCONT]
+
+RECORD_TEMPLATE = "%(rank)d %(host)s %(localrank)d %(wall).3f %(utime).3f %(stime).3f %(maxrss)d %(exitcode)d\n"
+RECORD_FIELDS = [('rank', int), ('host', str), ('localrank', int), ('wall', float), ('utime', float),
+                 ('stime', float), ('maxrss', int), ('exitcode', int)]
+
+
+def get_rank(environ, names):
+    """Return the value of the first variable of names in environ as int, -1 if none is found"""
+    for name in names:
+        value = environ.get(name, '')
+        if value.isdigit():
+            return int(value)
+    return -1
+
+
+def format_record(record):
+    """Return the record line of the record dict"""
+    return RECORD_TEMPLATE % record
+
+
+def parse_record(line):
+    """Return the record dict of a record line, None if it is not a valid record"""
+    values = line.split()
+    if not len(values) == len(RECORD_FIELDS):
+        return None
+    try:
+        return dict([(name, conv(value)) for (name, conv), value in zip(RECORD_FIELDS, values)])
+    except ValueError:
+        return None
+
+
+def read_records(recorddir):
+    """Return the list of records in recorddir, sorted by rank (the missing local ranks are filled in)"""
+    records = []
+    for name in os.listdir(recorddir):
+        try:
+            record = parse_record(open(os.path.join(recorddir, name)).read())
+        except IOError:
+            continue
+        if record is not None:
+            records.append(record)
+    records.sort(key=lambda x: x['rank'])
+
+    # local rank in rank order on each host
+    localranks = {}
+    for record in records:
+        localrank = localranks.get(record['host'], 0)
+        localranks[record['host']] = localrank + 1
+        if record['localrank'] < 0:
+            record['localrank'] = localrank
+    return records
+
+
+def summarize(records):
+    """
+    Return the summary dict of the records
+        - nodes: per host dict with number of ranks, max and total maxrss, cputime and walltime
+        - wall, cpu: (min, mean, max) over the ranks
+        - efficiency: total cputime / total walltime of the ranks
+        - imbalance: max / mean cputime of the ranks (1.0 is perfectly balanced)
+        - failed: number of ranks with a non-zero exitcode
+    """
+    nodes = {}
+    for record in records:
+        cpu = record['utime'] + record['stime']
+        node = nodes.setdefault(record['host'], {'ranks': 0, 'maxrss': 0, 'totalrss': 0, 'cpu': 0.0, 'wall': 0.0})
+        node['ranks'] += 1
+        node['maxrss'] = max(node['maxrss'], record['maxrss'])
+        node['totalrss'] += record['maxrss']
+        node['cpu'] += cpu
+        node['wall'] += record['wall']
+
+    def stats(values):
+        if not values:
+            return (0.0, 0.0, 0.0)
+        return (min(values), sum(values) / len(values), max(values))
+
+    walls = [x['wall'] for x in records]
+    cpus = [x['utime'] + x['stime'] for x in records]
+    res = {
+        'ranks': len(records),
+        'nodes': nodes,
+        'wall': stats(walls),
+        'cpu': stats(cpus),
+        'efficiency': 0.0,
+        'imbalance': 0.0,
+        'failed': len([x for x in records if not x['exitcode'] == 0]),
+    }
+    if sum(walls) > 0:
+        res['efficiency'] = sum(cpus) / sum(walls)
+    if res['cpu'][1] > 0:
+        res['imbalance'] = res['cpu'][2] / res['cpu'][1]
+    return res
+
+
+def format_summary(summary):
+    """Return the list of lines of the summary"""
+    res = [
+        "%s ranks on %s nodes, %s failed" % (summary['ranks'], len(summary['nodes']), summary['failed']),
+        "wall min/mean/max %.2f/%.2f/%.2f s" % summary['wall'],
+        "cpu min/mean/max %.2f/%.2f/%.2f s, efficiency %.2f, imbalance %.2f" %
+        (summary['cpu'] + (summary['efficiency'], summary['imbalance'])),
+    ]
+    template = "%-20s %6s %14s %14s %10s"
+    res.append(template % ('node', 'ranks', 'max_rss_kb', 'total_rss_kb', 'efficiency'))
+    hosts = summary['nodes'].keys()
+    hosts.sort()
+    for host in hosts:
+        node = summary['nodes'][host]
+        efficiency = 0.0
+        if node['wall'] > 0:
+            efficiency = node['cpu'] / node['wall']
+        res.append(template % (host, node['ranks'], node['maxrss'], node['totalrss'], "%.2f" % efficiency))
+    return res
+
+
+def get_wrapper_cmd(recorddir):
+    """Return the command (list) to start a rank with its record in recorddir (the command of the rank is appended)"""
+    script = "%s.py" % os.path.splitext(os.path.abspath(__file__))[0]
+    return [sys.executable, script, recorddir]
+
+
+def run_rank(recorddir, cmd, environ=None):
+    """Run cmd, write its record in recorddir, return the wait status of cmd"""
+    if environ is None:
+        environ = os.environ
+
+    start = time.time()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            try:
+                os.execvp(cmd[0], cmd)
+            except OSError, err:
+                sys.stderr.write("accounting: failed to start %s: %s\n" % (cmd[0], err))
+        finally:
+            os._exit(127)
+
+    def forward(signum, frame):
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+    handlers = dict([(signum, signal.signal(signum, forward)) for signum in FORWARD_SIGNALS])
+
+    try:
+        while True:
+            try:
+                _, status, rusage = os.wait4(pid, 0)
+                break
+            except OSError, err:
+                if not err.errno == errno.EINTR:
+                    raise
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+    exitcode = -1
+    if os.WIFEXITED(status):
+        exitcode = os.WEXITSTATUS(status)
+    elif os.WIFSIGNALED(status):
+        exitcode = 128 + os.WTERMSIG(status)
+
+    record = {
+        'rank': get_rank(environ, RANK_VARIABLES),
+        'host': socket.gethostname(),
+        'localrank': get_rank(environ, LOCALRANK_VARIABLES),
+        'wall': time.time() - start,
+        'utime': rusage.ru_utime,
+        'stime': rusage.ru_stime,
+        'maxrss': rusage.ru_maxrss,  # in kB
+        'exitcode': exitcode,
+    }
+    name = "rank_%s" % record['rank']
+    if record['rank'] < 0:
+        name = "pid_%s_%s" % (record['host'], pid)
+    try:
+        open(os.path.join(recorddir, name), 'w').write(format_record(record))
+    except IOError, err:
+        sys.stderr.write("accounting: failed to write record %s in %s: %s\n" % (name, recorddir, err))
+
+    return status
+
+
+def main(args=None):
+    """Main accounting wrapper: recorddir command [args]"""
+    if args is None:
+        args = sys.argv[1:]
+    status = run_rank(args[0], args[1:])
+
+    if os.WIFSIGNALED(status):
+        # die the same way
+        signum = os.WTERMSIG(status)
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+        sys.exit(128 + signum)
+    sys.exit(os.WEXITSTATUS(status))
+
+
+if __name__ == '__main__':
+    main()
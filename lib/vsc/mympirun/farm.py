@@ -0,0 +1,178 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Task farm: run many (small) MPI runs concurrently in the slots of one allocation
+
+The tasks file has one task per line: the number of mpi processes followed by the command
+    4 ./sweep --param 1
+Empty lines and lines starting with # are ignored.
+
+@author: Stijn De Weirdt
+"""
+
+import os
+import shlex
+import subprocess
+import time
+
+from vsc.mympirun.launchprofile import launch_profile
+from vsc.utils.fancylogger import getLogger
+
+POLL_INTERVAL = 0.1  # in seconds
+
+
+def parse_tasks(txt):
+    """Return list of (np, cmdargs) from the tasks file content txt"""
+    tasks = []
+    for idx, line in enumerate(txt.splitlines()):
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        fields = shlex.split(line)
+        try:
+            np = int(fields[0])
+        except ValueError:
+            raise ValueError("line %s: first field should be the number of processes: %s" % (idx + 1, line))
+        if np < 1 or len(fields) < 2:
+            raise ValueError("line %s: need a number of processes > 0 and a command: %s" % (idx + 1, line))
+        tasks.append((np, fields[1:]))
+    return tasks
+
+
+class SlotPool(object):
+    """Free slots per host"""
+
+    def __init__(self, noderuns):
+        """
+        @param noderuns: run-length list of (host, count) with the slots
+        """
+        self.hosts = []
+        self.free = {}
+        for host, count in noderuns:
+            if not host in self.free:
+                self.hosts.append(host)
+                self.free[host] = 0
+            self.free[host] += count
+        self.total = sum(self.free.values())
+
+    def allocate(self, np):
+        """
+        Return list of (host, count) with np slots and mark them used, None if there are not enough free slots
+            - on one host if possible (the one with the fewest free slots that fit, to keep large holes free)
+            - otherwise over the hosts with the most free slots
+        """
+        candidates = [(self.free[host], idx, host) for idx, host in enumerate(self.hosts) if self.free[host] >= np]
+        if candidates:
+            candidates.sort()
+            res = [(candidates[0][2], np)]
+        elif sum(self.free.values()) >= np:
+            hosts = [(-self.free[host], idx, host) for idx, host in enumerate(self.hosts) if self.free[host] > 0]
+            hosts.sort()
+            res = []
+            todo = np
+            for free, _, host in hosts:
+                count = min(-free, todo)
+                res.append((host, count))
+                todo -= count
+                if todo == 0:
+                    break
+        else:
+            return None
+
+        for host, count in res:
+            self.free[host] -= count
+        return res
+
+    def release(self, allocation):
+        """Free the slots of allocation"""
+        for host, count in allocation:
+            self.free[host] += count
+
+
+class TaskFarm(object):
+    """Run the tasks concurrently in the slots of the pool; freed slots are filled right away"""
+
+    def __init__(self, tasks, pool, make_cmd, outputs):
+        """
+        @param tasks: list of (np, cmdargs)
+        @param pool: SlotPool instance
+        @param make_cmd: function with arguments (index, task, allocation), returns the command (string)
+        @param outputs: function with argument index, returns the filename for the output of the task
+        """
+        self.log = getLogger(self.__class__.__name__)
+
+        self.tasks = tasks
+        self.pool = pool
+        self.make_cmd = make_cmd
+        self.outputs = outputs
+
+        # per task: dict with allocation, start, end, ec and cmd; None if never started
+        self.results = [None] * len(tasks)
+
+    def start(self, idx, allocation):
+        """Start task idx on allocation, return the Popen instance"""
+        cmd = self.make_cmd(idx, self.tasks[idx], allocation)
+        output = open(self.outputs(idx), 'w')
+        launch_profile.add_subprocess()
+        try:
+            proc = subprocess.Popen(cmd, shell=True, stdout=output, stderr=subprocess.STDOUT, close_fds=True)
+        finally:
+            output.close()
+        self.results[idx] = {'allocation': allocation, 'start': time.time(), 'end': None, 'ec': None, 'cmd': cmd}
+        self.log.debug("start: task %s on %s: %s" % (idx, allocation, cmd))
+        return proc
+
+    def run(self):
+        """Run all tasks, return the results"""
+        pending = []
+        for idx, (np, _) in enumerate(self.tasks):
+            if np > self.pool.total:
+                self.log.error("run: task %s needs %s slots, only %s in the allocation" % (idx, np, self.pool.total))
+            else:
+                pending.append(idx)
+
+        running = {}
+        while pending or running:
+            # start the pending tasks that fit, in order (smaller tasks can fill holes before larger ones)
+            for idx in pending[:]:
+                allocation = self.pool.allocate(self.tasks[idx][0])
+                if allocation is not None:
+                    running[idx] = self.start(idx, allocation)
+                    pending.remove(idx)
+
+            time.sleep(POLL_INTERVAL)
+
+            for idx, proc in running.items():
+                ec = proc.poll()
+                if ec is not None:
+                    res = self.results[idx]
+                    res['end'] = time.time()
+                    res['ec'] = ec
+                    self.pool.release(res['allocation'])
+                    del running[idx]
+                    self.log.debug("run: task %s finished with ec %s in %.2f seconds" %
+                                   (idx, ec, res['end'] - res['start']))
+
+        return self.results
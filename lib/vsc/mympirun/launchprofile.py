@@ -0,0 +1,160 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Launch profile: wall time per launch phase, number of spawned subprocesses and bytes written
+
+When disabled, the only overhead is a boolean check per phase.
+
+@author: Stijn De Weirdt
+"""
+
+import os
+import time
+
+from vsc.utils.fancylogger import getLogger
+
+try:
+    import json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        json = None
+
+try:
+    import cProfile
+except ImportError:
+    cProfile = None
+
+
+class LaunchProfile(object):
+    """Collect the launch profile"""
+
+    def __init__(self):
+        self.log = getLogger(self.__class__.__name__)
+
+        self.enabled = False
+        self.start = None
+
+        self.phases = []  # list of [name, walltime], in order of start
+        self._stack = []  # names of running phases (for nesting)
+
+        self.subprocesses = 0
+        self.bytes_written = {}
+
+        self.cprofile = None
+
+    def enable(self, cprofile=False):
+        """Enable the profiling (and optionally start cProfile)"""
+        if not self.enabled:
+            self.enabled = True
+            self.start = time.time()
+            self.log.debug("enable: launch profiling enabled")
+
+        if cprofile and self.cprofile is None:
+            if cProfile is None:
+                self.log.warning("enable: cProfile not available")
+            else:
+                self.cprofile = cProfile.Profile()
+                self.cprofile.enable()
+
+    def add_phase(self, name, walltime):
+        """Add a phase that was timed elsewhere"""
+        if self.enabled:
+            self.phases.append(["/".join(self._stack + [name]), walltime])
+
+    def phase(self, name, func, *args, **kwargs):
+        """Run func with args and kwargs, and record the walltime as phase name"""
+        if not self.enabled:
+            return func(*args, **kwargs)
+
+        entry = ["/".join(self._stack + [name]), None]
+        self.phases.append(entry)
+        self._stack.append(name)
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            entry[1] = time.time() - start
+            self._stack.pop()
+
+    def add_subprocess(self, count=1):
+        """Count spawned subprocesses"""
+        if self.enabled:
+            self.subprocesses += count
+
+    def add_bytes(self, name, nbytes):
+        """Record nbytes written for name (eg the nodefile)"""
+        if self.enabled:
+            self.bytes_written[name] = self.bytes_written.get(name, 0) + nbytes
+
+    def report(self):
+        """Return the profile as a dict"""
+        res = {
+            'phases': self.phases,
+            'subprocesses': self.subprocesses,
+            'bytes_written': self.bytes_written,
+        }
+        if self.start is not None:
+            res['walltime'] = time.time() - self.start
+        return res
+
+    def write(self, path):
+        """Write the JSON report (and cProfile stats if any) in directory path"""
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            fn = os.path.join(path, 'launch_profile.cprofile')
+            self.cprofile.dump_stats(fn)
+            self.log.info("write: wrote cProfile stats %s (use pstats to inspect)" % fn)
+
+        report = self.report()
+        fn = os.path.join(path, 'launch_profile.json')
+        if json is None:
+            self.log.error("write: no json module available, not writing launch profile %s: %s" % (fn, report))
+            return
+
+        try:
+            fh = open(fn, 'w')
+            try:
+                json.dump(report, fh, indent=4)
+            finally:
+                fh.close()
+            self.log.info("write: wrote launch profile %s" % fn)
+        except IOError, err:
+            self.log.error("write: failed to write launch profile %s: %s" % (fn, err))
+
+
+# there's only one launch per process
+launch_profile = LaunchProfile()
+
+
+def count_subprocesses(run_func):
+    """Wrap a vsc.utils.run function to count the spawned subprocesses in the launch profile"""
+    def wrapped(*args, **kwargs):
+        launch_profile.add_subprocess()
+        return run_func(*args, **kwargs)
+    wrapped.__name__ = run_func.__name__
+    wrapped.__doc__ = run_func.__doc__
+    return wrapped
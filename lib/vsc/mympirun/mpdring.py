@@ -0,0 +1,245 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Persistent MPD ring: one mpd ring per job, booted by the first mympirun and reused by the next ones
+
+The ring directory (~/.mympirun/mpdring_<jobid>) has
+    state: the job id, hosts, port of the local mpd and pid of the watchdog of the ring
+    lock: lock file for checking, booting and tearing down the ring
+    lastused: its mtime is the last time the ring was used
+    users/<pid>: one file per mympirun process that is using the ring
+
+The watchdog (started with this module as script) tears down the ring and removes the ring directory
+when the job script (the parent process of the mympirun that booted the ring) is gone,
+or when the ring was not used for idle seconds.
+
+@author: Stijn De Weirdt
+"""
+
+import errno
+import fcntl
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+STATE_FILENAME = 'state'
+LOCK_FILENAME = 'lock'
+LASTUSED_FILENAME = 'lastused'
+USERS_DIRNAME = 'users'
+WATCHDOG_LOG_FILENAME = 'watchdog.log'
+
+WATCHDOG_INTERVAL = 30  # seconds between the checks of the watchdog
+
+# mpdtrace -l output: <host>_<port> (<ip>), the local mpd first
+MPDTRACE_REGEX = re.compile(r"^(\S+)_(\d+)\s", re.M)
+
+
+def parse_mpdtrace(txt):
+    """Return the list of (host, port) of the mpds in mpdtrace -l output txt"""
+    return [(host, int(port)) for host, port in MPDTRACE_REGEX.findall(txt)]
+
+
+def pid_alive(pid):
+    """Return True if the process pid (on this node) exists"""
+    try:
+        os.kill(pid, 0)
+    except OSError, err:
+        return err.errno == errno.EPERM
+    return True
+
+
+class MpdRing(object):
+    """The ring directory of a persistent mpd ring"""
+
+    def __init__(self, ringdir):
+        self.ringdir = ringdir
+        self._lockfh = None
+
+    def _path(self, *names):
+        return os.path.join(self.ringdir, *names)
+
+    def lock(self, create=True):
+        """
+        Lock the ring (blocking), return False if the ring directory does not exist (and create is False)
+        The lock file of a removed ring directory is not a valid lock, so check the locked file is still there.
+        """
+        while True:
+            if create:
+                try:
+                    os.makedirs(self._path(USERS_DIRNAME), 0700)
+                except OSError, err:
+                    if not err.errno == errno.EEXIST:
+                        raise
+            try:
+                fh = open(self._path(LOCK_FILENAME), 'a')
+            except IOError, err:
+                if err.errno == errno.ENOENT and not create:
+                    return False
+                raise
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            try:
+                valid = os.stat(fh.name).st_ino == os.fstat(fh.fileno()).st_ino
+            except OSError:
+                valid = False
+            if valid:
+                self._lockfh = fh
+                return True
+            fh.close()
+
+    def unlock(self):
+        """Release the lock"""
+        if self._lockfh is not None:
+            self._lockfh.close()
+            self._lockfh = None
+
+    def read_state(self):
+        """Return the state dict (None if there is no ring)"""
+        try:
+            lines = open(self._path(STATE_FILENAME)).read().splitlines()
+        except IOError:
+            return None
+
+        state = dict([line.split('=', 1) for line in lines if '=' in line])
+        try:
+            state['hosts'] = [x for x in state['hosts'].split(',') if x]
+            state['port'] = int(state['port'])
+            state['watchdog'] = int(state['watchdog'])
+        except (KeyError, ValueError):
+            return None
+        return state
+
+    def write_state(self, jobid, hosts, port, watchdog):
+        """Write the state of the ring"""
+        txt = "jobid=%s\nhosts=%s\nport=%s\nwatchdog=%s\n" % (jobid, ','.join(hosts), port, watchdog)
+        tmpfn = "%s.%s.tmp" % (self._path(STATE_FILENAME), os.getpid())
+        fh = open(tmpfn, 'w')
+        try:
+            fh.write(txt)
+        finally:
+            fh.close()
+        os.rename(tmpfn, self._path(STATE_FILENAME))
+
+    def clear_state(self):
+        """Remove the state (eg after tearing down a broken ring)"""
+        try:
+            os.remove(self._path(STATE_FILENAME))
+        except OSError:
+            pass
+
+    def touch(self):
+        """Mark the ring as used now"""
+        open(self._path(LASTUSED_FILENAME), 'a').close()
+        os.utime(self._path(LASTUSED_FILENAME), None)
+
+    def register(self, pid=None):
+        """Register process pid (default: this process) as user of the ring"""
+        if pid is None:
+            pid = os.getpid()
+        open(self._path(USERS_DIRNAME, "%s" % pid), 'w').close()
+        self.touch()
+
+    def unregister(self, pid=None):
+        """Unregister process pid (default: this process) as user of the ring"""
+        if pid is None:
+            pid = os.getpid()
+        try:
+            os.remove(self._path(USERS_DIRNAME, "%s" % pid))
+        except OSError:
+            pass
+        else:
+            self.touch()
+
+    def idle(self):
+        """Return the number of seconds the ring is not used (0 if it is in use), remove stale users"""
+        busy = False
+        for name in os.listdir(self._path(USERS_DIRNAME)):
+            if pid_alive(int(name)):
+                busy = True
+            else:
+                os.remove(self._path(USERS_DIRNAME, name))
+        if busy:
+            self.touch()
+            return 0
+        try:
+            return max(time.time() - os.path.getmtime(self._path(LASTUSED_FILENAME)), 0)
+        except OSError:
+            return 0
+
+    def start_watchdog(self, jobpid, idle, stopcmd):
+        """Start the watchdog of the ring in the background, return its pid"""
+        script = "%s.py" % os.path.splitext(os.path.abspath(__file__))[0]
+        cmd = [sys.executable, script, self.ringdir, "%s" % jobpid, "%s" % idle, stopcmd]
+        log = open(self._path(WATCHDOG_LOG_FILENAME), 'a')
+        try:
+            # the watchdog outlives this mympirun
+            proc = subprocess.Popen(cmd, stdin=open(os.devnull), stdout=log, stderr=subprocess.STDOUT,
+                                    close_fds=True, preexec_fn=os.setsid)
+        finally:
+            log.close()
+        return proc.pid
+
+    def teardown(self, stopcmd):
+        """Stop the ring with stopcmd and remove the ring directory (with the lock held)"""
+        ec = subprocess.call(stopcmd, shell=True)
+        shutil.rmtree(self.ringdir, True)
+        return ec
+
+
+def run_watchdog(ringdir, jobpid, idle, stopcmd, interval=WATCHDOG_INTERVAL):
+    """Tear down the ring in ringdir when process jobpid is gone or the ring is idle for idle seconds"""
+    ring = MpdRing(ringdir)
+    while True:
+        time.sleep(interval)
+        if not ring.lock(create=False):
+            return
+        try:
+            if not pid_alive(jobpid):
+                reason = "job script (pid %s) is gone" % jobpid
+            elif ring.idle() > idle:
+                reason = "not used for more than %s seconds" % idle
+            else:
+                reason = None
+
+            if reason is not None:
+                print "mpdring watchdog: %s, tearing down the ring with %s" % (reason, stopcmd)
+                sys.stdout.flush()
+                ring.teardown(stopcmd)
+                return
+        finally:
+            ring.unlock()
+
+
+def main(args=None):
+    """Main watchdog: ringdir jobpid idle stopcmd"""
+    if args is None:
+        args = sys.argv[1:]
+    run_watchdog(args[0], int(args[1]), int(args[2]), args[3])
+
+
+if __name__ == '__main__':
+    main()
@@ -30,13 +30,14 @@ Intel MPI specific class
 
 from distutils.version import LooseVersion
 from vsc.mympirun.mpi.mpi import MPI, which
+from vsc.mympirun.tuneindex import TuneIndex
+from vsc.utils.missing import nub
 import os, re
 import socket
 
 class IntelMPI(MPI):
     """TODO: support for tuning
         - runtune: generate the tuning files
-        - tuneconf: pass the generated config files
     """
 
     _mpiscriptname_for = ['impirun']
@@ -48,6 +49,12 @@ class IntelMPI(MPI):
                                 'fallback':("Enable device fallback", None, "store_true", False),
                                 'daplud':("Enable DAPL UD connections", None, "store_true", False),
                                 'xrc':("Enable Mellanox XRC", None, "store_true", False),
+                                'tune':(("Use the nearest mpitune config file (TUNINGCONF environment variable "
+                                         "or lookup in the tuning directory)"), None, "store_true", False),
+                                'tunedir':(("Directory with the mpitune config files "
+                                            "(default: $SOFTROOTIMPI/etc64)"), "str", "store", None),
+                                'tuneapp':("Application name of the mpitune config files (default: TUNINGAPP "
+                                           "environment variable or mpiexec)", "str", "store", None),
                                 },
                      'prefix':'impi',
                      'description': ('Intel MPI options', 'Advanced options specific for Intel MPI'),
@@ -61,6 +68,20 @@ class IntelMPI(MPI):
 
     MPIEXEC_TEMPLATE_PASS_VARIABLE_OPTION = "-envlist %(commaseparated)s"
 
+    # read by mpd/the hydra proxies for the process placement and pinning
+    ENVFILE_COMMANDLINE_PREFIXES = ['I_MPI_PIN', 'I_MPI_MPD', 'I_MPI_HYDRA', 'I_MPI_PERHOST']
+
+    MPMD_SYNTAX = 'configfile'
+
+    MPDRING_SUPPORTED = True
+
+    FARM_SUPPORTED = False
+
+    TEARDOWN_CMD = 'mpdallexit'
+
+    TUNING_DIRECTORY_SUBDIR = 'etc64'  # relative to SOFTROOTIMPI
+    TUNING_APP_DEFAULT = 'mpiexec'
+
     def _pin_flavour(self, mp=None):
         if self.options.hybrid is not None and self.options.hybrid in (4,):
             mp = True
@@ -106,15 +127,24 @@ class IntelMPI(MPI):
                            "requested ppn %s, found cpus %s, usable cpus %s") %
                           (self.ppn, self.foundppn, len(self.cpus)))
 
-            if self.nruniquenodes > 1:
+            # one global processor list: only possible if all nodes have the same cpus
+            # the remote cpusets are only probed for the per node pinning
+            if self.nruniquenodes > 1 and self.pinning_override_type is None:
                 self.log.info(("check_usable_cpus: more then one unique node requested. "
-                               "Not setting I_MPI_PIN_PROCESSOR_LIST."))
+                               "Not setting I_MPI_PIN_PROCESSOR_LIST (use --overridepin for per node pinning)."))
+                return
+
+            cpusets = nub([tuple(cpus) for _, cpus, _ in self.get_node_cpusets().values()])
+            if len(cpusets) > 1:
+                self.log.info(("check_usable_cpus: %s different cpusets on %s unique nodes. "
+                               "Not setting I_MPI_PIN_PROCESSOR_LIST (use --overridepin for per node pinning).") %
+                              (len(cpusets), self.nruniquenodes))
             else:
-                txt = ",".join(["%d" % x for x in self.cpus])
+                txt = ",".join(["%d" % x for x in cpusets[0]])
                 self.mpiexec_global_options['I_MPI_PIN_PROCESSOR_LIST'] = txt
                 self._setenv('I_MPI_PIN_PROCESSOR_LIST', txt)
-                self.log.info(("check_usable_cpus: one node requested. "
-                               "Setting I_MPI_PIN_PROCESSOR_LIST to %s") % txt)
+                self.log.info(("check_usable_cpus: same cpus on all %s unique nodes. "
+                               "Setting I_MPI_PIN_PROCESSOR_LIST to %s") % (self.nruniquenodes, txt))
 
     def mpiexec_set_global_options(self):
         """Set mpiexec global options"""
@@ -166,6 +196,62 @@ class IntelMPI(MPI):
             if self.options.debuglvl > 0:
                 self.mpiexec_global_options['TMI_DEBUG'] = '1'
 
+    def get_tuning_dir(self):
+        """Return the directory with the mpitune config files, None if not found"""
+        tunedir = getattr(self.options, 'impi_tunedir', None)
+        if tunedir is None:
+            if not 'SOFTROOTIMPI' in os.environ:
+                self.log.warning('get_tuning_dir: environment variable SOFTROOTIMPI not found')
+                return None
+            tunedir = os.path.join(os.environ['SOFTROOTIMPI'], self.TUNING_DIRECTORY_SUBDIR)
+
+        if not os.path.isdir(tunedir):
+            self.log.warning("get_tuning_dir: path with config files %s not found" % tunedir)
+            return None
+        return os.path.abspath(tunedir)
+
+    def gettuning(self):
+        """Return the tuning option with the config file that matches the current run (None if there is none)"""
+        if not getattr(self.options, 'impi_tune', False):
+            return None
+
+        conf = os.environ.get('TUNINGCONF', None)
+        if conf is not None:
+            self.log.debug("gettuning: TUNINGCONF variable: %s" % conf)
+        else:
+            tunedir = self.get_tuning_dir()
+            if tunedir is None:
+                return None
+
+            app = getattr(self.options, 'impi_tuneapp', None)
+            if app is None:
+                app = os.environ.get('TUNINGAPP', self.TUNING_APP_DEFAULT)
+
+            indexfile = os.path.join(self.get_basepath(), '.mympirun', 'tuneindex',
+                                     tunedir.strip(os.sep).replace(os.sep, '_'))
+            nranks = self.mpitotalppn * self.nruniquenodes
+            conf = TuneIndex(tunedir, indexfile).lookup(app, self.device, self.nruniquenodes, nranks,
+                                                        self.mpitotalppn)
+            if conf is None:
+                self.log.info("gettuning: no tuning config file found for app %s device %s in %s" %
+                              (app, self.device, tunedir))
+                return None
+
+        if not os.path.isfile(conf):
+            self.log.warning("gettuning: tuning config file %s not found" % conf)
+            return None
+
+        self.log.info("gettuning: using tuning config file %s" % conf)
+        return "-tune %s" % conf
+
+    def make_mpiexec_options(self):
+        """Add the tuning config file to the global options"""
+        super(IntelMPI, self).make_mpiexec_options()
+
+        tuning = self.gettuning()
+        if tuning is not None:
+            self.mpiexec_options.insert(0, tuning)
+
     def mpirun_prepare_execution(self):
         """Small change"""
         # intel mpi mpirun strips the --file otion for mpdboot if it detects PBS_ENVIRONMENT to some fixed value
@@ -184,6 +270,17 @@ class IntelHydraMPI(IntelMPI):
     HYDRA = True
     HYDRA_LAUNCHER_NAME = "bootstrap"
 
+    MPDRING_SUPPORTED = False
+
+    FARM_SUPPORTED = True
+
+    TEARDOWN_CMD = None
+
+    NODEFILE_TEMPLATE_COMPACT = "%(host)s:%(count)s"
+
+    OUTPUT_RANK_PREFIX_OPTION = "-prepend-rank"
+    OUTPUT_RANK_PREFIX_REGEX = r"^\[(\d+)\] "
+
     DEVICE_MPIDEVICE_MAP = {
                             'ib':'shm:dapl',
                             'det':'det',
@@ -267,56 +364,3 @@ class IntelLegacy(IntelMPI):
 
         self.log.debug("maketunecmds returns %s" % ans)
         return ans
-
-    def gettuning(self):
-        """Get a tuning config file that matches the current code"""
-        self.log.raiseException("Legacy code, information purposes only!")
-
-        ans = '-noconf'
-        if not self.tune:
-            self.log.debug("No tuning parameter: %s" % ans)
-            return ans
-
-        conf = None
-        if os.environ.has_key('TUNINGCONF'):
-            conf = os.environ['TUNINGCONF']
-            self.log.debug("TUNINGCONF variable: %s" % conf)
-        else:
-            if not os.environ.has_key('SOFTROOTIMPI'):
-                self.log.error('gettuning: environment variable SOFTROOTIMPI not found')
-                return ans
-            tmpdir = os.path.join(os.environ['SOFTROOTIMPI'], 'etc64')
-            if not os.path.exists(tmpdir):
-                self.log.error("path with configfiles %s not found" % tmpdir)
-                return ans
-            # <app>_<device>_nn_<#nodes>_np_<#processes>_ppn_<#processes/node>.conf
-            # 2 factors: np and nn
-            w = 10
-            goal = w * (self.sched.nrnodes + 1) + (self.sched.nruniq + 1)
-            mindist = 10 * 1000 * 1000
-
-            if os.environ.has_key('TUNINGAPP'):
-                app = os.environ['TUNINGAPP']
-            else:
-                app = 'mpiexec'
-            import glob
-            reg = re.compile(r"%s_%s_nn_(\d+)_np_(\d+)_ppn_(\d+).conf" % (app, self.dev))
-            for fi in glob.glob("%s/*.conf" % (tmpdir)):
-                r = reg.search(os.path.basename(fi))
-                if r:
-                    nn = int(r.group(1))
-                    np = int(r.group(2))
-                    ppn = int(r.group(3))
-                    dist = abs(goal - (w * (np + 1) + (nn + 1) + (0 * ppn)))
-                    if dist < mindist:
-                        conf = fi
-                        mindist = dist
-
-        if conf:
-            if not os.path.isfile(conf):
-                self.log.error("Tuning config file %s not found" % conf)
-            else:
-                ans = "-tune %s" % conf
-        self.log.debug("Tuning parameter: %s" % ans)
-        return ans
-
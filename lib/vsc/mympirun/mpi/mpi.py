@@ -28,22 +28,52 @@ Base MPI class, all actual classes should inherit from this one
 @author: Stijn De Weirdt
 """
 
+import errno
+import gzip
 import os
 import re
+import shlex
 import socket
 import shutil
+import signal
 import time
 import resource
 import stat
 import subprocess
 import random
 import string
+import sys
+import threading
 
 
 from vsc.utils.fancylogger import getLogger
+from vsc.mympirun.accounting import RECORD_FIELDS, format_record, format_summary, get_wrapper_cmd
+from vsc.mympirun.accounting import read_records, summarize
 from vsc.mympirun.external.IPy import IP
+from vsc.mympirun.farm import SlotPool, TaskFarm, parse_tasks
+from vsc.mympirun.launchprofile import count_subprocesses, launch_profile
+from vsc.mympirun.mpdring import MpdRing, parse_mpdtrace, pid_alive
+from vsc.mympirun.mpmd import MPMD_SEPARATOR, parse_components_file, partition_nodes, split_components
+from vsc.mympirun.netinfo import get_local_ipv4_addresses
+from vsc.mympirun.output import OutputEngine, SplitFiles, run_output
+from vsc.mympirun.probecache import ProbeCache, make_probecache_key
+from vsc.mympirun.proctree import group_alive, kill_group, run_noworries_group, run_to_file_group, wait_group
+from vsc.mympirun.resilient import FABRIC_PATTERNS, LAUNCHER_PATTERNS, classify_failure, plan_retry
+from vsc.mympirun.stall import StallDetector, StallException
+from vsc.mympirun.rshagent import ENVIRONMENT_PREFIX as RSHAGENT_ENVIRONMENT_PREFIX
+from vsc.mympirun.sshtree import ENVIRONMENT_PREFIX as SSHTREE_ENVIRONMENT_PREFIX
+from vsc.mympirun.threadpool import bounded_map
+from vsc.mympirun.topology import PINNING_POLICIES, SYSFS_SYSTEM, Topology, make_cpulist
+from vsc.mympirun.walltime import WalltimeException, WalltimeGuard, get_signal, parse_walltime
 from vsc.utils.missing import get_subclasses, nub
-from vsc.utils.run import run_simple, run_simple_noworries, run_to_file, run_async_to_stdout
+from vsc.utils.run import run_simple, run_simple_noworries
+
+# count the spawned subprocesses in the launch profile
+run_simple = count_subprocesses(run_simple)
+run_simple_noworries = count_subprocesses(run_simple_noworries)
+run_to_file_group = count_subprocesses(run_to_file_group)
+run_noworries_group = count_subprocesses(run_noworries_group)
+run_output = count_subprocesses(run_output)
 
 # Going to guess myself
 
@@ -53,6 +83,16 @@ INSTALLATION_SUBDIRECTORY_NAME = '(VSC-tools|(?:vsc-)?mympirun)'
 # also hardcoded in setup.py !
 FAKE_SUBDIRECTORY_NAME = 'fake'
 
+TEARDOWN_EXITCODE_BASE = 128  # exitcode of mympirun after a terminating signal is this plus the signal number
+
+
+class TeardownException(Exception):
+    """mympirun (and mpirun) was terminated by signal signum"""
+
+    def __init__(self, signum):
+        Exception.__init__(self, "terminated by signal %s" % signum)
+        self.signum = signum
+
 
 def whatMPI(name):
     """
@@ -89,6 +129,26 @@ def _setenv(name, value):
     os.environ[name] = "%s" % value
 
 
+def make_variables_regex(names):
+    """
+    Return compiled regex that matches the variable names that are one of names,
+    or that start with one of names followed by an underscore
+    """
+    if len(names) == 0:
+        # matches nothing
+        return re.compile(r"(?!)")
+    names = nub(names)
+    # longest first, so the alternation doesn't stop at a shorter prefix
+    names.sort(lambda x, y: cmp(len(y), len(x)))
+    return re.compile(r"^(?:%s)(?:_|$)" % '|'.join([re.escape(x) for x in names]))
+
+
+def parse_environment(txt):
+    """Return dict with the environment from the output of env (multiline values are ignored)"""
+    reg = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)=(.*)$", re.M)
+    return dict(reg.findall(txt))
+
+
 def stripfake(path=None):
     """Remove the fake wrapper path:
         assumes (VSC-tools|mympirun)/1.0.0/bin/fake
@@ -143,6 +203,16 @@ class MPI(object):
     MPIRUN_LOCALHOSTNAME = 'localhost'
 
     DEFAULT_RSH = None
+    SSHTREE_CMD = 'sshtree'
+    RSHAGENT_CMD = 'rshagent'
+    LAUNCH_TREE_FANOUT = 32  # default fan-out of the launch tree of large jobs
+
+    LOCALHOST_LOOKUP_WORKERS = 16  # max number of concurrent hostname lookups
+    LOCALHOST_IFACE_PREFIXES = ['eth', 'em', 'ib', 'wlan']  # interfaces (besides lo) for the localhost lookup
+
+    PROBECACHE_TTL = 24 * 60 * 60  # in seconds
+    PROBECACHE_MAX_ENTRIES = 16  # per node
+    SHELL_CMD_NOT_FOUND_EXITCODE = 127  # exitcode of the shell for a missing command
 
     HYDRA = None
     HYDRA_LAUNCHER_NAME = "launcher"
@@ -157,19 +227,92 @@ class MPI(object):
 
     NETMASK_TYPE_MAP = {'ib': 'ib', 'det': 'eth', 'shm': 'eth', 'socket': 'eth'}
 
+    AUTODEVICE_MYMPIRUN_CMD = 'mympirun'
+    AUTODEVICE_PINGPONG_CMD = 'mympingpong'
+    AUTODEVICE_TIMEOUT = 60  # in seconds, per device
+    AUTODEVICE_CACHE_NAME = 'autodevice'  # one cache file for all nodes
+    AUTODEVICE_CACHE_TTL = 7 * 24 * 60 * 60  # in seconds
+    AUTODEVICE_CACHE_MAX_ENTRIES = 256
+
+    LIMIT_STACK_MIN_KB = 1024 * 1024
+
+    PREFLIGHT_WORKERS = 16  # max number of nodes checked concurrently
+    PREFLIGHT_TIMEOUT = 120  # default total time budget in seconds
+    PREFLIGHT_SHM_MIN_KB = 256 * 1024  # min free space in /dev/shm
+    PREFLIGHT_MEM_MIN_KB = 1024 * 1024  # min available memory
+
     PINNING_OVERRIDE_METHOD = 'numactl'
     PINNING_OVERRIDE_TYPE_DEFAULT = None
+    SYSFS_SYSTEM = SYSFS_SYSTEM
 
     MPDBOOT_TEMPLATE_REMOTE_OPTION_NAME = "--rsh=%(rsh)s"
+    MPDBOOT_TEMPLATE_FANOUT_OPTION_NAME = "--maxbranch=%(fanout)s"
     MPDBOOT_OPTIONS = []
 
+    # persistent mpd ring (--mpdring), see vsc.mympirun.mpdring
+    MPDRING_SUPPORTED = False
+    MPDRING_BOOT_CMD = 'mpdboot'
+    MPDRING_CHECK_CMD = 'mpdtrace -l'
+    MPDRING_STOP_CMD = 'mpdallexit'
+
     MPIEXEC_TEMPLATE_GOBAL_OPTION = "-genv %(name)s %(value)s"
     MPIEXEC_TEMPLATE_LOCAL_OPTION = "-env %(name)s %(value)s"
     MPIEXEC_TEMPLATE_PASS_VARIABLE_OPTION = "-x %(name)s"
     MPIEXEC_OPTIONS = []
 
+    # MPMD syntax: 'colon' (sections separated by ':' on the command line), 'configfile' (one section per line
+    # in a file passed with -configfile) or None (not supported)
+    MPMD_SYNTAX = 'colon'
+    MPMD_SECTION_PER_HOST = True  # one section per host of a component, otherwise one section per component
+    MPMD_TEMPLATE_SECTION = "-n %(np)s -host %(host)s"  # also has the nodefile of the component
+    MPMD_TEMPLATE_ENV = "-env %(name)s %(value)s"
+
+    # prefix of the output lines with the rank (--outputsplit): mpiexec option and regex with the rank as first group
+    # None: not supported
+    OUTPUT_RANK_PREFIX_OPTION = "-l"
+    OUTPUT_RANK_PREFIX_REGEX = r"^(\d+): "
+
+    # with --execmpirun, the mympirundir is removed by this hook script, started in the background
+    # and waiting for the exec'ed mpirun to exit
+    EXEC_CLEANUP_HOOK_NAME = 'cleanup_hook.sh'
+    EXEC_CLEANUP_HOOK_INTERVAL = 5  # seconds between the checks for the end of mpirun
+
+    # signals forwarded to the mpirun process group; the terminating ones also tear down the job
+    FORWARD_SIGNALS = [signal.SIGINT, signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2]
+    TERMINATE_SIGNALS = [signal.SIGINT, signal.SIGTERM]
+    TEARDOWN_KILL_WAIT = 5  # seconds to wait for the process group to be gone after the SIGKILL
+    TEARDOWN_CMD = None  # flavour command to stop the daemons left after mpirun is gone (eg mpdallexit)
+
+    # failure classification for --resilient (regexes on the output), see vsc.mympirun.resilient
+    RESILIENT_LAUNCHER_PATTERNS = LAUNCHER_PATTERNS
+    RESILIENT_FABRIC_PATTERNS = FABRIC_PATTERNS
+
+    # stall detection (--stallwindow), see vsc.mympirun.stall
+    STALL_SAMPLE_INTERVAL = 60  # seconds
+    STALL_REMOTE_CPUTIME_CMD = "ps -U %(uid)s -o times="  # cputime in seconds per process
+    STALL_REMOTE_TIMEOUT = 30  # in seconds, a remote sample running longer is killed
+
+    FARM_SUPPORTED = True  # False: concurrent farm tasks conflict (eg the mpd rings of the tasks)
+    # changed to make the commands of the farm tasks
+    FARM_TASK_ATTRIBUTES = ['mpinoderuns', 'uniquenodes', 'nruniquenodes', 'mpitotalppn', 'mpiexec_np', 'cmdargs',
+                            'mpiexec_node_filename', 'mpdboot_node_filename', 'mpdboot_options', 'mpiexec_options',
+                            'mpirun_cmd']
+
+    # template for one line per host in the nodefile (eg "%(host)s:%(count)s")
+    # None: always one line per mpi process
+    NODEFILE_TEMPLATE_COMPACT = None
+
     GLOBAL_VARIABLES_ENVIRONMENT_MODULES = ['MODULEPATH', 'LOADEDMODULES', 'MODULESHOME']
 
+    LOGIN_ENVIRONMENT_CMD = 'env'  # run with the remote shell (see --skiploginvariables)
+
+    # with --envfile, the global options and pass variables are written once to an env file in mympirundir
+    # that each rank sources through a small loader, instead of one command line option per variable
+    ENVFILE_SUPPORTED = True
+    ENVFILE_GLOBAL_OPTIONS = True  # the global options are environment variables
+    # variables that stay on the command line (eg read by the launcher or proxies themselves)
+    ENVFILE_COMMANDLINE_PREFIXES = []
+
     PASS_VARIABLES_BASE = ['LD_LIBRARY_PATH', 'PATH', 'PYTHONPATH', 'CLASSPATH', 'LD_PRELOAD', 'PYTHONUNBUFFERED']
     PASS_VARIABLES_BASE_PREFIX = ['OMP', 'MKL', 'KMP', 'DAPL', 'PSM', 'IPATH', 'TMI', 'PSC', 'O64', 'VSMP']
     PASS_VARIABLES_CLASS_PREFIX = []  # to be set per derived class
@@ -188,29 +331,64 @@ class MPI(object):
         self.netmask = None
 
         self.mympirundir = None
+        self.preflight_results = None
+
+        self.probecache = None
 
         self.mpdboot_node_filename = None
         self.mpdboot_options = None
         self.mpdboot_totalnum = None
         self.mpdboot_localhost_interface = None
+        self.mpdring = None
 
         self.mpiexec_node_filename = None
         self.mpiexec_options = None
         self.mpiexec_global_options = {}
         self.mpiexec_local_options = {}
         self.mpiexec_pass_environment = []  # list of variables
+        self.mpiexec_np = None  # number of processes to start (default: mpitotalppn per unique node)
+
+        self.envfile_environment = {}
+        self.envfile_loader = None
+
+        self.accounting_dirs = []  # records directories of the accounting wrappers
+
+        self.login_environment = None
 
         self.mpirun_cmd = None
 
+        self.farm_results = None
+
+        self.mpmd_components = None
+
+        self.output_split = getattr(self.options, 'outputsplit', None)
+        self.output_engine = None
+
+        self.walltime_guard = None
+        self.stall_detector = None
+        self.stall_remote_samples = {}  # per remote node, state of its last sample (see remote_cputime)
+
+        self.mpirun_pid = None  # also the process group id of mpirun
+        self.terminate_signum = None  # terminating signal received while mpirun runs (see signal_handler)
+
+        self.excluded_nodes = []  # nodes excluded after a failure with --resilient
+
         self.pinning_override_type = getattr(self.options, 'overridepin', self.PINNING_OVERRIDE_TYPE_DEFAULT)
 
+        # before the Sched init, so its phases are profiled too
+        cprofilelaunch = getattr(self.options, 'cprofilelaunch', False)
+        if getattr(self.options, 'profilelaunch', False) or cprofilelaunch:
+            launch_profile.enable(cprofile=cprofilelaunch)
+
         super(MPI, self).__init__(**kwargs)
 
         # sanity checks
         if getattr(self, 'id', None) is None:
             self.log.raiseException("__init__: id None (should be set by one of the Sched classes)")
 
-        if self.cmdargs is None or len(self.cmdargs) == 0:
+        # the farm tasks file and the MPMD file have the commands
+        if ((self.cmdargs is None or len(self.cmdargs) == 0) and getattr(self.options, 'farm', None) is None
+                and getattr(self.options, 'mpmd', None) is None):
             self.log.raiseException("__init__: no executable or command provided")
 
     # factory methods for MPI
@@ -245,7 +423,55 @@ class MPI(object):
         self.log.debug("_setenv; set name %s to value %s" % (name, value))
         _setenv(name, value)
 
+    def get_basepath(self):
+        """Return the basepath for the mympirun files"""
+        basepath = getattr(self.options, 'basepath', None)
+        if basepath is None:
+            basepath = os.environ['HOME']
+        if not os.path.exists(basepath):
+            self.log.raiseException("get_basepath: basepath %s should exist." % basepath)
+        return basepath
+
+    def make_probecache(self):
+        """Make the persistent per node probe cache"""
+        path = os.path.join(self.get_basepath(), '.mympirun', 'probecache')
+        key = make_probecache_key(mpirun=which('mpirun'))
+        refresh = getattr(self.options, 'refreshprobes', False)
+        self.probecache = ProbeCache(path, key, ttl=self.PROBECACHE_TTL, maxentries=self.PROBECACHE_MAX_ENTRIES,
+                                     refresh=refresh)
+        self.log.debug("make_probecache: probe cache in %s with key %s (refresh %s)" % (path, key, refresh))
+
+    def cached_probe(self, name, probe, valid=None):
+        """
+        Return the result of probe() for this node, using the probe cache
+            @param valid: function, only cache the result when valid(result) is True
+        """
+        if self.probecache is None:
+            self.make_probecache()
+        return self.probecache.get(name, probe, valid=valid)
+
+    def _probe_device_paths(self):
+        """Return dict with for each device if its path exists"""
+        res = {}
+        for dev, path in self.DEVICE_LOCATION_MAP.items():
+            res[dev] = path is None or os.path.exists(path)
+        return res
+
     def cleanup(self):
+        if self.accounting_dirs:
+            self.accounting_summary()
+
+        if self.mpdring is not None:
+            self.mpdring.unregister()
+
+        if launch_profile.enabled:
+            self.log.info("cleanup: not removing mympirundir %s with launch profile" % self.mympirundir)
+            return
+
+        if self.output_split is not None:
+            self.log.info("cleanup: not removing mympirundir %s with the split output" % self.mympirundir)
+            return
+
         # remove mympirundir
         try:
             shutil.rmtree(self.mympirundir)
@@ -256,85 +482,483 @@ class MPI(object):
     ### main ###
     def main(self):
         """Main method"""
-        self.prepare()
+        phase = launch_profile.phase
 
-        self.make_mpdboot()
+        farm = getattr(self.options, 'farm', None) is not None
+        if farm and not self.FARM_SUPPORTED:
+            self.log.raiseException("main: farm mode not supported with mpd based MPI flavours "
+                                    "(the mpd rings of concurrent tasks conflict)")
+
+        phase('prepare', self.prepare)
+
+        # the farm tasks make their own mpdboot and mpirun commands
+        if not farm:
+            phase('make_mpdboot', self.make_mpdboot)
+
+            if getattr(self.options, 'mpdring', False):
+                phase('mpdring_start', self.mpdring_start)
 
         # prepare these separately
-        self.mpiexec_set_global_options()
-        self.mpiexec_set_local_options()
-        self.mpiexec_set_local_pass_variable_options()
+        phase('mpiexec_set_global_options', self.mpiexec_set_global_options)
+        phase('mpiexec_set_local_options', self.mpiexec_set_local_options)
+        phase('mpiexec_set_local_pass_variable_options', self.mpiexec_set_local_pass_variable_options)
+
+        if getattr(self.options, 'envfile', False):
+            phase('make_envfile', self.make_envfile)
+
+        if farm:
+            if self.probecache is not None:
+                self.probecache.save()
+            if launch_profile.enabled:
+                self.write_launch_profile()
+
+            failed = self.farm()
+            self.cleanup()
+            if failed > 0:
+                self.log.raiseException("main: %s of %s farm tasks failed" % (failed, len(self.farm_results)))
+            return
 
-        self.make_mpiexec()
+        phase('make_mpiexec', self.make_mpiexec)
 
-        self.make_mpirun()
+        phase('make_mpirun', self.make_mpirun)
+
+        if self.probecache is not None:
+            self.probecache.save()
+
+        execution = phase('mpirun_prepare_execution', self.mpirun_prepare_execution)
+
+        if launch_profile.enabled:
+            self.write_launch_profile()
+
+        phase('make_walltime_guard', self.make_walltime_guard)
+        phase('make_stall_detector', self.make_stall_detector)
+
+        if getattr(self.options, 'execmpirun', False) and self.exec_supported(execution):
+            self.exec_mpirun()
 
         # actual execution
-        for runfunc, cmd in self.mpirun_prepare_execution():
-            self.log.debug("main: going to execute cmd %s" % " ".join(cmd))
+        self.execute(execution)
+
+        self.cleanup()
+
+    def execute(self, execution):
+        """
+        Run the list of (runfunc, cmd) tuples, the signals are forwarded to mpirun (see signal_handler)
+            with --resilient, mpirun is relaunched after a launcher or fabric failure (see recover)
+            after a terminating signal, tear down and raise TeardownException
+        """
+        retries = getattr(self.options, 'resilient', 0)
+        attempts = []
+        handlers = self.install_signal_handlers()
+        try:
+            try:
+                while True:
+                    start = time.time()
+                    ec, out, cmd = self.run_execution(execution)
+                    if self.stall_detector is not None and self.stall_detector.stalled:
+                        self.cleanup()
+                        self.log.raiseException("execute: mpirun aborted after %s seconds without progress; cmd %s" %
+                                                (self.stall_detector.window, cmd), exception=StallException)
+                    guard = self.walltime_guard
+                    if guard is not None and guard.sent and (guard.terminated() or not ec == 0):
+                        self.cleanup()
+                        self.log.raiseException("execute: mpirun exitcode %s after the walltime signals %s; cmd %s" %
+                                                (ec, ', '.join([x[2] for x in guard.sent]), cmd),
+                                                exception=WalltimeException)
+                    if ec == 0:
+                        break
+
+                    recovery = None
+                    if len(attempts) < retries:
+                        recovery = self.recover(ec, out)
+                    if recovery is None:
+                        self.resilient_report(attempts)
+                        self.cleanup()
+                        self.log.raiseException("execute: exitcode %s; cmd %s" % (ec, cmd))
+
+                    attempts.append((ec, recovery, time.time() - start))
+                    self.log.warning("execute: relaunch %s of %s after exitcode %s (%s %s)" %
+                                     (len(attempts), retries, ec, recovery[0], recovery[1]))
+                    execution = self.relaunch()
+            except TeardownException:
+                # the exception can be reraised on the way (eg by vsc.utils.run), with only a message
+                signum = self.terminate_signum
+                self.teardown(signum)
+                self.log.warning("execute: terminated by signal %s" % signum)
+                raise TeardownException(signum)
+        finally:
+            self.restore_signal_handlers(handlers)
+
+        self.resilient_report(attempts)
+
+    def run_execution(self, execution):
+        """Run the (runfunc, cmd) tuples until one fails, return tuple (exitcode, output, cmd) of the last one"""
+        ec, out, cmd = 0, None, None
+        for runfunc, cmd in execution:
+            self.log.debug("run_execution: going to execute cmd %s" % " ".join(cmd))
+            if self.stall_detector is not None:
+                self.stall_detector.reset()
             ec, out = runfunc(cmd)
-            if ec > 0:
-                self.cleanup()
-                self.log.raiseException("main: exitcode %s > 0; cmd %s" % (ec, cmd))
+            self.mpirun_pid = None
+            self.stop_remote_samples()
+            if not ec == 0:
                 break
+        return ec, out, cmd
 
-        self.cleanup()
+    def recover(self, ec, out):
+        """
+        Classify the failure with exitcode ec and output out, prepare the relaunch for a launcher or fabric failure
+            - exclude the failed nodes (never the node mympirun runs on), or fall back to the next device
+            return the recovery (action, value) (see vsc.mympirun.resilient.plan_retry), None if there is no retry
+        """
+        kind, badnodes = classify_failure(ec, out, self.uniquenodes, self.RESILIENT_LAUNCHER_PATTERNS,
+                                          self.RESILIENT_FABRIC_PATTERNS)
+        if self.mpdboot_localhost_interface is not None:
+            badnodes = [x for x in badnodes if not x == self.mpdboot_localhost_interface[0]]
+        self.log.warning("recover: %s failure (exitcode %s) on nodes %s" % (kind, ec, badnodes))
+
+        recovery = plan_retry(kind, badnodes, self.uniquenodes, self.fallback_devices())
+        if recovery is None:
+            return None
+
+        # the daemons of the failed attempt (not the persistent mpd ring)
+        if self.TEARDOWN_CMD is not None and self.mpdring is None:
+            run_simple_noworries(self.TEARDOWN_CMD)
+
+        action, value = recovery
+        if action == 'exclude':
+            self.exclude_nodes(value)
+        elif action == 'device':
+            self.change_device(value)
+        return recovery
+
+    def fallback_devices(self):
+        """Return the devices after the current one in DEVICE_ORDER that can be used (none for a forced device)"""
+        for name in ['rdma', 'socket', 'device']:
+            if getattr(self.options, name, None):
+                return []
+
+        current = [self.DEVICE_ORDER.index(dev) for dev, mpidev in self.DEVICE_MPIDEVICE_MAP.items()
+                   if mpidev == self.device and dev in self.DEVICE_ORDER]
+        if not current:
+            return []
+
+        device_paths = self.cached_probe('device_paths', self._probe_device_paths)
+        res = []
+        for dev in self.DEVICE_ORDER[max(current) + 1:]:
+            # only for single node
+            if dev in ('shm',) and self.nruniquenodes > 1:
+                continue
+            if device_paths[dev]:
+                res.append(dev)
+        return res
+
+    def change_device(self, dev):
+        """Use device dev (from DEVICE_ORDER) for the next launch"""
+        self.log.warning("change_device: device %s replaced by %s (%s)" %
+                         (self.device, self.DEVICE_MPIDEVICE_MAP[dev], dev))
+        self.device = self.DEVICE_MPIDEVICE_MAP[dev]
+        self.netmasktype = self.NETMASK_TYPE_MAP[dev]
+        self.netmask = None
+        self.set_netmask()
+
+    def exclude_nodes(self, nodes):
+        """Remove nodes from the node list, the mpi node list is remade by the next make_node_file"""
+        self.excluded_nodes += nodes
+        self.noderuns = [(host, count) for host, count in self.noderuns if not host in self.excluded_nodes]
+        self.nrnodes = sum([count for _, count in self.noderuns])
+        self.get_unique_nodes()
+        self.mpinoderuns = None
+        self.log.warning("exclude_nodes: excluded %s, %s nodes left" % (', '.join(nodes), self.nruniquenodes))
+
+    def relaunch(self):
+        """Remake the mpirun command for the current nodes and device, return the new execution"""
+        if self.mpmd_components is not None:
+            self.make_mpmd()
+        self.make_node_file()
+        self.make_mpdboot()
+        self.mpiexec_set_global_options()
+        if getattr(self.options, 'envfile', False):
+            self.make_envfile()
+        self.make_mpiexec()
+        self.make_mpirun()
+        return self.mpirun_prepare_execution()
+
+    def resilient_report(self, attempts):
+        """Log the failed attempts [(exitcode, recovery, seconds)], the excluded nodes and the time lost"""
+        if not attempts:
+            return
+
+        for idx, (ec, (action, value), seconds) in enumerate(attempts):
+            self.log.info("resilient_report: attempt %s: exitcode %s after %.2f seconds, %s %s" %
+                          (idx, ec, seconds, action, value))
+        self.log.info("resilient_report: %s relaunches, excluded nodes: %s, device %s, %.2f seconds lost" %
+                      (len(attempts), ', '.join(self.excluded_nodes) or '-', self.device,
+                       sum([x[2] for x in attempts])))
+
+    def install_signal_handlers(self):
+        """Install signal_handler for the FORWARD_SIGNALS, return dict with the original handlers"""
+        handlers = {}
+        for signum in self.FORWARD_SIGNALS:
+            handlers[signum] = signal.signal(signum, self.signal_handler)
+        return handlers
+
+    def restore_signal_handlers(self, handlers):
+        """Restore the original signal handlers"""
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+    def mpirun_started(self, pid):
+        """Record the pid of the started mpirun (the leader of its own process group)"""
+        self.mpirun_pid = pid
+        self.log.debug("mpirun_started: mpirun pid and process group %s" % pid)
+
+    def signal_handler(self, signum, frame):
+        """
+        Forward the signal to the mpirun process group;
+        for the TERMINATE_SIGNALS, raise TeardownException (execute does the teardown)
+        """
+        pgid = self.mpirun_pid
+        if pgid is not None:
+            try:
+                os.killpg(pgid, signum)
+            except OSError, err:
+                if not err.errno == errno.ESRCH:
+                    raise
+        self.log.warning("signal_handler: received signal %s, forwarded to mpirun process group %s" % (signum, pgid))
+
+        if signum in self.TERMINATE_SIGNALS:
+            # a repeated Ctrl-C should not interrupt the teardown
+            for sig in self.TERMINATE_SIGNALS:
+                signal.signal(sig, signal.SIG_IGN)
+            self.terminate_signum = signum
+            raise TeardownException(signum)
+
+    def teardown(self, signum):
+        """
+        Fast teardown after terminating signal signum (already forwarded to the mpirun process group)
+            - wait at most teardowngrace seconds for the process group, then kill the mpirun process tree
+            - run the flavour TEARDOWN_CMD (not with the persistent mpd ring, it is reused)
+            - cleanup the mympirundir
+        """
+        start = time.time()
+        if self.mpirun_pid is not None:
+            self.stop_mpirun(self.mpirun_pid)
+        stopped = time.time() - start
+        self.stop_remote_samples()
+
+        if self.TEARDOWN_CMD is not None and self.mpdring is None:
+            run_simple_noworries(self.TEARDOWN_CMD)
+
+        # the signal can arrive after the cleanup of a failed mpirun
+        if os.path.isdir(self.mympirundir):
+            self.cleanup()
+        self.log.info("teardown: signal %s: mpirun stopped in %.2f seconds, teardown done in %.2f seconds" %
+                      (signum, stopped, time.time() - start))
+
+    def stop_mpirun(self, pgid):
+        """
+        Wait at most teardowngrace seconds for the mpirun process group pgid (after a terminating signal),
+        then kill the mpirun process tree
+        """
+        if wait_group(pgid, self.options.teardowngrace):
+            return
+
+        killed = kill_group(pgid)
+        self.log.warning("stop_mpirun: mpirun process group %s still running after %s seconds, killed %s processes" %
+                         (pgid, self.options.teardowngrace, len(killed)))
+        if not wait_group(pgid, self.TEARDOWN_KILL_WAIT):
+            self.log.warning("stop_mpirun: mpirun process group %s still running after SIGKILL" % pgid)
+
+    def exec_supported(self, execution):
+        """Return True if mympirun can be replaced by mpirun (only one command, no output processing)"""
+        reason = None
+        if not len(execution) == 1:
+            reason = "%s commands to execute" % len(execution)
+        elif self.output_split is not None or self.options.outputcompress:
+            reason = "output split or compression"
+        elif self.supervised():
+            reason = "the mpirun process tree is supervised"
+        elif getattr(self.options, 'resilient', 0) > 0:
+            reason = "mpirun can be relaunched"
+        elif getattr(self.options, 'accounting', None) is not None:
+            reason = "the accounting records are merged at the end"
+
+        if reason is None:
+            return True
+        self.log.warning("exec_supported: can't exec mpirun (%s), mympirun stays resident" % reason)
+        return False
+
+    def make_cleanup_hook(self):
+        """
+        Write the cleanup hook in mympirundir: it waits for the exec'ed mpirun (this pid) to exit
+        and removes the mympirundir (as cleanup does). It can also be run eg from an epilogue.
+        """
+        hook = os.path.join(self.mympirundir, self.EXEC_CLEANUP_HOOK_NAME)
+        txt = [
+            "#!/bin/sh",
+            "# cleanup of mympirun %s after mpirun (pid %s)" % (self.id, os.getpid()),
+            "while kill -0 %s 2>/dev/null; do sleep %s; done" % (os.getpid(), self.EXEC_CLEANUP_HOOK_INTERVAL),
+        ]
+        if launch_profile.enabled:
+            txt.append("# not removing mympirundir with launch profile")
+        else:
+            txt.append("rm -rf '%s'" % self.mympirundir)
+
+        try:
+            open(hook, 'w').write("\n".join(txt + ['']))
+            os.chmod(hook, stat.S_IRWXU)
+        except (IOError, OSError), err:
+            self.log.raiseException("make_cleanup_hook: failed to write cleanup hook %s: %s" % (hook, err))
+        self.log.debug("make_cleanup_hook: wrote cleanup hook %s" % hook)
+        return hook
+
+    def exec_mpirun(self):
+        """
+        Replace mympirun by mpirun (os.execvp with the argv list, no shell); does not return
+            - the cleanup hook is started in the background
+            - with --output, stdout and stderr are redirected to the output file
+        """
+        # the shell word splitting of the mpirun command string
+        argv = shlex.split(" ".join(self.mpirun_cmd))
+        hook = self.make_cleanup_hook()
+        launch_profile.add_subprocess()
+        subprocess.Popen([hook], stdin=open(os.devnull), stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT,
+                         close_fds=True, preexec_fn=os.setsid)
+
+        self.log.info("exec_mpirun: exec %s (cleanup hook %s)" % (argv, hook))
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if self.options.output is not None:
+            try:
+                fd = os.open(self.options.output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+            except OSError, err:
+                self.log.raiseException("exec_mpirun: failed to open output file %s: %s" % (self.options.output, err))
+            os.dup2(fd, sys.stdout.fileno())
+            os.dup2(fd, sys.stderr.fileno())
+            os.close(fd)
+
+        try:
+            os.execvp(argv[0], argv)
+        except OSError, err:
+            self.log.raiseException("exec_mpirun: exec %s failed: %s" % (argv, err))
+
+    def write_launch_profile(self):
+        """Write the launch profile in mympirundir"""
+        if self.mpirun_cmd is not None:
+            launch_profile.add_bytes('mpirun_cmd', len(" ".join(self.mpirun_cmd)))
+        launch_profile.add_bytes('environment', sum([len(k) + len(v) + 2 for k, v in os.environ.items()]))
+        launch_profile.write(self.mympirundir)
 
     ### BEGIN prepare ###
     def prepare(self):
         """Collect information to create the commands"""
-        self.check_usable_cpus()
-        self.check_limit()
+        phase = launch_profile.phase
 
-        self.set_omp_threads()
-        self.qlogic_ipath()
-        self.scalemp_vsmp()
+        phase('check_usable_cpus', self.check_usable_cpus)
+        phase('check_limit', self.check_limit)
 
-        self.set_netmask()
+        if getattr(self.options, 'preflight', False):
+            phase('preflight', self.preflight)
 
-        self.make_node_file()
+        phase('set_omp_threads', self.set_omp_threads)
+        phase('qlogic_ipath', self.qlogic_ipath)
+        phase('scalemp_vsmp', self.scalemp_vsmp)
+
+        phase('set_netmask', self.set_netmask)
+
+        if getattr(self.options, 'mpmd', None) is not None or MPMD_SEPARATOR in (self.cmdargs or []):
+            phase('make_mpmd', self.make_mpmd)
+
+        phase('make_node_file', self.make_node_file)
 
-        self.set_pinning()
+        phase('set_pinning', self.set_pinning)
 
     def get_pass_variables(self):
         """Get the list of variable names to pass"""
         vars_to_pass = nub([v for v in self.PASS_VARIABLES_BASE if v in os.environ])
+        seen = set(vars_to_pass)
 
-        for env_prefix in self.PASS_VARIABLES_CLASS_PREFIX + self.PASS_VARIABLES_BASE_PREFIX + self.options.variablesprefix:
-            for env_var in os.environ.keys():
-                # exact match or starts with <prefix>_
-                if (env_prefix == env_var or env_var.startswith("%s_" % env_prefix)) and not env_var in vars_to_pass:
-                    vars_to_pass.append(env_var)
+        # exact match or starts with <prefix>_, in one pass over the environment
+        prefixes = self.PASS_VARIABLES_CLASS_PREFIX + self.PASS_VARIABLES_BASE_PREFIX + self.options.variablesprefix
+        match = make_variables_regex(prefixes).match
+        for env_var in os.environ.keys():
+            if not env_var in seen and match(env_var):
+                vars_to_pass.append(env_var)
+                seen.add(env_var)
+
+        if getattr(self.options, 'skiploginvariables', False):
+            vars_to_pass = self.drop_login_variables(vars_to_pass)
 
         return vars_to_pass
 
+    def get_login_environment(self):
+        """
+        Return dict with the environment of a remote shell on the first node
+        (empty if it can't be determined)
+        """
+        if self.login_environment is None:
+            if self.uniquenodes is None:
+                self.get_unique_nodes()
+            rsh = self.get_rsh()
+            self.setup_rsh(rsh)
+            cmd = "%s %s %s" % (rsh, self.uniquenodes[0], self.LOGIN_ENVIRONMENT_CMD)
+            ec, out = run_simple_noworries(cmd)
+            if ec > 0:
+                self.log.warning("get_login_environment: failed to get the remote environment with cmd %s (ec %s)" %
+                                 (cmd, ec))
+                self.login_environment = {}
+            else:
+                self.login_environment = parse_environment(out)
+            self.log.debug("get_login_environment: %s variables" % len(self.login_environment))
+        return self.login_environment
+
+    def drop_login_variables(self, names):
+        """Return the variables from names whose value differs from the one in a remote shell"""
+        login_environment = self.get_login_environment()
+        res = [x for x in names if not login_environment.get(x, None) == os.environ[x]]
+        self.log.debug("drop_login_variables: dropped variables with same value in remote shell: %s" %
+                       [x for x in names if not x in res])
+        return res
+
     def get_localhosts(self):
         """
         Get the localhost interfaces from the uniquenodes list
         -- if hostname is different from the name in the nodelist
+
+        All local addresses are collected once, the unique nodes are resolved concurrently
+        and the lookup stops at the first local match (in uniquenodes order).
+        Only the addresses of lo and the interfaces with a prefix from LOCALHOST_IFACE_PREFIXES are used
+        (eg not those of bond0, docker0 or virbr0).
         """
-        iface_prefix = ['eth', 'em', 'ib', 'wlan']
-        reg_iface = re.compile(r'((?:%s)\d+(?:\.\d+)?(?::\d+)?|lo)' % '|'.join(iface_prefix))
+        start = time.time()
+        reg_iface = re.compile(r'^(?:(?:%s)\d+(?:\.\d+)?(?::\d+)?|lo)$' % '|'.join(self.LOCALHOST_IFACE_PREFIXES))
+        local_addresses = {}
+        for ip, iface in get_local_ipv4_addresses().items():  # TODO ipv6
+            if reg_iface.search(iface):
+                local_addresses[ip] = iface
+            else:
+                self.log.debug("get_localhost: no interface match for prefixes %s: %s (ip: %s)" %
+                               (self.LOCALHOST_IFACE_PREFIXES, iface, ip))
 
-        res = []
-        for idx, hn in enumerate(self.uniquenodes):
-            ip = socket.gethostbyname(hn)
-            cmd = "/sbin/ip -4 -o addr show to %s/32" % ip  # TODO ipv6
-            ec, out = run_simple(cmd)
-            if ec == 0:
-                r = reg_iface.search(out)
-                if r:
-                    iface = r.group(1)
-                    self.log.debug("get_localhost idx %s: localhost interface %s found for %s (ip: %s)" %
-                                   (idx, iface, hn, ip))
+        def local_iface(hn):
+            try:
+                ip = socket.gethostbyname(hn)
+            except socket.error, err:
+                self.log.error("get_localhost: failed to resolve %s: %s" % (hn, err))
+                return None
 
-                    res.append((hn, iface))
-                else:
-                    # not a big issue, probably not
-                    self.log.debug(("get_localhost idx %s: no interface match for "
-                                    "prefixes %s out %s") % (idx, iface_prefix, out))
-            else:
-                self.log.error("get_localhost idx %s: cmd %s failed with output %s" % (idx, cmd, out))
+            iface = local_addresses.get(ip, None)
+            if iface is not None:
+                self.log.debug("get_localhost: localhost interface %s found for %s (ip: %s)" % (iface, hn, ip))
+            return iface
+
+        ifaces = bounded_map(local_iface, self.uniquenodes, workers=self.LOCALHOST_LOOKUP_WORKERS,
+                             stop=lambda hn, iface: iface is not None)
+
+        res = [(hn, iface) for hn, iface in zip(self.uniquenodes, ifaces) if iface is not None][:1]
+        self.log.info("get_localhost: lookup of %s unique nodes against %s local addresses took %.3f s" %
+                      (self.nruniquenodes, len(local_addresses), time.time() - start))
 
         if len(res) == 0:
             self.log.raiseException("get_localhost: can't find localhost from uniq nodes %s" %
@@ -353,10 +977,147 @@ class MPI(object):
     def check_limit(self):
         soft, hard = resource.getrlimit(resource.RLIMIT_STACK)
         # unit is kB
-        if soft > -1 and soft < 1024 * 1024:
+        if soft > -1 and soft < self.LIMIT_STACK_MIN_KB:
             # non-fatal
             self.log.error("Stack size %s%s too low? Increase with ulimit -s unlimited" % (soft, 'kB'))
 
+    def get_preflight_cmd(self):
+        """Return the shell command that reports the node health (key=value lines)"""
+        cmd = ["echo hostname=`hostname`"]
+        for dev, path in sorted(self.DEVICE_LOCATION_MAP.items()):
+            if path is not None:
+                cmd.append("if [ -e %s ]; then echo dev_%s=1; else echo dev_%s=0; fi" % (path, dev, dev))
+        cmd += [
+            "echo shm_df=`df -Pk /dev/shm 2>/dev/null | tail -n 1`",
+            'grep -E "^(MemFree|MemAvailable):" /proc/meminfo',
+            "echo memlock=`ulimit -l`",
+            "echo stack=`ulimit -s`",
+        ]
+        return '; '.join(cmd)
+
+    def parse_preflight(self, out):
+        """Parse the output of the preflight command, return dict"""
+        res = {}
+        for line in out.splitlines():
+            line = line.strip()
+            if line.startswith('Mem') and ':' in line:
+                key, value = line.split(':', 1)
+                res[key] = int(value.split()[0])
+            elif '=' in line:
+                key, value = line.split('=', 1)
+                if key == 'shm_df':
+                    try:
+                        res['shm_free_kb'] = int(value.split()[3])
+                    except (IndexError, ValueError):
+                        pass
+                else:
+                    res[key] = value.strip()
+        return res
+
+    def evaluate_preflight(self, res, localdevices):
+        """
+        Return tuple (failures, warnings) for the preflight result res of a node
+            - localdevices: dict with device as key and True if found on this node
+        """
+        failures = []
+        warnings = []
+
+        if res is None:
+            failures.append('timeout')
+            return failures, warnings
+        if res['ec'] > 0 or not 'hostname' in res:
+            failures.append("unreachable (ec %s)" % res['ec'])
+            return failures, warnings
+
+        for dev, found in sorted(localdevices.items()):
+            path = self.DEVICE_LOCATION_MAP.get(dev, None)
+            if found and path is not None and not res.get("dev_%s" % dev, None) == '1':
+                failures.append("missing %s" % path)
+
+        shm = res.get('shm_free_kb', None)
+        if shm is not None and shm < self.PREFLIGHT_SHM_MIN_KB:
+            failures.append("/dev/shm free %skB" % shm)
+
+        mem = res.get('MemAvailable', res.get('MemFree', None))
+        if mem is not None and mem < self.PREFLIGHT_MEM_MIN_KB:
+            warnings.append("available memory %skB" % mem)
+
+        memlock = res.get('memlock', 'unlimited')
+        if localdevices.get('ib', False) and not memlock == 'unlimited':
+            warnings.append("memlock %s (not unlimited)" % memlock)
+
+        stack = res.get('stack', 'unlimited')
+        if not stack == 'unlimited' and stack.isdigit() and int(stack) < self.LIMIT_STACK_MIN_KB:
+            warnings.append("stack %skB" % stack)
+
+        return failures, warnings
+
+    def preflight(self):
+        """
+        Check the health of all unique nodes before the start, concurrently and within a total time budget
+            - reachable with the remote shell
+            - the device paths found on this node (DEVICE_LOCATION_MAP)
+            - free /dev/shm and memory
+            - memlock and stack limits
+        Logs a table with one line per node, sets self.preflight_results and fails if any node fails.
+        """
+        if self.uniquenodes is None:
+            self.get_unique_nodes()
+        self.make_mympirundir()
+
+        rsh = self.get_rsh()
+        self.setup_rsh(rsh)
+        cmd = self.get_preflight_cmd()
+        timeout = getattr(self.options, 'preflighttimeout', None)
+        if timeout is None:
+            timeout = self.PREFLIGHT_TIMEOUT
+
+        states = dict([(x, {'pid': None, 'expired': False}) for x in self.uniquenodes])
+
+        def check(node):
+            """Run the preflight command on node, in its own process group"""
+            start = time.time()
+            ec, out = run_noworries_group("%s %s '%s'" % (rsh, node, cmd),
+                                          started=lambda pid: self.probe_started(pid, states[node]))
+            res = self.parse_preflight(out)
+            res.update({'ec': ec, 'time': time.time() - start})
+            return res
+
+        start = time.time()
+        results = bounded_map(check, self.uniquenodes, workers=self.PREFLIGHT_WORKERS, timeout=timeout)
+        self.preflight_expired([x for x, res in zip(self.uniquenodes, results) if res is None], states)
+        localdevices = self._probe_device_paths()
+
+        self.preflight_results = {}
+        failed = []
+        template = "%-20s %-6s %8s %12s %12s %10s %10s  %s"
+        self.log.info(template % ('node', 'status', 'time', 'shm_free_kb', 'mem_kb', 'memlock', 'stack', 'problems'))
+        for node, res in zip(self.uniquenodes, results):
+            failures, warnings = self.evaluate_preflight(res, localdevices)
+            status = 'OK'
+            if failures:
+                status = 'FAIL'
+                failed.append(node)
+            elif warnings:
+                status = 'WARN'
+            self.preflight_results[node] = (status, failures + warnings, res)
+
+            if res is None:
+                res = {}
+            elapsed = '-'
+            if 'time' in res:
+                elapsed = "%.2f" % res['time']
+            self.log.info(template % (node, status, elapsed, res.get('shm_free_kb', '-'),
+                                      res.get('MemAvailable', res.get('MemFree', '-')), res.get('memlock', '-'),
+                                      res.get('stack', '-'), ', '.join(failures + warnings)))
+
+        self.log.info("preflight: checked %s nodes in %.2f seconds (budget %s seconds)" %
+                      (len(self.uniquenodes), time.time() - start, timeout))
+        if failed:
+            self.cleanup()
+            self.log.raiseException("preflight: %s nodes failed the preflight check: %s" %
+                                    (len(failed), ', '.join(failed)))
+
     def set_omp_threads(self):
         if 'OMP_NUM_THREADS' in os.environ:
             t = os.environ['OMP_NUM_THREADS']
@@ -379,7 +1140,7 @@ class MPI(object):
         setattr(self.options, 'qlogic_ipath', None)
 
         ipathpath = "/ipathfs/0"
-        if os.path.isdir(ipathpath):
+        if self.cached_probe('qlogic_ipath', lambda: os.path.isdir(ipathpath)):
             self.mpiexec_global_options['PSM_SHAREDCONTEXTS'] = '0'
             if self.options.debuglvl > 0:
                 self.mpiexec_global_options['PSM_TRACEMASK'] = '0x101'
@@ -394,11 +1155,13 @@ class MPI(object):
             Detect vSMP presence + set additional default variables
             - vsmpctl --features works
             -- newer releases it is vsmpctl --status
+            - only a working or a missing vsmpctl is cached, not a failing one
         """
         setattr(self.options, 'scalemp_vsmp', None)
 
         vsmpctl = "vsmpctl --status"
-        ec, out = run_simple_noworries(vsmpctl)
+        ec, out = self.cached_probe('scalemp_vsmp', lambda: run_simple_noworries(vsmpctl),
+                                    valid=lambda (ec, out): ec in (0, self.SHELL_CMD_NOT_FOUND_EXITCODE))
         if ec > 0:
             self.log.debug("scalemp_vsmp: vSMP not found (cmd %s ec %s output %s)" % (vsmpctl, ec, out))
             return
@@ -448,22 +1211,34 @@ class MPI(object):
             self.log.debug("set_device: device already set: %s" % self.device)
             return
 
+        device_paths = self.cached_probe('device_paths', self._probe_device_paths)
+
         founddev = None
         if getattr(self.options, 'rdma', None):
             founddev = 'ib'
             self.device = 'rdma'  # force it
             path = self.DEVICE_LOCATION_MAP[founddev]
-            if path is None or os.path.exists(path):
+            if device_paths[founddev]:
                 self.log.warning("Forcing device %s (founddevice %s), but path %s not found." %
                                  (self.device, founddev, path))
         elif getattr(self.options, 'socket', None):
             founddev = 'socket'
             self.device = self.DEVICE_MPIDEVICE_MAP[founddev]
             path = self.DEVICE_LOCATION_MAP[founddev]
-            if path is None or os.path.exists(path):
+            if device_paths[founddev]:
                 self.log.warning("Forcing device %s (founddevice %s), but path %s not found." %
                                  (self.device, founddev, path))
+        elif getattr(self.options, 'device', None):
+            founddev = self.options.device
+            if not founddev in self.DEVICE_ORDER:
+                self.log.raiseException("set_device: unknown device %s (supported: %s)" %
+                                        (founddev, ', '.join(self.DEVICE_ORDER)))
+            self.device = self.DEVICE_MPIDEVICE_MAP[founddev]
+            if not device_paths[founddev]:
+                self.log.warning("Forcing device %s (founddevice %s), but path %s not found." %
+                                 (self.device, founddev, self.DEVICE_LOCATION_MAP[founddev]))
         else:
+            candidates = []
             for dev in self.DEVICE_ORDER:
                 if dev in ('shm',):
                     # only for single node
@@ -471,11 +1246,15 @@ class MPI(object):
                         continue
 
                 path = self.DEVICE_LOCATION_MAP[dev]
-                if path is None or os.path.exists(path):
-                    founddev = dev
-                    self.device = self.DEVICE_MPIDEVICE_MAP[dev]
-                    self.log.debug("set_device: found path %s for device %s" % (path, self.device))
-                    break
+                if device_paths[dev]:
+                    self.log.debug("set_device: found path %s for device %s" % (path, dev))
+                    candidates.append(dev)
+
+            if candidates:
+                founddev = candidates[0]
+                if getattr(self.options, 'autodevice', False) and len(candidates) > 1:
+                    founddev = self.autodevice(candidates)
+                self.device = self.DEVICE_MPIDEVICE_MAP[founddev]
 
         if self.device is None:
             self.log.raiseException("set_device: failed to set device.")
@@ -484,6 +1263,112 @@ class MPI(object):
         self.log.debug("set_device: set netmasktype %s for device %s (founddev %s)" %
                        (self.netmasktype, self.device, founddev))
 
+    def autodevice(self, candidates):
+        """
+        Return the fastest working device of candidates, measured with a ping-pong between 2 ranks
+        on the first 2 nodes (or on this node). The result is cached per node pair, MPI flavour and set of
+        candidate devices in basepath (shared by all nodes), so later jobs don't have to probe again.
+        """
+        if self.uniquenodes is None:
+            self.get_unique_nodes()
+        nodepair = tuple(self.uniquenodes[:2])
+        key = (self.__class__.__name__, nodepair, tuple(candidates))
+
+        path = os.path.join(self.get_basepath(), '.mympirun', 'probecache')
+        cache = ProbeCache(path, key, ttl=self.AUTODEVICE_CACHE_TTL, maxentries=self.AUTODEVICE_CACHE_MAX_ENTRIES,
+                           refresh=getattr(self.options, 'refreshprobes', False), name=self.AUTODEVICE_CACHE_NAME)
+        founddev, results = cache.get('autodevice', lambda: self.probe_devices(candidates),
+                                      valid=lambda (dev, res): dev is not None)
+        cache.save()
+
+        if founddev is None:
+            founddev = candidates[0]
+            self.log.warning("autodevice: no working device found with ping-pong (results %s), using %s" %
+                             (results, founddev))
+        else:
+            self.log.info("autodevice: using device %s for nodes %s (bandwidth MB/s %s)" %
+                          (founddev, ', '.join(nodepair), results))
+        return founddev
+
+    def get_autodevice_cmd(self, dev):
+        """Return the command that runs the ping-pong between 2 ranks with device dev"""
+        mympirun = self.AUTODEVICE_MYMPIRUN_CMD
+        if self._mpiscriptname_for:
+            mympirun = self._mpiscriptname_for[0]
+
+        hybrid = 1
+        if self.nruniquenodes < 2:
+            hybrid = 2
+
+        cmd = [mympirun, '--device', dev, '--hybrid', str(hybrid), '--universe', '2',
+               '--basepath', self.get_basepath()]
+        if getattr(self, '_sched_for', None):
+            cmd += ['--schedtype', self._sched_for[0]]
+        cmd.append(self.AUTODEVICE_PINGPONG_CMD)
+        return " ".join(cmd)
+
+    def probe_devices(self, candidates):
+        """
+        Run the ping-pong for each candidate device (one after the other, each within AUTODEVICE_TIMEOUT)
+        in its own process group, that is killed when the timeout is reached
+            return tuple (fastest device or None, dict with bandwidth in MB/s per device; None if it failed)
+        """
+        reg = re.compile(r"^MYMPINGPONG\s+latency_us=(\S+)\s+bandwidth_MBs=(\S+)", re.M)
+
+        def probe(dev, state):
+            """Return the bandwidth measured with dev"""
+            cmd = self.get_autodevice_cmd(dev)
+            ec, out = run_noworries_group(cmd, started=lambda pid: self.probe_started(pid, state))
+            res = reg.search(out)
+            if ec > 0 or res is None:
+                self.log.debug("probe_devices: ping-pong with device %s failed (ec %s): %s" % (dev, ec, out))
+                return None
+            return float(res.group(2))
+
+        results = {}
+        founddev = None
+        for dev in candidates:
+            state = {'pid': None, 'expired': False}
+            results[dev] = bounded_map(lambda x: probe(x, state), [dev], workers=1,
+                                       timeout=self.AUTODEVICE_TIMEOUT)[0]
+            if results[dev] is None:
+                self.probe_expired(dev, state)
+            self.log.debug("probe_devices: device %s bandwidth %s MB/s" % (dev, results[dev]))
+            if results[dev] is not None and (founddev is None or results[dev] > results[founddev]):
+                founddev = dev
+
+        return founddev, results
+
+    def probe_started(self, pid, state):
+        """Record the pid of a started ping-pong; kill it right away when its probe already expired"""
+        state['pid'] = pid
+        if state['expired']:
+            kill_group(pid)
+
+    def probe_expired(self, dev, state):
+        """Kill the process group of the ping-pong with device dev, if it is still running"""
+        state['expired'] = True
+        pid = state['pid']
+        if pid is None or not group_alive(pid):
+            return
+        killed = kill_group(pid)
+        self.log.warning("probe_devices: ping-pong with device %s still running after %s seconds, killed %s processes" %
+                         (dev, self.AUTODEVICE_TIMEOUT, len(killed) + 1))
+        if not wait_group(pid, self.TEARDOWN_KILL_WAIT):
+            self.log.warning("probe_devices: ping-pong process group %s still running after SIGKILL" % pid)
+
+    def preflight_expired(self, nodes, states):
+        """Kill the process groups of the preflight checks of nodes that are still running (see probe_started)"""
+        killed = []
+        for node in nodes:
+            state = states[node]
+            state['expired'] = True
+            if state['pid'] is not None and group_alive(state['pid']):
+                kill_group(state['pid'])
+                killed.append(node)
+        if killed:
+            self.log.warning("preflight: killed the checks still running on nodes %s" % ', '.join(killed))
+
     def set_netmask(self):
         if self.netmasktype is None:
             self.set_device()
@@ -496,7 +1381,7 @@ class MPI(object):
                                     (self.netmasktype, device_ip_reg_map))
 
         cmd = "/sbin/ip addr show"
-        ec, out = run_simple(cmd)
+        ec, out = self.cached_probe('ip_addr_show', lambda: run_simple(cmd), valid=lambda (ec, out): ec == 0)
         if ec > 0:
             self.log.raiseException("set_netmask: failed to run cmd %s: %s" % (cmd, out))
 
@@ -518,11 +1403,9 @@ class MPI(object):
             self.netmask = ":".join(res)
 
     def make_mympirundir(self):
-        basepath = getattr(self.options, 'basepath', None)
-        if basepath is None:
-            basepath = os.environ['HOME']
-        if not os.path.exists(basepath):
-            self.log.raiseException("make_mympirun_dir: basepath %s should exist." % basepath)
+        if self.mympirundir is not None:
+            return
+        basepath = self.get_basepath()
 
         destdir = os.path.join(basepath, '.mympirun', "%s_%s" % (self.id, time.strftime("%Y%m%d_%H%M%S")))
         if not os.path.exists(destdir):
@@ -538,15 +1421,28 @@ class MPI(object):
         """Return ppn for universe"""
         return self.mpitotalppn
 
-    def make_node_file(self):
-        """Make the correct node list file"""
+    def nodes_interleaved(self, noderuns=None):
+        """
+        Return True if the ordered mpi nodes (or noderuns) interleave hosts
+        (ie a host has more than one run, eg due to random order), so one line per host is not possible
+        """
+        if noderuns is None:
+            noderuns = self.mpinoderuns
+        hosts = [host for host, _ in noderuns]
+        res = len(set(hosts)) < len(hosts)
+        self.log.debug("nodes_interleaved: %s (%s runs)" % (res, len(hosts)))
+        return res
+
+    def make_node_file(self, prefix=''):
+        """
+        Make the correct node list file
+            @param prefix: prefix for the filenames in mympirundir (eg for the farm tasks)
+        """
         self.make_mympirundir()
 
-        if self.mpinodes is None:
+        if self.mpinoderuns is None:
             self.make_node_list()
 
-        nodetxt = "\n".join(self.mpinodes + [''])
-
         mpdboottxt = ""
         for n in self.uniquenodes:
             txt = "%s" % n
@@ -558,19 +1454,133 @@ class MPI(object):
             mpdboottxt += "%s\n" % txt
 
         try:
-            nodefn = os.path.join(self.mympirundir, 'nodes')
-            file(nodefn, 'w').write(nodetxt)
+            nodefn = os.path.join(self.mympirundir, '%snodes' % prefix)
+            compact = self.write_node_file(nodefn, self.mpinoderuns)
             self.mpiexec_node_filename = nodefn
-            self.log.debug("make_node_file: wrote nodefile %s:\n%s" % (nodefn, nodetxt))
+            self.log.debug("make_node_file: wrote nodefile %s (compact %s) (host, count): %s" %
+                           (nodefn, compact, self.mpinoderuns))
+            if launch_profile.enabled:
+                launch_profile.add_bytes('nodefile', os.path.getsize(nodefn))
 
-            mpdfn = os.path.join(self.mympirundir, 'mpdboot')
+            mpdfn = os.path.join(self.mympirundir, '%smpdboot' % prefix)
             file(mpdfn, 'w').write(mpdboottxt)
             self.mpdboot_node_filename = mpdfn
             self.log.debug("make_node_file: wrote mpdbootfile %s:\n%s" % (mpdfn, mpdboottxt))
+            launch_profile.add_bytes('mpdbootfile', len(mpdboottxt))
         except Exception:
             self.log.raiseException('make_node_file: failed to write nodefile %s mpbboot nodefile %s' %
                                     (nodefn, mpdfn))
 
+    def write_node_file(self, filename, noderuns):
+        """
+        Write the nodefile filename for the run-length list of mpi nodes noderuns
+        (one line per host if possible, see NODEFILE_TEMPLATE_COMPACT), return True if compact
+        """
+        compact = self.NODEFILE_TEMPLATE_COMPACT is not None and not self.nodes_interleaved(noderuns)
+        # stream from the run-length representation
+        nodefh = open(filename, 'w')
+        try:
+            for host, count in noderuns:
+                if compact:
+                    nodefh.write("%s\n" % (self.NODEFILE_TEMPLATE_COMPACT % {'host': host, 'count': count}))
+                else:
+                    nodefh.write(("%s\n" % host) * count)
+        finally:
+            nodefh.close()
+        return compact
+
+    ### BEGIN MPMD ###
+    def make_mpmd(self):
+        """
+        Make the MPMD components (from the --mpmd file or the ':' separated command line)
+            - each component gets its dedicated nodes and its own nodefile in mympirundir
+            - the mpi nodes are the nodes of all components
+        """
+        if self.MPMD_SYNTAX is None:
+            self.log.raiseException("make_mpmd: MPMD not supported for %s" % self.__class__.__name__)
+
+        mpmdfile = getattr(self.options, 'mpmd', None)
+        try:
+            if mpmdfile is None:
+                components = split_components(self.cmdargs)
+            else:
+                components = parse_components_file(open(mpmdfile).read())
+        except (IOError, ValueError), err:
+            self.log.raiseException("make_mpmd: failed to get the MPMD components (file %s): %s" % (mpmdfile, err))
+
+        if self.mpinoderuns is None:
+            self.make_node_list()
+
+        def perhost(component):
+            """Number of processes per node of component"""
+            if component['hybrid'] is None:
+                return self.mpitotalppn
+            return component['hybrid']
+
+        try:
+            partition_nodes(self.uniquenodes, components, perhost)
+        except ValueError, err:
+            self.log.raiseException("make_mpmd: %s" % err)
+
+        self.make_mympirundir()
+        mpinoderuns = []
+        for idx, component in enumerate(components):
+            if component['omp'] is None and component['hybrid'] is not None:
+                component['omp'] = max(self.ppn // component['hybrid'], 1)
+
+            component['nodefile'] = os.path.join(self.mympirundir, "mpmd_%s_nodes" % idx)
+            try:
+                self.write_node_file(component['nodefile'], component['runs'])
+            except IOError, err:
+                self.log.raiseException("make_mpmd: failed to write nodefile %s: %s" % (component['nodefile'], err))
+            mpinoderuns += component['runs']
+
+            self.log.info("make_mpmd: component %s: %s processes on %s nodes (omp %s): %s" %
+                          (idx, component['np'], len(component['hosts']), component['omp'],
+                           " ".join(component['cmdargs'])))
+
+        self.mpinoderuns = mpinoderuns
+        self.mpmd_components = components
+
+    def make_mpmd_sections(self):
+        """
+        Return the MPMD part of the mpirun command: per component the section(s) with the number of processes,
+        nodes, OMP_NUM_THREADS and the command (with its own pinning wrapper)
+        """
+        sections = []
+        mpinoderuns = self.mpinoderuns
+        try:
+            for idx, component in enumerate(self.mpmd_components):
+                # the pinning override maps of the component
+                self.mpinoderuns = component['runs']
+                exe = " ".join(self.make_exe_cmd(component['cmdargs'], prefix="mpmd_%s_" % idx))
+
+                env = ''
+                if component['omp'] is not None:
+                    env = self.MPMD_TEMPLATE_ENV % {'name': 'OMP_NUM_THREADS', 'value': component['omp']}
+
+                if self.MPMD_SECTION_PER_HOST:
+                    runs = component['runs']
+                else:
+                    runs = [(None, component['np'])]
+                for host, count in runs:
+                    section = self.MPMD_TEMPLATE_SECTION % {'np': count, 'host': host,
+                                                            'nodefile': component['nodefile']}
+                    sections.append(" ".join([x for x in (section, env, exe) if x]))
+        finally:
+            self.mpinoderuns = mpinoderuns
+
+        if self.MPMD_SYNTAX == 'configfile':
+            configfile = os.path.join(self.mympirundir, 'mpmd_configfile')
+            try:
+                open(configfile, 'w').write("\n".join(sections + ['']))
+            except IOError, err:
+                self.log.raiseException("make_mpmd_sections: failed to write configfile %s: %s" % (configfile, err))
+            self.log.debug("make_mpmd_sections: wrote configfile %s: %s" % (configfile, sections))
+            return ["-configfile %s" % configfile]
+
+        return [(" %s " % MPMD_SEPARATOR).join(sections)]
+
     ### BEGIN pinning ###
     def _pin_flavour(self, mp=None):
         return mp
@@ -593,6 +1603,14 @@ class MPI(object):
                 # always pin!
                 self.options.pinmpi = True
 
+        if getattr(self.options, 'farm', None) is not None:
+            # farm tasks share nodes, and each MPI run would pin its processes starting from the first core
+            if self.pinning_override_type is not None:
+                self.log.warning("set_pinning: pinning override %s not supported with farm, disabling it" %
+                                 self.pinning_override_type)
+                self.pinning_override_type = None
+            self.options.pinmpi = False
+
         if self.pinning_override_type is not None:
             self.log.debug("set_pinning: previous pinning %s;  will be overwritten, pinning_override_type set to %s" %
                            (self.options.pinmpi, self.pinning_override_type))
@@ -616,7 +1634,7 @@ class MPI(object):
         """
         self.log.raiseException("get_pinning_override_variable: not implemented.")
 
-    def pinning_override(self):
+    def pinning_override(self, prefix=''):
         """
         Create own pinning
         - using taskset or numactl?
@@ -629,15 +1647,18 @@ class MPI(object):
 
         Do we assume heterogenous nodes (ie same cpu layuout as current node?)
         - yes
-        -- reality NO: different cpusets!
+        -- but not the same cpusets: these are probed per node, the wrapper looks up the map of its host
 
         What do we support?
          - packed/compact : all together, ranks close to each other
-         - spread: as far away as possible from each other
+         - spread: as far away as possible from each other (over sockets/caches, no hyperthread siblings first)
+         - cycle: like compact, wraps around (eg more ranks than cores)
          - explicit map: TODO
 
         Option:
          - threaded (default yes): eg in hybrid, pin on all available cores or just one
+         - one rank per physical core (overridepinphyscore)
+         - bind memory to the local NUMA node(s) (overridepinmembind)
 
         When in this mode, one needs to disable default/native pinning
 
@@ -660,81 +1681,60 @@ class MPI(object):
 
         rankname = 'MYMPIRUN_LOCALRANK'
         rankmapname = 'MYMPIRUN_LOCALRANK_MAP'
+        memmapname = 'MYMPIRUN_LOCALRANK_MEMMAP'
 
         wrappertxt = "#!/bin/bash\n%s=%s\n" % (rankname, variableexpression)
 
-        # number of local processors
-        # - eg nuamctl -s grep physcpubind
-        if not self.ppn == self.foundppn:
-            self.log.raiseException(("pinning_override: number of found procs %s is different from "
-                                     "requested ppn %s. Not yet supported.") % (self.foundppn, self.ppn))
-
         override_type = self.pinning_override_type
         multithread = True
         if override_type.endswith('pin'):
             override_type = override_type[:-3]
             multithread = False
-        self.log.debug("pinning_override: type %s multithread %s" % (override_type, multithread))
+        physcore = getattr(self.options, 'overridepinphyscore', False)
+        membind = getattr(self.options, 'overridepinmembind', False)
+        self.log.debug("pinning_override: type %s multithread %s physcore %s membind %s" %
+                       (override_type, multithread, physcore, membind))
 
-        """
-        The whole method is very primitive
-        - assume cpu layout on OS is correct wrt numbering
+        if not override_type in PINNING_POLICIES:
+            self.log.raiseException("pinning_override: unsupported pinning_override_type  %s" %
+                                    self.pinning_override_type)
 
-        What about pinned threads of threaded apps?
-        - eg use likwid to pin those threads too.
-        """
+        groups = self.pinning_override_maps(override_type, multithread, physcore)
 
-        # cores per process
-        corespp = self.foundppn // self.mpitotalppn
-        corespp_rest = self.foundppn % self.mpitotalppn
-        if (corespp < 1) or (self.mpitotalppn == self.foundppn):
-            multi = False
-            self.log.debug(("pinning_override: exactly one or more processes %s then cores %s. "
-                            "No multithreading.") % (self.mpitotalppn, self.foundppn))
-        if corespp_rest > 0:
-            self.log.debug(("pinning_override: total number of mpiprocesses %s no exact multiple of "
-                            "number of procs %s. Ignoring rest.") % (self.mpitotalppn, self.foundppn))
-
-        map_func = None
-        if override_type in ('packed', 'compact',):
-            if multi:
-                # consecutive domains
-                map_func = lambda x: "%s-%s" % (x * corespp, (x + 1) * corespp - 1)
-            else:
-                # consecutive cores
-                map_func = lambda x: "%s" % x
-        elif override_type in ('cycle',):
-            # eg double with GAMESS
-            if multi:
-                # what is this?
-                self.log.raiseException("pinning_override: cycle type with multiple cores?")
-            else:
-                map_func = lambda x: "%s" % (x % self.foundppn)
-        elif override_type in ('spread',):
-            if multi:
-                # spread domains
-                map_func = lambda x: "%s-%s" % (x * corespp, (x + 1) * corespp - 1)
-            else:
-                # spread cores
-                map_func = lambda x: "%s" % (x * corespp)
+        def maptxt(rankmap, memmap, indent=''):
+            txt = "%s%s=(%s)\n" % (indent, rankmapname, ' '.join(rankmap))
+            if membind:
+                txt += "%s%s=(%s)\n" % (indent, memmapname, ' '.join(memmap))
+            return txt
 
+        # each node looks up its own maps; the largest group is the default
+        if len(groups) == 1:
+            wrappertxt += maptxt(groups[0][1], groups[0][2])
         else:
-            self.log.raiseException("pinning_override: unsupported pinning_override_type  %s" %
-                                    self.pinning_override_type)
-
-        rankmap = [map_func(x) for x in range(self.mpitotalppn)]
+            wrappertxt += 'case "$(hostname)" in\n'
+            for hostnames, rankmap, memmap in groups[1:]:
+                wrappertxt += "    %s)\n%s        ;;\n" % ('|'.join(hostnames), maptxt(rankmap, memmap, ' ' * 8))
+            wrappertxt += "    *)\n%s        ;;\nesac\n" % maptxt(groups[0][1], groups[0][2], ' ' * 8)
 
-        wrappertxt += "%s=(%s)\n" % (rankmapname, ' '.join(rankmap))
+        # the rank can be the global rank
+        rankindex = "$((%s %% ${#%s[@]}))" % (rankname, rankmapname)
 
         pinning_exe = which(self.PINNING_OVERRIDE_METHOD)
         if not pinning_exe:
             self.log.raiseException("pinning_override: can't find execuatble %s" % self.PINNING_OVERRIDE_METHOD)
 
         if self.PINNING_OVERRIDE_METHOD in ('numactl',):
-            pinning_exe += ' --physcpubind="${%s[$%s]}"' % (rankmapname, rankname)
-
-        wrappertxt += "%s $@" % pinning_exe
-        wrapperpath = os.path.join(self.jobdir, 'pinning_override_wrapper.sh')
+            pinning_exe += ' --physcpubind="${%s[%s]}"' % (rankmapname, rankindex)
+            if membind:
+                pinning_exe += ' --membind="${%s[%s]}"' % (memmapname, rankindex)
+        elif self.PINNING_OVERRIDE_METHOD in ('taskset',):
+            pinning_exe += ' -c "${%s[%s]}"' % (rankmapname, rankindex)
+            if membind:
+                self.log.warning("pinning_override: memory binding not supported with %s" %
+                                 self.PINNING_OVERRIDE_METHOD)
+
+        wrappertxt += '%s "$@"\n' % pinning_exe
+        wrapperpath = os.path.join(self.mympirundir, '%spinning_override_wrapper.sh' % prefix)
         try:
             open(wrapperpath, 'w').write(wrappertxt)
             os.chmod(wrapperpath, stat.S_IRWXU)
@@ -746,6 +1746,116 @@ class MPI(object):
 
         return wrapperpath
 
+    def accounting_wrapper(self, prefix=''):
+        """
+        Create the accounting wrapper (like the pinning wrapper): it starts the rank through vsc.mympirun.accounting,
+        which writes the resource usage record of the rank in the records directory in mympirundir
+            @param prefix: prefix for the filenames in mympirundir (eg for the farm tasks)
+        """
+        recorddir = os.path.join(self.mympirundir, '%saccounting' % prefix)
+        wrapperpath = os.path.join(self.mympirundir, '%saccounting_wrapper.sh' % prefix)
+        wrappertxt = "#!/bin/bash\nexec %s \"$@\"\n" % ' '.join(get_wrapper_cmd(recorddir))
+        try:
+            if os.path.isdir(recorddir):
+                # eg the records of a failed attempt with --resilient
+                shutil.rmtree(recorddir)
+            os.mkdir(recorddir)
+            open(wrapperpath, 'w').write(wrappertxt)
+            os.chmod(wrapperpath, stat.S_IRWXU)
+            self.log.debug("accounting_wrapper: wrote wrapper file %s:\n%s" % (wrapperpath, wrappertxt))
+        except (IOError, OSError), err:
+            self.log.raiseException("accounting_wrapper: failed to write wrapper file %s: %s" % (wrapperpath, err))
+
+        if not recorddir in self.accounting_dirs:
+            self.accounting_dirs.append(recorddir)
+        return wrapperpath
+
+    def accounting_summary(self):
+        """Merge the accounting records in one summary, log it and write it with the records to the accounting file"""
+        records = []
+        for recorddir in self.accounting_dirs:
+            records += read_records(recorddir)
+        self.accounting_dirs = []
+        if not records:
+            self.log.warning("accounting_summary: no accounting records found")
+            return
+
+        lines = format_summary(summarize(records))
+        for line in lines:
+            self.log.info("accounting_summary: %s" % line)
+
+        fn = self.options.accounting
+        try:
+            fh = open(fn, 'w')
+            fh.write(''.join(["# %s\n" % x for x in lines]))
+            fh.write("# %s\n" % ' '.join([name for name, _ in RECORD_FIELDS]))
+            fh.write(''.join([format_record(x) for x in records]))
+            fh.close()
+            self.log.debug("accounting_summary: wrote %s records to %s" % (len(records), fn))
+        except IOError, err:
+            self.log.warning("accounting_summary: failed to write accounting file %s: %s" % (fn, err))
+
+    def pinning_override_maps(self, override_type, multithread, physcore):
+        """
+        Return list of (hostnames, cpu map, memory node map) per group of nodes with the same cpuset
+        and number of local ranks, the default group first.
+            - the maps have one comma-separated list per local rank
+            - the allowed cpus and memory nodes of each node are probed (see get_node_cpusets)
+            - the default group is the one with the nodes that could not be probed (their hostname is unknown),
+              otherwise the largest group
+
+        Assume all nodes have the same topology as the current node
+        - cpus, cores, sockets and NUMA nodes are read from sysfs
+
+        What about pinned threads of threaded apps?
+        - eg use likwid to pin those threads too.
+        """
+        ranks = {}
+        if self.mpinoderuns is not None:
+            for host, count in self.mpinoderuns:
+                ranks[host] = ranks.get(host, 0) + count
+
+        groups = {}
+        for node, (hostname, cpus, mems) in self.get_node_cpusets().items():
+            key = (tuple(cpus), tuple(mems), ranks.get(node, self.mpitotalppn))
+            groups.setdefault(key, []).append(hostname)
+
+        res = []
+        for (cpus, mems, nranks), allhostnames in groups.items():
+            hostnames = [x for x in allhostnames if x is not None]
+            unknown = len(allhostnames) - len(hostnames)
+            topology = Topology(cpus=cpus, sysfs=self.SYSFS_SYSTEM)
+            if not topology.cpus == list(cpus):
+                self.log.warning(("pinning_override_maps: cpus %s of nodes %s not all found on local node, "
+                                  "using %s") % (cpus, hostnames, topology.cpus))
+            nrunits = len(topology.units(physcore=physcore))
+
+            # units per process
+            domain = 1
+            if multithread:
+                domain = max(nrunits // nranks, 1)
+            if nrunits % nranks > 0 and nranks < nrunits:
+                self.log.debug(("pinning_override_maps: number of local processes %s no exact multiple of "
+                                "number of units %s. Ignoring rest.") % (nranks, nrunits))
+
+            cpumap = topology.rank_map(override_type, nranks, domain=domain, physcore=physcore)
+            memmap = []
+            for rankcpus in cpumap:
+                nodes = [x for x in topology.numa_nodes(rankcpus) if len(mems) == 0 or x in mems]
+                if len(nodes) == 0:
+                    nodes = list(mems)
+                memmap.append(make_cpulist(nodes))
+
+            res.append(((unknown, len(hostnames)), hostnames, [make_cpulist(x) for x in cpumap], memmap))
+
+        res.sort(key=lambda x: x[0], reverse=True)
+        for (unknown, _), hostnames, _, _ in res[1:]:
+            if unknown > 0:
+                self.log.warning(("pinning_override_maps: %s nodes with unknown hostname can't use the maps "
+                                  "of the group with nodes %s, they use the default maps") % (unknown, hostnames))
+        self.log.debug("pinning_override_maps: found %s groups: %s" % (len(res), res))
+        return [res[0][1:]] + [x[1:] for x in res[1:] if len(x[1]) > 0]
+
     ### BEGIN mpdboot ###
     def make_mpdboot(self):
         """Make the mpdboot configuration"""
@@ -761,9 +1871,9 @@ class MPI(object):
             # set correct permissions on this file.
             os.chmod(mpdconffn, 0400)
 
-        self.mpdboot_set_localhost_interface()
+        launch_profile.phase('mpdboot_set_localhost_interface', self.mpdboot_set_localhost_interface)
 
-        self.make_mpdboot_options()
+        launch_profile.phase('make_mpdboot_options', self.make_mpdboot_options)
 
         self.log.debug("make_mpdboot set options %s" % self.mpdboot_options)
 
@@ -793,9 +1903,134 @@ class MPI(object):
         if self.options.mpdbootverbose:
             self.mpdboot_options.append("--verbose")
 
-        # mpdboot rsh command
+        # mpdboot rsh command and launch tree
         if not self.HYDRA:
-            self.mpdboot_options.append(self.MPDBOOT_TEMPLATE_REMOTE_OPTION_NAME % {'rsh': self.get_rsh()})
+            rsh = self.get_rsh()
+            self.setup_rsh(rsh)
+            self.mpdboot_options.append(self.MPDBOOT_TEMPLATE_REMOTE_OPTION_NAME % {'rsh': rsh})
+
+            fanout = self.get_launch_fanout()
+            if fanout is not None:
+                self.mpdboot_options.append(self.MPDBOOT_TEMPLATE_FANOUT_OPTION_NAME % {'fanout': fanout})
+
+    def setup_rsh(self, rsh):
+        """Configure the remote shell rsh if it is one of the mympirun agents (sshtree, rshagent)"""
+        if rsh == self.SSHTREE_CMD:
+            self.make_sshtree()
+        elif rsh == self.RSHAGENT_CMD:
+            self.make_rshagent()
+
+    def make_rshagent(self):
+        """Configure the rshagent (see vsc.mympirun.rshagent): per job state directory under the basepath"""
+        statedir = os.path.join(self.get_basepath(), '.mympirun', "rshagent_%s" % self.id)
+        self._setenv("%sDIR" % RSHAGENT_ENVIRONMENT_PREFIX, statedir)
+        self.log.debug("make_rshagent: rshagent state directory %s" % statedir)
+
+    def get_launch_fanout(self):
+        """
+        Return the fan-out of the launch tree (each reached node starts the remote shells of its children):
+        the sshtreefanout option, LAUNCH_TREE_FANOUT for large jobs, None (the launcher default) otherwise
+        """
+        fanout = getattr(self.options, 'sshtreefanout', None)
+        if fanout is None and self.is_large():
+            fanout = self.LAUNCH_TREE_FANOUT
+        self.log.debug("get_launch_fanout: %s" % fanout)
+        return fanout
+
+    def make_sshtree(self):
+        """Configure the sshtree launch agent (see vsc.mympirun.sshtree) through its environment"""
+        config = {
+            'ID': os.path.basename(self.mympirundir),
+            'CONCURRENCY': getattr(self.options, 'sshtreeconcurrency', None),
+            'RETRIES': getattr(self.options, 'sshtreeretries', None),
+        }
+        for name, value in config.items():
+            if value is not None:
+                self._setenv("%s%s" % (SSHTREE_ENVIRONMENT_PREFIX, name), value)
+        self.log.debug("make_sshtree: sshtree configured with %s" % config)
+
+    def get_mpdring_dir(self):
+        """Return the per job directory of the persistent mpd ring"""
+        return os.path.join(self.get_basepath(), '.mympirun', "mpdring_%s" % self.id)
+
+    def mpdring_start(self):
+        """
+        Use the persistent mpd ring of the job: reuse the ring if it is healthy, boot it otherwise
+            - the ring is torn down by its watchdog at the end of the job or after mpdringidle seconds without use
+            - sets self.mpdring, the mpirun command uses mpiexec without mpdboot
+        """
+        if not self.MPDRING_SUPPORTED:
+            self.log.warning("mpdring_start: no persistent mpd ring for %s, booting the ring as usual" %
+                             self.__class__.__name__)
+            return
+
+        # the mpd console of the ring is per job
+        self._setenv('MPD_CON_EXT', self.id)
+
+        ring = MpdRing(self.get_mpdring_dir())
+        start = time.time()
+        ring.lock()
+        try:
+            state = ring.read_state()
+            if state is not None and not self.mpdring_healthy(state):
+                self.log.warning("mpdring_start: persistent mpd ring %s is not healthy, booting a new one" % state)
+                run_simple_noworries(self.MPDRING_STOP_CMD)
+                ring.clear_state()
+                state = None
+
+            if state is None:
+                cmd = "%s %s" % (self.MPDRING_BOOT_CMD, ' '.join(self.mpdboot_options))
+                ec, out = run_simple(cmd)
+                if ec > 0:
+                    self.log.raiseException("mpdring_start: mpdboot failed (ec %s): cmd %s, output %s" %
+                                            (ec, cmd, out))
+                ec, out = run_simple_noworries(self.MPDRING_CHECK_CMD)
+                trace = parse_mpdtrace(out)
+                if ec > 0 or len(trace) == 0:
+                    self.log.raiseException("mpdring_start: no mpds found after mpdboot (ec %s): %s" % (ec, out))
+
+                launch_profile.add_subprocess()
+                watchdog = ring.start_watchdog(self.get_job_pid(), self.options.mpdringidle, self.MPDRING_STOP_CMD)
+                ring.write_state(self.id, self.uniquenodes, trace[0][1], watchdog)
+                self.log.info("mpdring_start: booted persistent mpd ring with %s mpds (port %s) in %.2f seconds" %
+                              (len(trace), trace[0][1], time.time() - start))
+            else:
+                self.log.info("mpdring_start: reusing persistent mpd ring with %s mpds (port %s), checked in "
+                              "%.2f seconds" % (len(state['hosts']), state['port'], time.time() - start))
+
+            ring.register()
+        finally:
+            ring.unlock()
+
+        self.mpdring = ring
+
+    def get_job_pid(self):
+        """
+        Return the pid of the process the persistent mpd ring is tied to: the session leader (eg the job script),
+        not the parent (that can be a shell or wrapper that exits before the end of the job)
+            - the parent if mympirun is the session leader itself
+        """
+        pid = os.getsid(0)
+        if pid == os.getpid():
+            pid = os.getppid()
+        self.log.debug("get_job_pid: persistent mpd ring tied to pid %s" % pid)
+        return pid
+
+    def mpdring_healthy(self, state):
+        """Return True if the ring with state is usable: same job and nodes, all mpds in the ring"""
+        if not state.get('jobid') == self.id or not state['hosts'] == self.uniquenodes:
+            self.log.debug("mpdring_healthy: ring for job %s hosts %s, not for %s" %
+                           (state.get('jobid'), state['hosts'], self.uniquenodes))
+            return False
+        if not pid_alive(state['watchdog']):
+            self.log.debug("mpdring_healthy: watchdog %s of the ring is gone" % state['watchdog'])
+            return False
+
+        ec, out = run_simple_noworries(self.MPDRING_CHECK_CMD)
+        trace = parse_mpdtrace(out)
+        res = ec == 0 and len(trace) == len(state['hosts']) and trace[0][1] == state['port']
+        self.log.debug("mpdring_healthy: %s (ec %s, mpds %s)" % (res, ec, trace))
+        return res
 
     def mpdboot_set_localhost_interface(self):
         """
@@ -835,8 +2070,12 @@ class MPI(object):
         self.mpiexec_options += self.mpiexec_get_global_options()
 
         # number of procs to start
-        if self.options.universe is not None and self.options.universe > 0:
+        if self.mpmd_components is not None:
+            self.log.debug("make_mpiexec_options: number of processes set per MPMD component")
+        elif self.options.universe is not None and self.options.universe > 0:
             self.mpiexec_options.append("-np %s" % self.options.universe)
+        elif self.mpiexec_np is not None:
+            self.mpiexec_options.append("-np %s" % self.mpiexec_np)
         else:
             self.mpiexec_options.append("-np %s" % (self.mpitotalppn * self.nruniquenodes))
 
@@ -846,12 +2085,21 @@ class MPI(object):
         # pass local env variables
         self.mpiexec_options += self.mpiexec_get_local_pass_variable_options()
 
+        if self.output_split is not None:
+            if self.OUTPUT_RANK_PREFIX_OPTION is None:
+                self.log.raiseException("make_mpiexec_options: no rank prefix for the output split with %s" %
+                                        self.__class__.__name__)
+            self.mpiexec_options.append(self.OUTPUT_RANK_PREFIX_OPTION)
+
     def make_mpiexec_hydra_options(self):
         """Hydra specific mpiexec options"""
-        self.get_hydra_info()
+        launch_profile.phase('get_hydra_info', self.get_hydra_info)
         self.mpiexec_options.append("-f %s" % self.mpiexec_node_filename)
-        if self.options.branchcount is not None:
-            self.mpiexec_options.append("--branch-count %d" % self.options.branchcount)
+        branchcount = self.options.branchcount
+        if branchcount is None:
+            branchcount = self.get_launch_fanout()
+        if branchcount is not None:
+            self.mpiexec_options.append("--branch-count %d" % branchcount)
 
         # default launcher seems ssh
         if getattr(self, 'HYDRA_RMK', None) is not None:
@@ -877,6 +2125,11 @@ class MPI(object):
                 launcher_exec = self.get_rsh()
             else:
                 self.mpiexec_options.append("-%s %s" % (self.HYDRA_LAUNCHER_NAME, launcher[0]))
+                if launcher_exec is None and getattr(self.options, 'ssh', False):
+                    # safe ssh mode, eg sshtree for large jobs
+                    launcher_exec = self.get_rsh()
+
+            self.setup_rsh(launcher_exec)
 
             if launcher_exec is not None:
                 self.log.debug("make_mpiexec_hydra_options: HYDRA using launcher exec %s" % launcher_exec)
@@ -887,7 +2140,7 @@ class MPI(object):
         reg_hydra_info = re.compile(r"^\s+(?P<key>\S[^:\n]*)\s*:(?P<value>.*?)\s*$", re.M)
 
         cmd = "mpirun -info"
-        ec, out = run_simple(cmd)
+        ec, out = self.cached_probe('hydra_info', lambda: run_simple(cmd), valid=lambda (ec, out): ec == 0)
         if ec > 0:
             self.log.raiseException("get_hydra_info: failed to run cmd %s: %s" % (cmd, out))
 
@@ -930,8 +2183,11 @@ class MPI(object):
         self.mpiexec_global_options['MKL_NUM_THREADS'] = '1'
 
         if not self.options.noenvmodules:
-            for env_var in self.GLOBAL_VARIABLES_ENVIRONMENT_MODULES:
-                if env_var in os.environ and not env_var in self.mpiexec_global_options:
+            env_vars = [x for x in self.GLOBAL_VARIABLES_ENVIRONMENT_MODULES if x in os.environ]
+            if getattr(self.options, 'skiploginvariables', False):
+                env_vars = self.drop_login_variables(env_vars)
+            for env_var in env_vars:
+                if not env_var in self.mpiexec_global_options:
                     self.mpiexec_global_options[env_var] = os.environ[env_var]
 
     def mpiexec_set_local_options(self):
@@ -948,8 +2204,9 @@ class MPI(object):
         """
         global_options = []
 
+        pass_environment = set(self.mpiexec_pass_environment)
         for k, v in self.mpiexec_global_options.items():
-            if k in self.mpiexec_pass_environment:
+            if k in pass_environment:
                 self.log.debug("mpiexec_get_global_options: found global option %s in mpiexec_pass_environment." % k)
             else:
                 global_options.append(self.MPIEXEC_TEMPLATE_GOBAL_OPTION % {'name': k, "value": v})
@@ -963,8 +2220,9 @@ class MPI(object):
             allow overwriting through environment
         """
         local_options = []
+        pass_environment = set(self.mpiexec_pass_environment)
         for k, v in self.mpiexec_local_options.items():
-            if k in self.mpiexec_pass_environment:
+            if k in pass_environment:
                 self.log.debug("mpiexec_get_local_options: found local option %s in mpiexec_pass_environment." % k)
             else:
                 local_options.append(self.MPIEXEC_TEMPLATE_LOCAL_OPTION % {'name': k, "value": v})
@@ -979,7 +2237,9 @@ class MPI(object):
         self.log.debug("mpiexec_get_local_pass_variable_options: variables (and current value) to pass: %s" %
                        ([[x, os.environ[x]] for x in self.mpiexec_pass_environment]))
 
-        if '%(commaseparated)s' in self.MPIEXEC_TEMPLATE_PASS_VARIABLE_OPTION:
+        if len(self.mpiexec_pass_environment) == 0:
+            local_pass_options = []
+        elif '%(commaseparated)s' in self.MPIEXEC_TEMPLATE_PASS_VARIABLE_OPTION:
             self.log.debug("mpiexec_get_local_pass_variable_options: found commaseparated in template.")
             local_pass_options = [self.MPIEXEC_TEMPLATE_PASS_VARIABLE_OPTION %
                                   {'commaseparated': ','.join(self.mpiexec_pass_environment)}]
@@ -991,38 +2251,175 @@ class MPI(object):
                        (self.MPIEXEC_TEMPLATE_PASS_VARIABLE_OPTION, local_pass_options))
         return local_pass_options
 
+    def envfile_variable(self, name):
+        """Return True if variable name can be passed with the env file"""
+        for prefix in self.ENVFILE_COMMANDLINE_PREFIXES:
+            if name == prefix or name.startswith(prefix):
+                return False
+        return True
+
+    def make_envfile(self):
+        """
+        Move the global options and pass variables to the env file in mympirundir and write the loader
+        that sources it before starting the executable.
+        Local options (that can differ per executable) and the ENVFILE_COMMANDLINE_PREFIXES variables stay
+        on the mpiexec command line.
+        """
+        if not self.ENVFILE_SUPPORTED:
+            self.log.debug("make_envfile: env file not supported by %s" % self.__class__.__name__)
+            return
+
+        if self.ENVFILE_GLOBAL_OPTIONS:
+            pass_environment = set(self.mpiexec_pass_environment)
+            for name, value in self.mpiexec_global_options.items():
+                if self.envfile_variable(name) and not name in pass_environment:
+                    self.envfile_environment[name] = value
+                    del self.mpiexec_global_options[name]
+
+        for name in self.mpiexec_pass_environment[:]:
+            if self.envfile_variable(name) and name in os.environ:
+                self.envfile_environment[name] = os.environ[name]
+                self.mpiexec_pass_environment.remove(name)
+
+        self.make_mympirundir()
+        envfile = os.path.join(self.mympirundir, 'environment')
+        names = self.envfile_environment.keys()
+        names.sort()
+        envtxt = ''.join(["export %s='%s'\n" % (name, str(self.envfile_environment[name]).replace("'", "'\\''"))
+                          for name in names])
+        loader = os.path.join(self.mympirundir, 'envfile_loader.sh')
+        loadertxt = "#!/bin/bash\n. %s\nexec \"$@\"\n" % envfile
+        try:
+            open(envfile, 'w').write(envtxt)
+            open(loader, 'w').write(loadertxt)
+            os.chmod(loader, stat.S_IRWXU)
+        except:
+            self.log.raiseException("make_envfile: failed to write env file %s or loader %s" % (envfile, loader))
+
+        launch_profile.add_bytes('envfile', len(envtxt))
+        self.envfile_loader = loader
+        self.log.debug("make_envfile: wrote %s variables to env file %s (%s bytes), loader %s" %
+                       (len(names), envfile, len(envtxt), loader))
+
     ### BEGIN mpirun ###
     def make_mpirun(self):
         """Make the mpirun command (or whatever). It typically consists of a mpdboot and a mpiexec part"""
 
-        self.mpirun_cmd = ['mpirun']
+        if self.mpdring is None:
+            self.mpirun_cmd = ['mpirun']
+        else:
+            # the mpds are running
+            self.mpirun_cmd = ['mpiexec']
 
         self._make_final_mpirun_cmd()
         if self.options.mpirunoptions is not None:
             self.log.debug("make_mpirun: added user provided options %s" % self.options.mpirunoptions)
             self.mpirun_cmd.append(self.options.mpirunoptions)
 
+        if self.mpmd_components is None:
+            self.mpirun_cmd += self.make_exe_cmd(self.cmdargs)
+        else:
+            self.mpirun_cmd += self.make_mpmd_sections()
+
+    def make_exe_cmd(self, cmdargs, prefix=''):
+        """
+        Return the list with the env file loader, pinning wrapper and quoted cmdargs to start
+            @param prefix: prefix for the pinning wrapper filename
+        """
+        res = []
+        if self.envfile_loader is not None:
+            res.append(self.envfile_loader)
+
+        # before the pinning wrapper, so only the rank is pinned
+        if getattr(self.options, 'accounting', None) is not None:
+            res.append(self.accounting_wrapper(prefix=prefix))
+
         if self.pinning_override_type is not None:
-            p_o = self.pinning_override()
+            p_o = self.pinning_override(prefix=prefix)
             if p_o is None or not os.path.isfile(p_o):
-                self.log.raiseException("make_mpirun: no valid pinning_overrride %s (see previous errors)" % p_o)
+                self.log.raiseException("make_exe_cmd: no valid pinning_overrride %s (see previous errors)" % p_o)
             else:
-                self.mpirun_cmd += [p_o]
+                res.append(p_o)
 
         # the executable
         # use undocumented subprocess API call to quote whitespace (executed with Popen(shell=True))
         # (see http://stackoverflow.com/questions/4748344/whats-the-reverse-of-shlex-split for alternatives if needed)
-        quoted_args_string = subprocess.list2cmdline(self.cmdargs)
-        self.log.debug("make_mpirun: adding cmdargs %s (quoted %s)" % (self.cmdargs, quoted_args_string))
-        self.mpirun_cmd.append(quoted_args_string)
+        quoted_args_string = subprocess.list2cmdline(cmdargs)
+        self.log.debug("make_exe_cmd: adding cmdargs %s (quoted %s)" % (cmdargs, quoted_args_string))
+        res.append(quoted_args_string)
+        return res
 
     def _make_final_mpirun_cmd(self):
         """Create the acual mpirun command
             add it to self.mpirun_cmd
         """
-        self.mpirun_cmd += self.mpdboot_options
+        if self.mpdring is None:
+            self.mpirun_cmd += self.mpdboot_options
         self.mpirun_cmd += self.mpiexec_options
 
+    ### BEGIN farm ###
+    def farm(self):
+        """
+        Run the tasks of the farm file concurrently in the mpi slots of the allocation (see vsc.mympirun.farm)
+            - each task gets its own nodefile in mympirundir and output file <tasks file>.<index>.out
+              in the current directory
+            - logs the runtime and exitcode per task, sets self.farm_results
+            - returns the number of failed tasks
+        """
+        tasksfile = self.options.farm
+        try:
+            tasks = parse_tasks(open(tasksfile).read())
+        except (IOError, ValueError), err:
+            self.log.raiseException("farm: failed to read tasks file %s: %s" % (tasksfile, err))
+
+        def outputs(idx):
+            return os.path.join(os.getcwd(), "%s.%s.out" % (os.path.basename(tasksfile), idx))
+
+        pool = SlotPool(self.mpinoderuns)
+        self.log.info("farm: running %s tasks in %s slots on %s nodes" % (len(tasks), pool.total, len(pool.hosts)))
+
+        # the per task commands are made by changing the node related attributes
+        saved = dict([(x, getattr(self, x)) for x in self.FARM_TASK_ATTRIBUTES])
+        start = time.time()
+        try:
+            self.farm_results = TaskFarm(tasks, pool, self.make_farm_task_cmd, outputs).run()
+        finally:
+            for name, value in saved.items():
+                setattr(self, name, value)
+
+        failed = 0
+        template = "%6s %6s %10s %6s  %s"
+        self.log.info(template % ('task', 'np', 'time', 'ec', 'nodes'))
+        for idx, ((np, _), res) in enumerate(zip(tasks, self.farm_results)):
+            if res is None:
+                failed += 1
+                self.log.info(template % (idx, np, '-', '-', 'not started'))
+                continue
+            if not res['ec'] == 0:
+                failed += 1
+            nodes = ','.join(["%s:%s" % x for x in res['allocation']])
+            self.log.info(template % (idx, np, "%.2f" % (res['end'] - res['start']), res['ec'], nodes))
+        self.log.info("farm: %s tasks (%s failed) in %.2f seconds" % (len(tasks), failed, time.time() - start))
+
+        return failed
+
+    def make_farm_task_cmd(self, idx, task, allocation):
+        """Return the mpirun command for farm task idx with (np, cmdargs) task on allocation [(host, count)]"""
+        np, cmdargs = task
+
+        self.mpinoderuns = allocation
+        self.get_unique_nodes([host for host, _ in allocation])
+        self.mpitotalppn = max([count for _, count in allocation])
+        self.mpiexec_np = np
+        self.cmdargs = cmdargs
+
+        self.make_node_file(prefix="farm_%s_" % idx)
+        self.make_mpdboot()
+        self.make_mpiexec()
+        self.make_mpirun()
+
+        return " ".join(self.mpirun_cmd)
+
     def mpirun_prepare_execution(self):
         """
         Make a list of tuples to start the actual mpirun command
@@ -1030,9 +2427,235 @@ class MPI(object):
                 (run_function_to_run, cmd)
         """
         def main_runfunc(cmd):
-            if self.options.output is not None:
-                return run_to_file(cmd, filename=self.options.output)
+            if (self.options.output is not None and self.output_split is None and not self.options.outputcompress
+                    and not self.supervised() and not getattr(self.options, 'resilient', 0) > 0):
+                # mpirun writes to the file directly
+                return run_to_file_group(cmd, filename=self.options.output, started=self.mpirun_started)
             else:
-                return run_async_to_stdout(cmd)
+                return self.run_output(cmd)
 
         return [(main_runfunc, self.mpirun_cmd)]
+
+    def run_output(self, cmd):
+        """
+        Run cmd with the output through the output engine (see vsc.mympirun.output)
+            - to stdout or the --output file (gzip compressed with --outputcompress)
+            - with --outputsplit, the lines of the ranks are counted per rank ('count'),
+              or written per rank ('rank') or per node ('node') in the output directory in mympirundir
+        """
+        compress = self.options.outputcompress
+        if self.options.output is None:
+            default = sys.stdout
+        elif compress:
+            filename = self.options.output
+            if not filename.endswith('.gz'):
+                filename += '.gz'
+            default = gzip.open(filename, 'wb')
+        else:
+            default = open(self.options.output, 'w')
+
+        regex = None
+        split = None
+        sink_name = None
+        if self.output_split is not None:
+            regex = re.compile(self.OUTPUT_RANK_PREFIX_REGEX)
+        if self.output_split in ('rank', 'node'):
+            split = SplitFiles(os.path.join(self.mympirundir, 'output'), compress=compress)
+        if self.output_split == 'rank':
+            sink_name = lambda rank: "rank_%s" % rank
+        elif self.output_split == 'node':
+            mpinodes = self.mpinodes
+            sink_name = lambda rank: "node_%s" % mpinodes[rank % len(mpinodes)]
+
+        self.output_engine = OutputEngine(default, rank_regex=regex, split=split, sink_name=sink_name)
+        start = time.time()
+        try:
+            ec, out = run_output(cmd, engine=self.output_engine, tick=self.supervise, started=self.mpirun_started)
+        finally:
+            if default is not sys.stdout:
+                default.close()
+
+        self.output_statistics(time.time() - start)
+        return ec, out
+
+    def make_walltime_guard(self):
+        """
+        Set the walltime guard from the walltime option or (with walltimeguard) the remaining walltime of
+        the scheduler; without both, there is no guard
+        """
+        walltime = getattr(self.options, 'walltime', None)
+        if walltime is None and not getattr(self.options, 'walltimeguard', False):
+            self.log.debug("make_walltime_guard: no walltime guard requested")
+            return
+
+        try:
+            if walltime is None:
+                remaining = self.get_walltime_remaining()
+            else:
+                remaining = parse_walltime(walltime)
+            signum = get_signal(self.options.walltimesignal)
+        except ValueError, err:
+            self.log.raiseException("make_walltime_guard: %s" % err)
+
+        if remaining is None:
+            self.log.debug("make_walltime_guard: no walltime")
+            return
+
+        warning = self.options.walltimewarning * 60
+        self.walltime_guard = WalltimeGuard(time.time() + remaining, warning, signum)
+        self.log.info("make_walltime_guard: %d seconds walltime left, signal %s %s seconds before the end" %
+                      (remaining, signum, warning))
+
+    def make_stall_detector(self):
+        """Set the stall detector from the stallwindow option (optionally with the remote cputime samples)"""
+        window = getattr(self.options, 'stallwindow', 0)
+        if not window > 0:
+            self.log.debug("make_stall_detector: no stall detection")
+            return
+
+        remote = None
+        if getattr(self.options, 'stallremote', False):
+            rsh = self.get_rsh()
+            self.setup_rsh(rsh)
+            remote = lambda: self.remote_cputime(rsh)
+
+        self.stall_detector = StallDetector(window * 60, interval=self.STALL_SAMPLE_INTERVAL, remote=remote)
+        self.log.info("make_stall_detector: abort mpirun after %s seconds without progress (sample interval %s)" %
+                      (self.stall_detector.window, self.stall_detector.interval))
+
+    def remote_cputime(self, rsh):
+        """
+        Return the total cputime of the processes of this user on the remote nodes, from the last finished sample
+        of each node (so the remote cputime lags one sample interval behind).
+        The samples run in the background (the output is read meanwhile), each in its own process group:
+        nodes with a sample still running get no new one, samples running longer than STALL_REMOTE_TIMEOUT are killed.
+        """
+        local = None
+        if self.mpdboot_localhost_interface is not None:
+            local = self.mpdboot_localhost_interface[0]
+        nodes = [x for x in self.uniquenodes if not x == local]
+        cmd = self.STALL_REMOTE_CPUTIME_CMD % {'uid': os.getuid()}
+
+        def sample(item):
+            """Sample the cputime on a node"""
+            node, state = item
+            ec, out = run_noworries_group("%s %s '%s'" % (rsh, node, cmd),
+                                          started=lambda pid: self.remote_sample_started(pid, state))
+            if ec == 0:
+                state['value'] = sum([int(x) for x in out.split() if x.isdigit()])
+            state['done'] = True
+
+        todo = []
+        for node in nodes:
+            state = self.stall_remote_samples.get(node, None)
+            if state is None or state['done']:
+                value = None
+                if state is not None:
+                    value = state['value']
+                state = {'pid': None, 'start': None, 'expired': False, 'done': False, 'value': value}
+                self.stall_remote_samples[node] = state
+                todo.append((node, state))
+            elif state['start'] is not None and time.time() - state['start'] > self.STALL_REMOTE_TIMEOUT:
+                self.remote_sample_expired(node, state)
+
+        if todo:
+            thread = threading.Thread(target=bounded_map, args=(sample, todo),
+                                      kwargs={'workers': self.PREFLIGHT_WORKERS})
+            thread.setDaemon(True)
+            thread.start()
+        self.log.debug("remote_cputime: started %s samples, %s of %s nodes still running the previous one" %
+                       (len(todo), len(nodes) - len(todo), len(nodes)))
+
+        values = [x['value'] for x in self.stall_remote_samples.values()]
+        return sum([x for x in values if x is not None])
+
+    def remote_sample_started(self, pid, state):
+        """Record the pid and start of a remote sample; kill it right away when it already expired"""
+        state['pid'] = pid
+        state['start'] = time.time()
+        if state['expired']:
+            kill_group(pid)
+
+    def remote_sample_expired(self, node, state):
+        """Kill the process group of the sample of node, if it is still running (without waiting for it)"""
+        state['expired'] = True
+        pid = state['pid']
+        if pid is None or not group_alive(pid):
+            return
+        killed = kill_group(pid)
+        self.log.warning("remote_cputime: sample of node %s still running after %s seconds, killed %s processes" %
+                         (node, self.STALL_REMOTE_TIMEOUT, len(killed) + 1))
+
+    def stop_remote_samples(self):
+        """Kill the remote samples that are still running or waiting to start (eg after mpirun ended)"""
+        for node, state in self.stall_remote_samples.items():
+            if not state['done']:
+                state['expired'] = True
+                if state['pid'] is not None and group_alive(state['pid']):
+                    kill_group(state['pid'])
+        self.stall_remote_samples = {}
+
+    def check_stall(self, pid):
+        """Check the progress of mpirun pid, abort it when it is stalled (after running the stallhook)"""
+        output = 0
+        if self.output_engine is not None:
+            output = self.output_engine.total
+        if not self.stall_detector.check(pid, output):
+            return False
+
+        samples = ', '.join(["%s %s" % x for x in sorted(self.stall_detector.samples.items())])
+        self.log.warning("check_stall: no progress of mpirun %s for %s seconds (samples: %s), aborting" %
+                         (pid, self.stall_detector.window, samples))
+
+        hook = getattr(self.options, 'stallhook', None)
+        if hook is not None:
+            ec, out = run_simple_noworries("%s %s %s" % (hook, pid, self.mpiexec_node_filename))
+            self.log.info("check_stall: stallhook %s exitcode %s output:\n%s" % (hook, ec, out))
+
+        try:
+            os.killpg(pid, signal.SIGTERM)
+        except OSError, err:
+            if not err.errno == errno.ESRCH:
+                raise
+        self.stop_mpirun(pid)
+        return True
+
+    def supervised(self):
+        """Return True if the mpirun process tree is supervised (see supervise)"""
+        return self.walltime_guard is not None or self.stall_detector is not None
+
+    def supervise(self, pid):
+        """Supervise the mpirun process tree of pid (called periodically), return True to stop reading the output"""
+        res = False
+        if self.walltime_guard is not None:
+            nrsent = len(self.walltime_guard.sent)
+            res = self.walltime_guard.check(pid)
+            for when, signum, name in self.walltime_guard.sent[nrsent:]:
+                self.log.warning("supervise: %s: sent signal %s to the mpirun process tree, %d seconds before the "
+                                 "end of the walltime" % (name, signum, self.walltime_guard.deadline - when))
+
+        if not res and self.stall_detector is not None:
+            res = self.check_stall(pid)
+        return res
+
+    def output_statistics(self, runtime):
+        """Log the output statistics of the output engine, write the bytes per rank in mympirundir"""
+        engine = self.output_engine
+        launch_profile.add_bytes('output', engine.total)
+        self.log.info("output_statistics: %s bytes of output in %.2f seconds" % (engine.total, runtime))
+
+        if not engine.rank_bytes:
+            return
+
+        ranks = engine.rank_bytes.keys()
+        ranks.sort()
+        counts = [engine.rank_bytes[x] for x in ranks]
+        maxrank = ranks[counts.index(max(counts))]
+        self.log.info("output_statistics: %s ranks, bytes per rank min %s mean %.1f max %s (rank %s)" %
+                      (len(ranks), min(counts), float(sum(counts)) / len(counts), max(counts), maxrank))
+
+        fn = os.path.join(self.mympirundir, 'output_rank_bytes')
+        try:
+            open(fn, 'w').write(''.join(["%s %s\n" % (rank, count) for rank, count in zip(ranks, counts)]))
+        except IOError, err:
+            self.log.warning("output_statistics: failed to write bytes per rank file %s: %s" % (fn, err))
@@ -30,8 +30,7 @@ MPICH specific classes
 
 from distutils.version import LooseVersion
 
-from vsc.mympirun.mpi.mpi import MPI
-from vsc.utils.run import run_simple
+from vsc.mympirun.mpi.mpi import MPI, run_simple
 
 
 class MVAPICH2Hydra(MPI):
@@ -42,6 +41,11 @@ class MVAPICH2Hydra(MPI):
 
     HYDRA = True
 
+    NODEFILE_TEMPLATE_COMPACT = "%(host)s:%(count)s"
+
+    OUTPUT_RANK_PREFIX_OPTION = "-prepend-rank"
+    OUTPUT_RANK_PREFIX_REGEX = r"^\[(\d+)\] "
+
     PASS_VARIABLES_CLASS_PREFIX = ['MV2', 'HYDRA']
 
     MPIEXEC_TEMPLATE_PASS_VARIABLE_OPTION = "-envlist %(commaseparated)s"
@@ -82,8 +86,18 @@ class MVAPICH2(MVAPICH2Hydra):
 
     HYDRA = False
 
+    NODEFILE_TEMPLATE_COMPACT = None
+
+    OUTPUT_RANK_PREFIX_OPTION = "-l"
+    OUTPUT_RANK_PREFIX_REGEX = r"^(\d+): "
+
     PASS_VARIABLES_CLASS_PREFIX = ['MV2']
 
+    MPDRING_SUPPORTED = True
+
+    FARM_SUPPORTED = False
+
+    TEARDOWN_CMD = 'mpdallexit'
 
     def make_mpdboot_options(self):
         """Small fix"""
@@ -96,15 +110,20 @@ class MVAPICH2(MVAPICH2Hydra):
 
         res = []
 
-        cmd = "%s %s" % ('mpdboot', ' '.join(self.mpdboot_options))
-        res.append((run_simple, cmd))
+        # the persistent mpd ring is already running
+        if self.mpdring is None:
+            cmd = "%s %s" % ('mpdboot', ' '.join(self.mpdboot_options))
+            res.append((run_simple, cmd))
 
         if self.options.debug:
             res.append((run_simple, 'mpdtrace -l'))
 
-        res += super(MVAPICH2, self).mpirun_prepare_execution
+        res += super(MVAPICH2, self).mpirun_prepare_execution()
+
+        if self.mpdring is None:
+            res.append((run_simple, 'mpdallexit'))
 
-        res.append((run_simple, 'mpdallexit'))
+        return res
 
 
 class MPICH2Hydra(MVAPICH2Hydra):
@@ -39,9 +39,19 @@ class OpenMPI(MPI):
 
     MPIEXEC_TEMPLATE_GOBAL_OPTION = "--mca %(name)s %(value)s"
     MPIEXEC_TEMPLATE_LOCAL_OPTION = "--mca %(name)s %(value)s"
+    ENVFILE_GLOBAL_OPTIONS = False  # mca parameters
 
     MPDBOOT_TEMPLATE_REMOTE_OPTION_NAME = "--mca pls_rsh_agent %(rsh)s"
 
+    NODEFILE_TEMPLATE_COMPACT = "%(host)s slots=%(count)s"
+
+    MPMD_SECTION_PER_HOST = False
+    MPMD_TEMPLATE_SECTION = "-np %(np)s -hostfile %(nodefile)s"
+    MPMD_TEMPLATE_ENV = "-x %(name)s=%(value)s"
+
+    OUTPUT_RANK_PREFIX_OPTION = "--tag-output"
+    OUTPUT_RANK_PREFIX_REGEX = r"^\[\d+,(\d+)\]<std(?:out|err)>:"
+
     def mpiexec_set_global_options(self):
         """Set mpiexec global options"""
         self.mpiexec_global_options['btl'] = self.device
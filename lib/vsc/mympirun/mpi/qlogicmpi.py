@@ -53,6 +53,10 @@ class QLogicMPI(MPI):
     MPIEXEC_TEMPLATE_LOCAL_OPTION = "export %(name)s='%(value)s'"
     MPIEXEC_TEMPLATE_PASS_VARIABLE_OPTION = "export %(name)s='%(value)s'"
 
+    ENVFILE_SUPPORTED = False  # all variables are already in the rcfile
+    MPMD_SYNTAX = None
+    OUTPUT_RANK_PREFIX_OPTION = None
+
     def _pin_flavour(self, mp=None):
         if self.options.hybrid is not None and self.options.hybrid > 0:
             if self.pinning_override_type is not None:
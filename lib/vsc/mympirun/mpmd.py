@@ -0,0 +1,125 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+MPMD: components of a coupled launch, each with its own command, number of processes and dedicated nodes
+
+A component is an (optional) list of settings followed by the command
+    [nodes=<N>] [np=<n>] [hybrid=<processes per node>] [omp=<threads>] command [args]
+Components are separated with a ':' argument on the mympirun command line, or given one per line in a file
+(empty lines and lines starting with # are ignored).
+
+@author: Stijn De Weirdt
+"""
+
+import re
+import shlex
+
+MPMD_SEPARATOR = ':'
+SETTINGS = ['nodes', 'np', 'hybrid', 'omp']
+
+_SETTING_REGEX = re.compile(r"^(%s)=(\d+)$" % '|'.join(SETTINGS))
+
+
+def parse_component(args):
+    """Return the component dict (with the settings and cmdargs) from the list of args"""
+    component = dict([(x, None) for x in SETTINGS])
+    idx = 0
+    while idx < len(args):
+        res = _SETTING_REGEX.search(args[idx])
+        if res is None:
+            break
+        component[res.group(1)] = int(res.group(2))
+        idx += 1
+
+    component['cmdargs'] = args[idx:]
+    if len(component['cmdargs']) == 0:
+        raise ValueError("no command in MPMD component %s" % args)
+    for name in SETTINGS:
+        if component[name] is not None and component[name] < 1:
+            raise ValueError("%s should be > 0 in MPMD component %s" % (name, args))
+    return component
+
+
+def split_components(args):
+    """Return the list of components from args with MPMD_SEPARATOR separated components"""
+    res = []
+    current = []
+    for arg in args + [MPMD_SEPARATOR]:
+        if arg == MPMD_SEPARATOR:
+            res.append(parse_component(current))
+            current = []
+        else:
+            current.append(arg)
+    return res
+
+
+def parse_components_file(txt):
+    """Return the list of components from the file content txt, one component per line"""
+    return [parse_component(shlex.split(line)) for line in txt.splitlines()
+            if len(line.strip()) > 0 and not line.strip().startswith('#')]
+
+
+def partition_nodes(nodes, components, perhost):
+    """
+    Set the dedicated nodes (hosts) and the run-length list of (host, count) (runs) of each component
+        - components with nodes set get that many nodes; with only np set, enough nodes for np processes
+        - the other nodes are divided over the components with neither set
+        @param perhost: function with component as argument, returns the number of processes per node
+    """
+    sizes = []
+    for component in components:
+        size = component['nodes']
+        if size is None and component['np'] is not None:
+            size = (component['np'] + perhost(component) - 1) // perhost(component)
+        sizes.append(size)
+
+    free = [idx for idx, size in enumerate(sizes) if size is None]
+    rest = len(nodes) - sum([x for x in sizes if x is not None])
+    for nr, idx in enumerate(free):
+        sizes[idx] = rest // len(free) + int(nr < rest % len(free))
+
+    if sum(sizes) > len(nodes) or min(sizes) < 1:
+        raise ValueError("can't partition %s nodes over %s MPMD components (nodes per component %s)" %
+                         (len(nodes), len(components), sizes))
+
+    start = 0
+    for component, size in zip(components, sizes):
+        component['hosts'] = nodes[start:start + size]
+        start += size
+
+        # one run per node, the last nodes get fewer processes if np is smaller
+        todo = component['np']
+        if todo is None:
+            todo = size * perhost(component)
+        component['runs'] = []
+        for node in component['hosts']:
+            count = min(perhost(component), todo)
+            if count > 0:
+                component['runs'].append((node, count))
+            todo -= count
+        if todo > 0:
+            raise ValueError("np %s too large for %s nodes with %s processes per node in MPMD component %s" %
+                             (component['np'], size, perhost(component), component['cmdargs']))
+        component['np'] = sum([count for _, count in component['runs']])
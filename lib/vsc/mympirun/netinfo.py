@@ -0,0 +1,112 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Local network interface information
+
+@author: Stijn De Weirdt
+"""
+
+import array
+import fcntl
+import re
+import socket
+import struct
+
+from vsc.mympirun.launchprofile import count_subprocesses
+from vsc.utils.fancylogger import getLogger
+from vsc.utils.run import run_simple
+
+run_simple = count_subprocesses(run_simple)
+
+_log = getLogger('netinfo')
+
+# from linux/sockios.h
+SIOCGIFCONF = 0x8912
+# should be plenty
+SIOCGIFCONF_MAX_INTERFACES = 1024
+
+IP_ADDR_SHOW_CMD = "/sbin/ip -4 -o addr show"
+
+
+def _ifconf_ipv4_addresses():
+    """
+    Get the ipv4 address to interface mapping with the SIOCGIFCONF ioctl
+        - labels (eg eth0:1) are reported as interface name
+    """
+    # size of struct ifreq: name + sockaddr union (padded to pointer size)
+    if struct.calcsize('P') == 8:
+        ifreq_size = 40
+    else:
+        ifreq_size = 32
+
+    maxbytes = SIOCGIFCONF_MAX_INTERFACES * ifreq_size
+    buf = array.array('B', '\0' * maxbytes)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        ifconf = fcntl.ioctl(sock.fileno(), SIOCGIFCONF, struct.pack('iL', maxbytes, buf.buffer_info()[0]))
+    finally:
+        sock.close()
+
+    outbytes = struct.unpack('iL', ifconf)[0]
+    data = buf.tostring()
+
+    res = {}
+    for offset in range(0, outbytes, ifreq_size):
+        iface = data[offset:offset + 16].split('\0', 1)[0]
+        # sockaddr_in: family (2), port (2), address (4)
+        ip = socket.inet_ntoa(data[offset + 20:offset + 24])
+        res[ip] = iface
+    return res
+
+
+def _ip_addr_show_ipv4_addresses():
+    """Get the ipv4 address to interface mapping by parsing the ip addr show output (single run)"""
+    ec, out = run_simple(IP_ADDR_SHOW_CMD)
+    if ec > 0:
+        _log.raiseException("_ip_addr_show_ipv4_addresses: failed to run cmd %s: %s" % (IP_ADDR_SHOW_CMD, out))
+
+    # eg 2: eth0    inet 10.141.10.1/16 brd 10.141.255.255 scope global eth0
+    reg = re.compile(r"^\d+:\s+(\S+)\s+inet\s+(\d+\.\d+\.\d+\.\d+)", re.M)
+    res = {}
+    for iface, ip in reg.findall(out):
+        res[ip] = iface
+    return res
+
+
+def get_local_ipv4_addresses():
+    """
+    Return dict with all local ipv4 addresses as key and the interface name as value.
+        - in-process with ioctl, falls back to a single ip addr show
+    """
+    try:
+        res = _ifconf_ipv4_addresses()
+        _log.debug("get_local_ipv4_addresses: found %s with ioctl" % res)
+    except (IOError, socket.error, struct.error), err:
+        _log.debug("get_local_ipv4_addresses: ioctl failed (%s), parsing %s" % (err, IP_ADDR_SHOW_CMD))
+        res = _ip_addr_show_ipv4_addresses()
+        _log.debug("get_local_ipv4_addresses: found %s from %s" % (res, IP_ADDR_SHOW_CMD))
+
+    return res
@@ -51,7 +51,6 @@ class MympirunOption(GeneralOption):
         GeneralOption.__init__(self)
 
     def make_init(self):
-        # "walltime":("Job walltime in hours", 'float', 'store', 48, 'l'),
         opts = {
                 "showmpi": ("Print the known MPI classes and exit", None, "store_true", False, 'm'),
                 "showsched": ("Print the known Sched classes and exit", None, "store_true", False, 's'),
@@ -59,6 +58,10 @@ class MympirunOption(GeneralOption):
                 "debugmpi": ("Enable MPI level debugging", None, "store_true", False),
                 "debuglvl": ("Specify debug level", "int", "store", 0),
                 "mpdbootverbose": ("Run verbose mpdboot", None, "store_true", False),
+                "mpdring": (("Boot the mpd ring once per job and reuse it in the next mympirun calls of the job "
+                             "(MPD based flavours)"), None, "store_true", False),
+                "mpdringidle": ("Tear down the persistent mpd ring after this many seconds without use",
+                                "int", "store", 1800),
                 "stats": ("Set MPI statistics level", "int", "store", 0),
 
                 "hybrid": ("Run in hybrid mode, specify number of processes per node.", "int", "store", None, 'h'),
@@ -69,6 +72,33 @@ class MympirunOption(GeneralOption):
                               "str", "store", None, "S"),  # TODO: generate list
 
                 "output": ("filename to write stdout/stderr directly to (instead of stdout)", "str", "store", None),
+                "walltime": (("Remaining walltime of the job ([[HH:]MM:]SS); the mpirun process tree is signalled "
+                              "and terminated before the end"), "str", "store", None, 'l'),
+                "walltimeguard": (("Signal and terminate the mpirun process tree before the end of the walltime "
+                                   "of the job from the scheduler (eg PBS_WALLTIME)"), None, "store_true", False),
+                "walltimesignal": ("Signal sent to the mpirun process tree walltimewarning minutes before the end",
+                                   "str", "store", 'USR1'),
+                "walltimewarning": ("Minutes before the end of the walltime to send the walltimesignal",
+                                    "int", "store", 10),
+                "teardowngrace": (("Seconds to wait for the mpirun process group after forwarding SIGINT/SIGTERM, "
+                                   "before it is killed"), "int", "store", 10),
+                "resilient": (("Relaunch mpirun up to this many times after a launcher or fabric failure, "
+                               "without the failed nodes or with the next device"), "int", "store", 0),
+                "stallwindow": (("Abort mpirun when it makes no progress (no output, no cputime) for this many minutes "
+                                 "(0: disabled)"), "int", "store", 0),
+                "stallremote": ("Also sample the cputime on the remote nodes (with the remote shell) for --stallwindow",
+                                None, "store_true", False),
+                "stallhook": (("Command run before a stalled mpirun is aborted (eg to dump stack traces), "
+                               "with the mpirun pid and the nodefile as arguments"), "str", "store", None),
+                "accounting": (("Record the resource usage of each rank (wall and cpu time, max RSS) with a wrapper "
+                                "and write the summary and the records to this file"), "str", "store", None),
+                "execmpirun": (("Replace mympirun by mpirun after the preparation (no resident mympirun); "
+                                "the mympirun directory is removed by a cleanup hook"), None, "store_true", False),
+                "outputsplit": (("Split the output with the rank prefix of the MPI flavour: per rank or per node files "
+                                 "in the output directory of the mympirun directory, or only count the bytes per rank"),
+                                "choice", "store", None, ['rank', 'node', 'count']),
+                "outputcompress": ("Compress the --output file and the split output files with gzip",
+                                   None, "store_true", False),
 
                 "ssh": ("Force ssh for mpd startup (will try to use optimised method by default)",
                         None, "store_false", True),
@@ -81,19 +111,51 @@ class MympirunOption(GeneralOption):
 
                 "rdma": ("Force rdma device", None, "store_true", None),
                 "socket": ("Force socket device", None, "store_true", None),
+                "device": ("Force device (one of %s)" % ', '.join(MPI.DEVICE_ORDER), "str", "store", None),
+                "autodevice": (("Measure the candidate devices with a ping-pong between 2 ranks and use the fastest "
+                                "one (result is cached per node pair in basepath)"), None, "store_true", False),
 
                 "universe": (("Start only this number of processes instead of all (e.g. for MPI_Spawn) Total size of the "
                               "universe is all requested processes.)"), "int", "store", None),
                 "overridepin": (("Let mympriun set the affinity (default: disabled, left over to MPI implementation). "
                                  "Supported types: 'compact','spread','cycle' (add 'pin' postfix for single core pinning, "
                                  "e.g. 'cyclepin')."), "str", "store", None),
+                "overridepinphyscore": ("With overridepin: one rank per physical core (no hyperthread siblings)",
+                                        None, "store_true", False),
+                "overridepinmembind": ("With overridepin: bind the memory to the local NUMA node(s) of the ranks",
+                                       None, "store_true", False),
 
                 "variablesprefix": (("Comma-separated list of exact names or prefixes to match environment variables "
                                      "(<prefix>_ should match) to pass through."), "string", "extend", []),
                 "noenvmodules": ("Don't pass the environment modules variables", None, "store_true", False),
+                "skiploginvariables": (("Don't pass the variables that have the same value in a remote shell "
+                                        "on the first node"), None, "store_true", False),
+                "envfile": (("Pass the environment variables with an env file in the mympirun directory, sourced by "
+                             "each rank (instead of one mpirun option per variable)"), None, "store_true", False),
+                "farm": (("Task farm: run the tasks in this file (one per line: number of processes and command) "
+                          "concurrently in the slots of the allocation"), "str", "store", None),
+                "mpmd": (("MPMD: file with one component per line ([nodes=N] [np=n] [hybrid=h] [omp=t] command); "
+                          "components can also be separated with ':' on the command line"), "str", "store", None),
                 "mpirunoptions": ("String with options to pass to mpirun (will be appended to generate comamnd)",
                                   "str", "store", None),
                 'branchcount': ("Set the hydra branchcount", "int", "store", None),
+                "preflight": ("Check the health of all nodes before the start (reachable, devices, /dev/shm, memory, "
+                              "limits)", None, "store_true", False),
+                "preflighttimeout": ("Total time budget in seconds for the preflight check (default 120)",
+                                     "int", "store", None),
+                "sshtreefanout": (("Fan-out of the launch tree (hydra --branch-count, mpdboot --maxbranch) "
+                                   "(default 32 for large jobs)"), "int", "store", None),
+                "sshtreeconcurrency": ("Max number of remote shells set up at the same time per node by sshtree",
+                                       "int", "store", None),
+                "sshtreeretries": ("Number of retries (with exponential backoff) of failed remote shells by sshtree",
+                                   "int", "store", None),
+                "profilelaunch": ("Write a JSON profile of the launch (time per phase, number of subprocesses, "
+                                  "bytes written) in the mympirun directory (which is not removed)",
+                                  None, "store_true", False),
+                "cprofilelaunch": ("Also write cProfile stats of the launch (implies --profilelaunch)",
+                                   None, "store_true", False),
+                "refreshprobes": (("Ignore the cached results of the node probes (device, netmask, vSMP, "
+                                   "hydra info) and probe again"), None, "store_true", False),
                 }
 
         descr = ["mympirun options", "General advanced mympirun options"]
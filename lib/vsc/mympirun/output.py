@@ -0,0 +1,237 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Output engine for the mpirun output: large non-blocking reads, bounded memory and per rank demultiplexing
+
+All ranks write their stdout/stderr in one stream. The engine reads it with large non-blocking reads
+and writes each block right away (a slow sink stops the reading, so the pipe applies the backpressure
+to the ranks and at most one block is in memory). Only the tail of the output is kept.
+
+With the rank prefix of the MPI flavour (eg -prepend-rank, -l, --tag-output), the lines are demultiplexed
+per rank: the bytes per rank are counted and the lines can be written to per rank or per node files
+(optionally gzip compressed), without the prefix.
+
+@author: Stijn De Weirdt
+"""
+
+import errno
+import fcntl
+import gzip
+import os
+import select
+import time
+
+from vsc.mympirun.proctree import RunProcessGroup
+
+READ_SIZE = 1024 * 1024  # bytes per read
+MAX_PARTIAL = 1024 * 1024  # max size of an incomplete line before it is written anyway
+TAIL_SIZE = 64 * 1024  # output kept for the error messages
+POLL_INTERVAL = 1  # seconds
+
+
+class SplitFiles(object):
+    """
+    Per rank or per node output files in a directory
+        - the files are opened on first use, at most maxopen files are kept open (reopened in append mode)
+        - with compress, the files are gzip compressed (reopening adds a gzip member)
+    """
+
+    def __init__(self, path, compress=False, maxopen=256):
+        self.path = path
+        self.compress = compress
+        self.maxopen = maxopen
+        self.filenames = {}
+        self._open = {}
+        self._order = []
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def filename(self, name):
+        """Return the filename for name"""
+        fn = os.path.join(self.path, "%s.out" % name)
+        if self.compress:
+            fn += '.gz'
+        return fn
+
+    def write(self, name, data):
+        """Write data to the file of name"""
+        fh = self._open.get(name, None)
+        if fh is None:
+            if len(self._open) >= self.maxopen:
+                self._open.pop(self._order.pop(0)).close()
+            fn = self.filename(name)
+            mode = 'w'
+            if name in self.filenames:
+                mode = 'a'
+            if self.compress:
+                fh = gzip.open(fn, "%sb" % mode)
+            else:
+                fh = open(fn, mode)
+            self.filenames[name] = fn
+            self._open[name] = fh
+            self._order.append(name)
+        fh.write(data)
+
+    def close(self):
+        """Close all open files"""
+        for fh in self._open.values():
+            fh.close()
+        self._open = {}
+        self._order = []
+
+
+class OutputEngine(object):
+    """
+    Pump the output of a process to the default output (file object), demultiplex it per rank
+        @param rank_regex: compiled regex that matches the rank prefix of a line, with the rank as first group
+        @param sink_name: function with rank as argument, returns the name for the SplitFiles split
+                          (without split, the lines go to the default output and are only counted)
+    """
+
+    def __init__(self, default, rank_regex=None, split=None, sink_name=None):
+        self.default = default
+        self.rank_regex = rank_regex
+        self.split = split
+        self.sink_name = sink_name
+
+        self.total = 0
+        self.rank_bytes = {}
+        self.tail = ''
+        self._partial = ''
+
+    def _write_default(self, data):
+        self.default.write(data)
+        self.default.flush()
+
+    def feed(self, data):
+        """Process a block of output"""
+        self.total += len(data)
+        self.tail = (self.tail + data)[-TAIL_SIZE:]
+
+        if self.rank_regex is None:
+            self._write_default(data)
+            return
+
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        if len(self._partial) > MAX_PARTIAL:
+            lines.append(self._partial)
+            self._partial = ''
+        self._demultiplex(lines)
+
+    def _demultiplex(self, lines):
+        """Count and write the complete lines, grouped per sink"""
+        default = []
+        sinks = {}
+        for line in lines:
+            res = self.rank_regex.match(line)
+            if res is None:
+                default.append(line)
+                continue
+
+            rank = int(res.group(1))
+            self.rank_bytes[rank] = self.rank_bytes.get(rank, 0) + len(line) - res.end() + 1
+            if self.split is None:
+                default.append(line)
+            else:
+                sinks.setdefault(self.sink_name(rank), []).append(line[res.end():])
+
+        for name, sinklines in sinks.items():
+            self.split.write(name, "%s\n" % '\n'.join(sinklines))
+        if default:
+            self._write_default("%s\n" % '\n'.join(default))
+
+    def flush(self):
+        """Process the last incomplete line and close the split files"""
+        if self._partial:
+            partial = self._partial
+            self._partial = ''
+            self._demultiplex([partial])
+        if self.split is not None:
+            self.split.close()
+
+    def pump(self, fd, tick=None):
+        """
+        Read fd with large non-blocking reads until end of file
+            @param tick: function called every POLL_INTERVAL seconds, stop reading when it returns True
+        """
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+        last = time.time()
+        try:
+            while True:
+                if tick is not None and time.time() - last >= POLL_INTERVAL:
+                    last = time.time()
+                    if tick():
+                        break
+
+                try:
+                    ready = select.select([fd], [], [], POLL_INTERVAL)[0]
+                except select.error, err:
+                    if err.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if not ready:
+                    continue
+
+                try:
+                    data = os.read(fd, READ_SIZE)
+                except OSError, err:
+                    if err.errno in (errno.EAGAIN, errno.EINTR):
+                        continue
+                    raise
+                if not data:
+                    break
+                self.feed(data)
+        finally:
+            # also when interrupted (eg by the teardown on a signal)
+            self.flush()
+
+
+class RunOutput(RunProcessGroup):
+    """
+    Run the command in a new process group with the output through an OutputEngine
+    (only the tail of the output is returned)
+        @param started: see RunProcessGroup
+        @param tick: function with the pid of the process as argument, see OutputEngine.pump
+    """
+
+    def __init__(self, cmd, **kwargs):
+        self.engine = kwargs.pop('engine')
+        self.tick = kwargs.pop('tick', None)
+        super(RunOutput, self).__init__(cmd, **kwargs)
+
+    def _wait_for_process(self):
+        tick = None
+        if self.tick is not None:
+            tick = lambda: self.tick(self._process.pid)
+        self.engine.pump(self._process.stdout.fileno(), tick=tick)
+        self._process_exitcode = self._process.wait()
+        self._process_output = self.engine.tail
+
+
+run_output = RunOutput.run
@@ -0,0 +1,177 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Persistent per node cache for the results of environment probes
+(eg device paths, ip addr show, vsmpctl, mpirun -info)
+
+@author: Stijn De Weirdt
+"""
+
+import cPickle
+import os
+import socket
+import stat
+import time
+
+from vsc.utils.fancylogger import getLogger
+
+BOOT_ID_FILENAME = '/proc/sys/kernel/random/boot_id'
+
+DEFAULT_TTL = 24 * 60 * 60  # in seconds
+DEFAULT_MAX_ENTRIES = 16  # per node
+
+
+def get_boot_id():
+    """Return the boot id of this node (empty string if not available)"""
+    try:
+        return open(BOOT_ID_FILENAME).read().strip()
+    except IOError:
+        return ''
+
+
+def make_probecache_key(mpirun=None):
+    """
+    Make the key for the probes of this node boot and mpirun
+        @param mpirun: path to the mpirun executable
+    """
+    mtime = None
+    if mpirun is not None:
+        try:
+            mtime = os.stat(mpirun)[stat.ST_MTIME]
+        except OSError:
+            pass
+    return (get_boot_id(), mpirun, mtime)
+
+
+class ProbeCache(object):
+    """
+    Cache of probe results, stored in one file per node (hostname) in path.
+    Each file has at most maxentries entries (one per key), evicting the oldest ones;
+    entries older than ttl seconds are ignored.
+    """
+
+    def __init__(self, path, key, ttl=DEFAULT_TTL, maxentries=DEFAULT_MAX_ENTRIES, refresh=False, name=None):
+        """
+        @param path: directory to store the cache files in
+        @param key: key of the probe results for this node (eg from make_probecache_key)
+        @param refresh: ignore the cached values (new values are still stored)
+        @param name: name of the cache file (default: the hostname; eg a fixed name for results shared by all nodes)
+        """
+        self.log = getLogger(self.__class__.__name__)
+
+        self.path = path
+        self.key = key
+        self.ttl = ttl
+        self.maxentries = maxentries
+        self.refresh = refresh
+
+        if name is None:
+            name = socket.gethostname()
+        self.filename = os.path.join(self.path, name)
+
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+
+        self.entries = self._load()
+
+        if self.refresh or not self.key in self.entries:
+            self.entries[self.key] = {'timestamp': time.time(), 'probes': {}}
+        self.probes = self.entries[self.key]['probes']
+
+    def _load(self):
+        """Load the entries from the cache file, without the expired ones"""
+        entries = {}
+        if not os.path.isfile(self.filename):
+            self.log.debug("_load: no cache file %s" % self.filename)
+            return entries
+
+        try:
+            fh = open(self.filename, 'rb')
+            try:
+                entries = cPickle.load(fh)
+            finally:
+                fh.close()
+        except Exception, err:
+            self.log.warning("_load: failed to load cache file %s, ignoring it: %s" % (self.filename, err))
+            return {}
+
+        now = time.time()
+        for key, entry in entries.items():
+            if now - entry['timestamp'] > self.ttl:
+                self.log.debug("_load: dropping expired entry %s" % (key,))
+                del entries[key]
+                self.dirty = True
+
+        return entries
+
+    def get(self, name, probe, valid=None):
+        """
+        Return the value of probe name; run probe() and store the value on a miss
+            @param valid: function, only store the value when valid(value) is True
+        """
+        if name in self.probes:
+            self.hits += 1
+            value = self.probes[name]
+            self.log.debug("get: hit for probe %s: %s" % (name, value))
+        else:
+            self.misses += 1
+            value = probe()
+            if valid is None or valid(value):
+                self.probes[name] = value
+                self.dirty = True
+            self.log.debug("get: miss for probe %s: %s" % (name, value))
+
+        return value
+
+    def save(self):
+        """Save the cache file if anything changed, evict the oldest entries"""
+        self.log.debug("save: probe cache %s hits %s misses %s" % (self.filename, self.hits, self.misses))
+        if not self.dirty:
+            return
+
+        keys = self.entries.keys()
+        keys.sort(lambda x, y: cmp(self.entries[y]['timestamp'], self.entries[x]['timestamp']))
+        for key in keys[self.maxentries:]:
+            self.log.debug("save: evicting entry %s" % (key,))
+            del self.entries[key]
+
+        tmpfn = "%s.%s.tmp" % (self.filename, os.getpid())
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            fh = open(tmpfn, 'wb')
+            try:
+                cPickle.dump(self.entries, fh, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                fh.close()
+            os.chmod(tmpfn, stat.S_IRUSR | stat.S_IWUSR)
+            # atomic replace, there might be concurrent mympiruns on this node
+            os.rename(tmpfn, self.filename)
+            self.dirty = False
+            self.log.debug("save: wrote cache file %s" % self.filename)
+        except (IOError, OSError), err:
+            # non-fatal, it's only a cache
+            self.log.warning("save: failed to write cache file %s: %s" % (self.filename, err))
@@ -0,0 +1,172 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+The process tree of a process on this node, from /proc (eg to signal the whole mpirun process tree),
+and running a command as leader of its own process group
+
+@author: Stijn De Weirdt
+"""
+
+import errno
+import os
+import signal
+import time
+
+from vsc.utils.run import Run, RunFile, RunNoWorries
+
+PROC = '/proc'
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def read_proc_stat(pid, proc=PROC):
+    """Return (ppid, pgrp, cputime in seconds) of process pid (cputime includes the waited for children)"""
+    txt = open(os.path.join(proc, "%s" % pid, 'stat')).read()
+    # the command name can have spaces and parentheses
+    fields = txt[txt.rindex(')') + 2:].split()
+    cputime = sum([int(x) for x in fields[11:15]]) / float(CLOCK_TICKS)
+    return int(fields[1]), int(fields[2]), cputime
+
+
+def process_table(proc=PROC):
+    """Return dict with pid as key and (ppid, pgrp, cputime) as value for all processes"""
+    res = {}
+    for name in os.listdir(proc):
+        if not name.isdigit():
+            continue
+        try:
+            res[int(name)] = read_proc_stat(name, proc=proc)
+        except (IOError, OSError, ValueError, IndexError):
+            # process is gone
+            continue
+    return res
+
+
+def descendants(pid, table):
+    """Return the list of pids of the process tree of pid (pid first) in process table"""
+    children = {}
+    for child, (ppid, _, _) in table.items():
+        children.setdefault(ppid, []).append(child)
+
+    res = [pid]
+    idx = 0
+    while idx < len(res):
+        res.extend(children.get(res[idx], []))
+        idx += 1
+    return res
+
+
+def signal_tree(pid, signum, proc=PROC):
+    """Send signal signum to all processes in the process tree of pid, return the list of signalled pids"""
+    res = []
+    for tpid in descendants(pid, process_table(proc=proc)):
+        try:
+            os.kill(tpid, signum)
+            res.append(tpid)
+        except OSError, err:
+            if not err.errno == errno.ESRCH:
+                raise
+    return res
+
+
+def tree_cputime(pid, proc=PROC):
+    """Return the total cputime in seconds of the process tree of pid"""
+    table = process_table(proc=proc)
+    return sum([table[x][2] for x in descendants(pid, table) if x in table])
+
+
+def group_alive(pgid):
+    """Return True if process group pgid has processes left"""
+    try:
+        os.killpg(pgid, 0)
+    except OSError, err:
+        if err.errno == errno.ESRCH:
+            return False
+        raise
+    return True
+
+
+def wait_group(pid, timeout, interval=0.1):
+    """
+    Wait at most timeout seconds until the process group of (child) process pid is gone
+        the child process itself is reaped; return True if the process group is gone
+    """
+    end = time.time() + timeout
+    while True:
+        try:
+            os.waitpid(pid, os.WNOHANG)
+        except OSError, err:
+            # not a child or already reaped
+            if not err.errno == errno.ECHILD:
+                raise
+        if not group_alive(pid):
+            return True
+        if time.time() >= end:
+            return False
+        time.sleep(interval)
+
+
+def kill_group(pgid, proc=PROC):
+    """
+    Send SIGKILL to process group pgid and to all descendants of its leader pgid
+    (also those that left the process group, eg daemonised)
+        return list of pids of the killed descendants
+    """
+    killed = signal_tree(pgid, signal.SIGKILL, proc=proc)
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError, err:
+        if not err.errno == errno.ESRCH:
+            raise
+    return killed
+
+
+class RunProcessGroup(Run):
+    """
+    Run the command as leader of a new process group (the pid is the process group id),
+    so the whole group can be signalled without signalling the parent
+        @param started: function with the pid as argument, called once the process is started
+    """
+
+    def __init__(self, cmd, **kwargs):
+        self.started = kwargs.pop('started', None)
+        super(RunProcessGroup, self).__init__(cmd, **kwargs)
+
+    def _init_process(self):
+        self._popen_named_args['preexec_fn'] = os.setpgrp
+        super(RunProcessGroup, self)._init_process()
+        if self.started is not None:
+            self.started(self._process.pid)
+
+
+class RunFileProcessGroup(RunProcessGroup, RunFile):
+    """RunFile in a new process group"""
+
+
+class RunNoWorriesProcessGroup(RunProcessGroup, RunNoWorries):
+    """RunNoWorries in a new process group"""
+
+
+run_to_file_group = RunFileProcessGroup.run
+run_noworries_group = RunNoWorriesProcessGroup.run
@@ -0,0 +1,138 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Failure classification of a failed mpirun for the resilient mode (--resilient)
+
+A failure is
+    - a launcher failure: the remote shell or the process manager failed to start (eg ssh, mpdboot, hydra proxies)
+    - a fabric failure: the interconnect failed to initialise (eg a HCA or DAPL provider on one of the nodes)
+    - an application failure: anything else, retrying does not help
+
+For a launcher or fabric failure, the nodes named in the failure messages are excluded from the next attempt;
+a fabric failure without identifiable nodes falls back to the next device.
+
+@author: Stijn De Weirdt
+"""
+
+import re
+
+FAILURE_LAUNCHER = 'launcher'
+FAILURE_FABRIC = 'fabric'
+FAILURE_APPLICATION = 'application'
+
+LAUNCHER_PATTERNS = [
+    r"ssh: connect to host",
+    r"ssh: Could not resolve hostname",
+    r"Connection (?:refused|timed out|closed by)",
+    r"Host key verification failed",
+    r"Permission denied \(",
+    r"No route to host",
+    r"failed to (?:ping|connect to) mpd",
+    r"mpdboot\S* .*(?:failed|timeout)",
+    r"HYDU_sock_connect|HYD_pmcd_pmiserv_proxy_init|unable to connect from",
+    r"ORTE was unable to reliably start one or more daemons",
+    r"An ORTE daemon has unexpectedly failed",
+]
+
+FABRIC_PATTERNS = [
+    r"ibv_\w+ failed|ibv_open_device",
+    r"Failed to (?:open|query) (?:the )?(?:IB|HCA)|Cannot initialize HCA|Couldn't initialize",
+    r"DAPL startup.*failed|dapl\S* .*(?:failed|could not open)",
+    r"MPID_nem_ib_init|rdma_get_cm_event|RDMA CM",
+    r"No OpenFabrics connection schemes reported",
+    r"MPI_Init(?:_thread)?.*(?:Other MPI error|Fatal error)",
+]
+
+# exitcode of the remote shell when the connection failed (without any output, the launch failed)
+LAUNCHER_EXITCODE = 255
+
+MAX_FAILURE_LINES = 100  # only the first failure lines are searched for nodes
+
+
+def failure_lines(output, patterns):
+    """Return the lines of output that match one of the regex patterns"""
+    regex = re.compile('|'.join(["(?:%s)" % x for x in patterns]))
+    return [line for line in output.splitlines() if regex.search(line)][:MAX_FAILURE_LINES]
+
+
+def mentioned_nodes(lines, nodes):
+    """Return the nodes (in nodes order) named in lines, also by their short hostname"""
+    names = {}
+    for node in nodes:
+        names.setdefault(node.split('.')[0], node)
+        names[node] = node
+
+    found = set()
+    for line in lines:
+        for word in re.findall(r"[\w.-]+", line):
+            word = word.rstrip('.')
+            if word in names:
+                found.add(names[word])
+    return [x for x in nodes if x in found]
+
+
+def classify_failure(ec, output, nodes, launcher_patterns=None, fabric_patterns=None):
+    """
+    Return tuple (failure class, list of nodes named in the failure messages) for exitcode ec and output
+        - the patterns are lists of regexes, defaults: LAUNCHER_PATTERNS and FABRIC_PATTERNS
+    """
+    if launcher_patterns is None:
+        launcher_patterns = LAUNCHER_PATTERNS
+    if fabric_patterns is None:
+        fabric_patterns = FABRIC_PATTERNS
+    if output is None:
+        output = ''
+
+    for kind, patterns in [(FAILURE_LAUNCHER, launcher_patterns), (FAILURE_FABRIC, fabric_patterns)]:
+        lines = failure_lines(output, patterns)
+        if lines:
+            return kind, mentioned_nodes(lines, nodes)
+
+    if ec == LAUNCHER_EXITCODE and not output.strip():
+        return FAILURE_LAUNCHER, []
+
+    return FAILURE_APPLICATION, []
+
+
+def plan_retry(kind, badnodes, nodes, devices):
+    """
+    Return the recovery for a failure of class kind (see classify_failure) as tuple (action, value)
+        ('exclude', nodes to exclude), ('device', next device), ('retry', None) or None (no retry)
+        - nodes: the nodes used; devices: the fallback devices in order of preference
+    """
+    if kind == FAILURE_APPLICATION:
+        return None
+
+    badnodes = [x for x in badnodes if x in nodes]
+    if badnodes and len(badnodes) < len(nodes):
+        return ('exclude', badnodes)
+
+    if kind == FAILURE_FABRIC:
+        if devices:
+            return ('device', devices[0])
+        return None
+
+    # launcher failure without (or on all) identified nodes: eg a transient failure of the remote shell
+    return ('retry', None)
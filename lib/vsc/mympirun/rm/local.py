@@ -49,8 +49,8 @@ class Local(Sched):
         """
 
         localhostname = getattr(self, 'MPIRUN_LOCALHOSTNAME', 'localhost')
-        self.nodes = [localhostname] * len(self.cpus)
-        self.nrnodes = len(self.nodes)  # same as len(self.cpus)
+        self.noderuns = [(intern(localhostname), len(self.cpus))]
+        self.nrnodes = len(self.cpus)
 
-        self.log.debug("get_node_list: set %s nodes: %s" % (self.nrnodes, self.nodes))
+        self.log.debug("get_node_list: set %s nodes (host, count): %s" % (self.nrnodes, self.noderuns))
 
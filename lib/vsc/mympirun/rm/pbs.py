@@ -28,19 +28,47 @@
 Torque / PBS
 """
 
-from vsc.mympirun.rm.sched import Sched
+from vsc.mympirun.rm.sched import Sched, rle_nodes
 import os
+import time
 
 class PBS(Sched):
     """Torque/PBS based"""
     _sched_for = ['pbs', 'torque']
     SCHED_ENVIRON_ID = 'PBS_JOBID'
 
-    RSH_LARGE_CMD = 'pbsssh'
-    RSH_LARGE_LIMIT = 'pbsssh'
-    HYDRA_LAUNCHER_EXEC = 'pbsssh'
+    RSH_LARGE_CMD = 'rshagent'
     HYDRA_RMK = ['pbs']
 
+    # remote shells (eg ssh) are not started in the Torque cpuset of the job
+    TORQUE_CPUSET_PROBE_CMD = ("hostname; d=/dev/cpuset/torque/%(id)s; if [ -f $d/cpus ]; then "
+                               "echo Cpus_allowed_list: `cat $d/cpus`; echo Mems_allowed_list: `cat $d/mems`; "
+                               "else %(default)s; fi")
+
+    def get_cpuset_probe_cmd(self):
+        """Use the Torque cpuset of the job if it exists"""
+        return self.TORQUE_CPUSET_PROBE_CMD % {'id': self.id,
+                                               'default': self.ALLOWED_LIST_CMD}
+
+    def get_walltime_remaining(self):
+        """
+        Remaining walltime from PBS_WALLTIME (seconds),
+        the start of the job is the modification time of the PBS_NODEFILE
+        """
+        walltime = os.environ.get('PBS_WALLTIME', None)
+        nodefile = os.environ.get('PBS_NODEFILE', None)
+        if walltime is None or nodefile is None:
+            return None
+
+        try:
+            res = int(walltime) - (time.time() - os.path.getmtime(nodefile))
+        except (OSError, ValueError), err:
+            self.log.warning("get_walltime_remaining: failed to get remaining walltime from PBS_WALLTIME %s "
+                             "and nodefile %s: %s" % (walltime, nodefile, err))
+            return None
+        self.log.debug("get_walltime_remaining: %s seconds (PBS_WALLTIME %s)" % (res, walltime))
+        return res
+
     def get_node_list(self):
 
         nodevar = 'PBS_NODEFILE'
@@ -49,13 +77,17 @@ class PBS(Sched):
             self.log.raiseException("get_node_list: failed to get %s from environment" % nodevar)
 
         try:
-            self.nodes = [ x.strip() for x in file(fn).read().split("\n") if len(x.strip()) > 0]
-            self.nrnodes = len(self.nodes)
-            self.log.debug("get_node_list: found %s nodes in %s: %s" % (self.nrnodes, fn, self.nodes))
+            fh = open(fn)
+            try:
+                self.noderuns = rle_nodes(x for x in (y.strip() for y in fh) if len(x) > 0)
+            finally:
+                fh.close()
+            self.nrnodes = sum([count for _, count in self.noderuns])
+            self.log.debug("get_node_list: found %s nodes in %s: %s" % (self.nrnodes, fn, self.noderuns))
         except:
             self.log.raiseException("get_node_list: failed to get nodes from nodefile %s" % fn)
 
-        self.log.debug("get_node_list: set %s nodes: %s" % (self.nrnodes, self.nodes))
+        self.log.debug("get_node_list: set %s nodes (host, count): %s" % (self.nrnodes, self.noderuns))
 
 
 
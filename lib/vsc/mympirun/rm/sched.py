@@ -32,13 +32,69 @@ Main sched class
 import os
 import random
 import re
+import socket
 import time
 from vsc.utils.fancylogger import getLogger
-from vsc.mympirun.mpi.mpi import get_subclasses
+from vsc.mympirun.launchprofile import launch_profile
+from vsc.mympirun.mpi.mpi import get_subclasses, run_simple
+from vsc.mympirun.threadpool import bounded_map
+from vsc.mympirun.topology import parse_cpulist
 from vsc.utils.affinity import sched_getaffinity
 from vsc.utils.missing import nub
 
 
+def rle_nodes(nodes):
+    """
+    Return the run-length representation of the iterable nodes (one hostname per slot)
+        - list of (hostname, count) tuples, consecutive slots on the same host are one tuple
+        - hostnames are interned
+    """
+    runs = []
+    for node in nodes:
+        if runs and runs[-1][0] == node:
+            runs[-1][1] += 1
+        else:
+            runs.append([intern(node), 1])
+    return [tuple(run) for run in runs]
+
+
+def merge_rle(runs):
+    """Merge consecutive runs on the same host"""
+    res = []
+    for host, count in runs:
+        if res and res[-1][0] == host:
+            res[-1] = (host, res[-1][1] + count)
+        else:
+            res.append((host, count))
+    return res
+
+
+def expand_rle(runs):
+    """Return the list with one hostname per slot from the run-length representation runs"""
+    res = []
+    for host, count in runs:
+        res.extend([host] * count)
+    return res
+
+
+def parse_allowed_list(txt):
+    """
+    Parse the output of the cpuset probe: hostname, followed by the Cpus_allowed_list and Mems_allowed_list lines
+    (as in /proc/<pid>/status). Return tuple (hostname, cpus, mems); hostname is None if not found.
+    """
+    hostname = None
+    cpus = []
+    mems = []
+    for line in [x.strip() for x in txt.splitlines() if len(x.strip()) > 0]:
+        if line.startswith('Cpus_allowed_list:'):
+            cpus = parse_cpulist(line.split(':', 1)[1])
+        elif line.startswith('Mems_allowed_list:'):
+            mems = parse_cpulist(line.split(':', 1)[1])
+        elif hostname is None and not ':' in line:
+            hostname = line
+    return hostname, cpus, mems
+
+
 def whatSched(requested):
     """Return the scheduler class"""
     found_sched = get_subclasses(Sched)
@@ -57,11 +113,17 @@ class Sched(object):
     SCHED_ENVIRON_ID_AUTOGENERATE_JOBID = False  # if the SCHED_ENVIRON_ID is not found, create one yourself
 
     SAFE_RSH_CMD = 'ssh'
-    SAFE_RSH_LARGE_CMD = 'sshsleep'
+    SAFE_RSH_LARGE_CMD = 'sshtree'
     RSH_CMD = None
     RSH_LARGE_CMD = None
     RSH_LARGE_LIMIT = 16  # nr of nodes considered large (relevant for internode communication for eg mpdboot)
 
+    # print the hostname and the allowed cpus and memory nodes (eg due to cpusets)
+    ALLOWED_LIST_CMD = "grep _allowed_list /proc/self/status"
+    CPUSET_PROBE_CMD = "hostname; %s" % ALLOWED_LIST_CMD
+    CPUSET_PROBE_WORKERS = 16  # max number of concurrent remote probes
+    CPUSET_PROBE_TIMEOUT = 120  # total time budget in seconds for all remote probes
+
     HYDRA_RMK = []
     HYDRA_LAUNCHER = ['ssh']
     HYDRA_LAUNCHER_EXEC = None
@@ -72,14 +134,14 @@ class Sched(object):
         if not hasattr(self, 'options'):
             self.options = options
 
-        self.nodes = None
+        self.noderuns = None  # run-length list of (host, count); see nodes property for the per slot list
         self.nrnodes = None
 
         self.uniquenodes = None
         self.nruniquenodes = None
 
-        self.mpinodes = None
-        self.mpinrnodes = None
+        self.mpinoderuns = None  # run-length list of (host, count); see mpinodes property for the per slot list
+        self.nrmpinodes = None
         self.mpitotalppn = None
 
         self.id = None
@@ -89,18 +151,52 @@ class Sched(object):
         self.totalppn = None
 
         self.cpus = []
+        self.nodecpusets = None  # per unique node: (hostname, cpus, mems); see get_node_cpusets
 
-        # collect data
-        self.get_id()
-        self._cores_on_this_node()
-        self.which_cpus()
-
-        self.get_node_list()
-        self.get_unique_nodes()
-        self.set_ppn()
+        launch_profile.phase('sched', self._collect_data)
 
         super(Sched, self).__init__(**kwargs)
 
+    def _collect_data(self):
+        """Collect the scheduler data"""
+        phase = launch_profile.phase
+
+        phase('get_id', self.get_id)
+        phase('cores_on_this_node', self._cores_on_this_node)
+        phase('which_cpus', self.which_cpus)
+
+        phase('get_node_list', self.get_node_list)
+        phase('get_unique_nodes', self.get_unique_nodes)
+        phase('set_ppn', self.set_ppn)
+
+    def _get_nodes(self):
+        """The list of nodes (one node per slot), expanded from noderuns"""
+        if self.noderuns is None:
+            return None
+        return expand_rle(self.noderuns)
+
+    def _set_nodes(self, nodes):
+        if nodes is None:
+            self.noderuns = None
+        else:
+            self.noderuns = rle_nodes(nodes)
+
+    nodes = property(_get_nodes, _set_nodes)
+
+    def _get_mpinodes(self):
+        """The list of mpi nodes (one node per mpi process), expanded from mpinoderuns"""
+        if self.mpinoderuns is None:
+            return None
+        return expand_rle(self.mpinoderuns)
+
+    def _set_mpinodes(self, mpinodes):
+        if mpinodes is None:
+            self.mpinoderuns = None
+        else:
+            self.mpinoderuns = rle_nodes(mpinodes)
+
+    mpinodes = property(_get_mpinodes, _set_mpinodes)
+
     # factory methods for MPI
     # to add a new MPI class just create a new class that extends the cluster class
     # see http://stackoverflow.com/questions/456672/class-factory-in-python
@@ -127,19 +223,27 @@ class Sched(object):
 
     # other methods
     def get_unique_nodes(self, nodes=None):
-        """Set unique nodes from self.nodes"""
+        """Set unique nodes from self.noderuns (or from the list nodes)"""
         if nodes is None:
-            nodes = self.nodes
+            if self.noderuns is None:
+                self.get_node_list()
+            nodes = [host for host, _ in self.noderuns]
 
         # don't use set(), preserve order!
         self.uniquenodes = nub(nodes)
         self.nruniquenodes = len(self.uniquenodes)
 
-        self.log.debug("get_unique_nodes: %s uniquenodes: %s from %s" %
-                       (self.nruniquenodes, self.uniquenodes, nodes))
+        self.log.debug("get_unique_nodes: %s uniquenodes: %s" % (self.nruniquenodes, self.uniquenodes))
+
+    def get_walltime_remaining(self):
+        """Return the remaining walltime of the job in seconds (None if unknown)"""
+        return None
 
     def get_node_list(self):
-        """get list of nodes (one node per requested processor/core)"""
+        """
+        Get list of nodes (one node per requested processor/core)
+            sets self.noderuns (eg with rle_nodes) and self.nrnodes
+        """
         self.log.raiseException("get_node_list not implemented")
 
     def get_id(self):
@@ -190,8 +294,7 @@ class Sched(object):
         - and how big is it (nr of procs compared to local number of cores)
 
         stores local core ids in array
-        # TODO fix remote cpusets
-        - what with remote ones?
+        - for the remote ones, see get_node_cpusets
         """
         if self.foundppn is None:
             self._cores_on_this_node()
@@ -204,6 +307,69 @@ class Sched(object):
 
         self.log.debug("which_cpus: using cpus %s" % (self.cpus))
 
+    def get_cpuset_probe_cmd(self):
+        """Return the command to print the hostname and allowed cpus and memory nodes on a node"""
+        return self.CPUSET_PROBE_CMD
+
+    def get_node_cpusets(self):
+        """
+        Determine the allowed cpus and memory nodes on each unique node (eg different cpusets per node)
+            - sets and returns self.nodecpusets: dict with unique node as key and value (hostname, cpus, mems)
+            - with one unique node, the local process affinity is used
+            - otherwise, all unique nodes are probed with the remote shell (bounded concurrency and time)
+            - nodes that can't be probed get the local values and hostname None (their real hostname is unknown)
+        """
+        if self.nodecpusets is not None:
+            return self.nodecpusets
+
+        if self.uniquenodes is None:
+            self.get_unique_nodes()
+        if len(self.cpus) == 0:
+            self.which_cpus()
+
+        mems = []
+        try:
+            mems = parse_allowed_list(open('/proc/self/status').read())[2]
+        except IOError:
+            self.log.debug("get_node_cpusets: failed to read local allowed memory nodes")
+        local = (socket.gethostname(), self.cpus, mems)
+
+        if self.nruniquenodes == 1:
+            self.nodecpusets = {self.uniquenodes[0]: local}
+            self.log.debug("get_node_cpusets: one unique node, using local %s" % (local,))
+            return self.nodecpusets
+
+        rsh = self.get_rsh()
+        cmd = self.get_cpuset_probe_cmd()
+
+        def probe(node):
+            """Probe node with remote shell"""
+            ec, out = run_simple("%s %s '%s'" % (rsh, node, cmd))
+            if ec > 0:
+                self.log.warning("get_node_cpusets: failed to probe node %s with %s (ec %s): %s" % (node, rsh, ec, out))
+                return None
+            res = parse_allowed_list(out)
+            if res[0] is None or len(res[1]) == 0:
+                self.log.warning("get_node_cpusets: failed to parse probe output of node %s: %s" % (node, out))
+                return None
+            return res
+
+        start = time.time()
+        results = bounded_map(probe, self.uniquenodes, workers=self.CPUSET_PROBE_WORKERS,
+                              timeout=self.CPUSET_PROBE_TIMEOUT)
+
+        self.nodecpusets = {}
+        for node, res in zip(self.uniquenodes, results):
+            if res is None:
+                self.log.warning("get_node_cpusets: no cpuset found for node %s, assuming local cpus %s" %
+                                 (node, self.cpus))
+                res = (None, local[1], local[2])
+            self.nodecpusets[node] = res
+
+        self.log.info("get_node_cpusets: probed %s nodes in %.3f seconds" % (self.nruniquenodes, time.time() - start))
+        self.log.debug("get_node_cpusets: found %s" % self.nodecpusets)
+        return self.nodecpusets
+
     def is_large(self):
         """Determine if this is a large job or not"""
         if self.nrnodes is None:
@@ -230,17 +396,19 @@ class Sched(object):
                 rsh = default_rsh
             elif getattr(self, 'HYDRA', None):
                 rsh = 'ssh'  # default anyway
-            elif self.is_large():
+            elif self.is_large() and self.RSH_LARGE_CMD is not None:
                 rsh = self.RSH_LARGE_CMD
-            else:
+            elif self.RSH_CMD is not None:
                 rsh = self.RSH_CMD
+            else:
+                rsh = self.SAFE_RSH_CMD
 
         self.log.debug("get_rsh returns %s" % rsh)
         return rsh
 
     def make_node_list(self):
         """Make a modified list of nodes based on requested options"""
-        if self.nodes is None:
+        if self.noderuns is None:
             self.get_node_list()
         if self.totalppn is None or self.ppn is None:
             self.set_ppn()
@@ -261,21 +429,18 @@ class Sched(object):
 
         self.log.debug("make_node_list: hybrid %s double %s multi %s" % (hybrid, double, multi))
 
-        res = []
         if double:
             self.mpitotalppn = self.ppn * multi
-            res = self.nodes * multi
+            res = self.noderuns * multi
         elif hybrid:
             # return multi unique nodes
             # mpitotalppn = 1 per node * multi
             self.mpitotalppn = multi
-            for n in self.uniquenodes:
-                res.extend([n] * multi)
+            res = [(n, multi) for n in self.uniquenodes]
         else:
             # default mode
             self.mpitotalppn = self.ppn * multi
-            for n in self.uniquenodes:
-                res.extend([n] * self.mpitotalppn)
+            res = [(n, self.mpitotalppn) for n in self.uniquenodes]
 
         # reorder
         ordermode = getattr(self.options, 'order', None)
@@ -290,7 +455,10 @@ class Sched(object):
                 seed = int(ordermode[1])
                 random.seed(seed)
                 self.log.debug("make_node_list: setting random seed %s" % seed)
-            random.shuffle(res)
+            # shuffle needs the per slot list
+            nodes = expand_rle(res)
+            random.shuffle(nodes)
+            res = rle_nodes(nodes)
             self.log.debug("make_node_list shuffled nodes (mode %s)" % ordermode)
         elif ordermode[0] in ('sort',):
             res.sort()
@@ -298,8 +466,9 @@ class Sched(object):
         else:
             self.log.raiseExcepetion("make_node_list unknown ordermode %s" % ordermode)
 
-        self.log.debug("make_node_list: ordered node list %s (mpitotalppn %s)" %
+        res = merge_rle(res)
+        self.log.debug("make_node_list: ordered node list (host, count) %s (mpitotalppn %s)" %
                        (res, self.mpitotalppn))
 
-        self.mpinodes = res
-        self.nrmpinodes = len(res)
+        self.mpinoderuns = res
+        self.nrmpinodes = sum([count for _, count in res])
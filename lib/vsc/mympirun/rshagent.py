@@ -0,0 +1,473 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+rshagent: remote shell (replaces pbsssh) that keeps one persistent control connection per node and job
+
+    rshagent [options] host command
+
+Modes (MYMPIRUN_RSHAGENT_MODE, or PBSSSHMODE=ssh as with pbsssh):
+    - pbsdsh (default if pbsdsh is found): on first use of a node, a proxy is started on it with pbsdsh
+      (in a login shell, once). The proxy registers its port in the per job state directory,
+      all next commands for that node are sent to the proxy (authenticated with a per job token)
+      and run in a plain shell, the output and exit code are sent back.
+    - ssh: ssh with ControlMaster/ControlPersist, so all sessions to a node share one connection
+
+Host names are normalised like pbsssh (ip addresses to names, short name with the local domain),
+the reverse lookups are cached in the state directory.
+Variables listed in PBSSSHENV are exported for the command (as with pbsssh).
+
+The state directory (MYMPIRUN_RSHAGENT_DIR, default ~/.mympirun/rshagent_<PBS_JOBID>) must be shared.
+The proxies stop after being idle (MYMPIRUN_RSHAGENT_IDLE seconds), or when the job ends.
+
+@author: Stijn De Weirdt
+"""
+
+import errno
+import os
+import re
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+ENVIRONMENT_PREFIX = 'MYMPIRUN_RSHAGENT_'
+DEFAULTS = {
+    'DIR': None,
+    'MODE': None,  # pbsdsh or ssh
+    'PBSDSH': 'pbsdsh -o -h',
+    'SSH': 'ssh',
+    'IDLE': 3600,  # seconds, for the proxies and ssh ControlPersist
+    'START_TIMEOUT': 60,  # seconds to wait for a proxy to start
+    'EXE': None,  # default: this python and script
+}
+
+REG_IP = re.compile(r'^\d+\.\d+\.\d+\.\d+$')
+SSH_FAILURE_EXITCODE = 255
+KILL_GRACE = 5  # seconds between SIGTERM and SIGKILL of a command when its client is gone
+FRAME_HEADER = '!cI'  # kind and length
+
+
+def send_frame(sock, kind, data):
+    """Send one frame of kind with data"""
+    sock.sendall(struct.pack(FRAME_HEADER, kind, len(data)) + data)
+
+
+def _recv_exact(sock, size):
+    """Receive exactly size bytes (None on end of connection)"""
+    data = []
+    while size > 0:
+        txt = sock.recv(min(size, 65536))
+        if not txt:
+            return None
+        data.append(txt)
+        size -= len(txt)
+    return ''.join(data)
+
+
+def recv_frame(sock):
+    """Return tuple (kind, data) of the next frame, (None, None) on end of connection"""
+    header = _recv_exact(sock, struct.calcsize(FRAME_HEADER))
+    if header is None:
+        return None, None
+    kind, size = struct.unpack(FRAME_HEADER, header)
+    data = _recv_exact(sock, size)
+    if data is None:
+        return None, None
+    return kind, data
+
+
+def which_exe(name):
+    """Return full path of executable name in PATH, or None"""
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        fn = os.path.join(path, name)
+        if os.path.isfile(fn) and os.access(fn, os.X_OK):
+            return fn
+    return None
+
+
+def get_config(environ=None):
+    """Return the configuration dict from the environment"""
+    if environ is None:
+        environ = os.environ
+
+    config = {}
+    for name, default in DEFAULTS.items():
+        value = environ.get(ENVIRONMENT_PREFIX + name, default)
+        if isinstance(default, int):
+            value = int(value)
+        config[name] = value
+
+    if config['DIR'] is None:
+        config['DIR'] = os.path.join(environ.get('HOME', '/tmp'), '.mympirun',
+                                     "rshagent_%s" % environ.get('PBS_JOBID', 'nojob'))
+    if config['EXE'] is None:
+        config['EXE'] = "%s %s" % (sys.executable, os.path.abspath(sys.argv[0]))
+    if config['MODE'] is None:
+        if environ.get('PBSSSHMODE', None) == 'ssh' or which_exe(config['PBSDSH'].split()[0]) is None:
+            config['MODE'] = 'ssh'
+        else:
+            config['MODE'] = 'pbsdsh'
+    return config
+
+
+def _write_atomic(fn, txt):
+    """Write txt to fn with rename"""
+    tmpfn = "%s.%s.tmp" % (fn, os.getpid())
+    fh = open(tmpfn, 'w')
+    try:
+        fh.write(txt)
+    finally:
+        fh.close()
+    os.rename(tmpfn, fn)
+
+
+def kill_command(proc, grace=KILL_GRACE):
+    """
+    Stop the command of Popen instance proc (leader of its own process group):
+    SIGTERM to the process group, SIGKILL if it is still running after grace seconds
+    """
+    for signum in [signal.SIGTERM, signal.SIGKILL]:
+        end = time.time() + grace
+        while True:
+            # reap the leader, a zombie leader keeps the process group alive
+            proc.poll()
+            try:
+                os.killpg(proc.pid, signum)
+            except OSError, err:
+                if err.errno == errno.ESRCH:
+                    return
+                raise
+            signum = 0
+            if time.time() >= end:
+                break
+            time.sleep(0.1)
+
+
+def handle_connection(conn, token):
+    """
+    Handle one client connection in the proxy: check token, run command, send output and exit code
+        - the command runs in its own session, so all its processes are stopped when the client is gone
+    """
+    kind, data = recv_frame(conn)
+    if not (kind == 't' and data == token):
+        conn.close()
+        return
+    kind, cmd = recv_frame(conn)
+    if not kind == 'c':
+        conn.close()
+        return
+
+    shell = '/bin/bash'
+    if not os.path.exists(shell):
+        shell = '/bin/sh'
+    proc = subprocess.Popen([shell, '-c', cmd], stdin=open(os.devnull), stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, close_fds=True, preexec_fn=os.setsid)
+
+    fds = {proc.stdout.fileno(): 'o', proc.stderr.fileno(): 'e'}
+    while fds:
+        ready = select.select(fds.keys() + [conn.fileno()], [], [])[0]
+        if conn.fileno() in ready and not conn.recv(4096):
+            # client is gone
+            kill_command(proc)
+            break
+        for fd in ready:
+            if fd in fds:
+                data = os.read(fd, 65536)
+                if data:
+                    send_frame(conn, fds[fd], data)
+                else:
+                    del fds[fd]
+
+    ec = proc.wait()
+    if ec < 0:
+        # killed by signal, like the shell reports it
+        ec = 128 - ec
+    try:
+        send_frame(conn, 'x', "%s" % ec)
+    except socket.error:
+        pass
+    conn.close()
+
+
+def run_proxy(statedir, host, idle):
+    """Run the proxy for host, registered in statedir; stop after idle seconds without connections"""
+    token = open(os.path.join(statedir, 'token')).read()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('', 0))
+    listener.listen(128)
+
+    registration = "%s %s" % (listener.getsockname()[1], os.getpid())
+    regfn = os.path.join(statedir, "proxy_%s" % host)
+    _write_atomic(regfn, registration)
+
+    children = set()
+    last = time.time()
+    while True:
+        for pid in list(children):
+            if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                children.remove(pid)
+        if children:
+            last = time.time()
+        elif time.time() - last > idle:
+            break
+
+        try:
+            ready = select.select([listener], [], [], 1)[0]
+        except select.error:
+            continue
+        if ready:
+            conn = listener.accept()[0]
+            pid = os.fork()
+            if pid == 0:
+                listener.close()
+                try:
+                    handle_connection(conn, token)
+                finally:
+                    os._exit(0)
+            conn.close()
+            children.add(pid)
+
+    try:
+        if open(regfn).read() == registration:
+            os.remove(regfn)
+    except (IOError, OSError):
+        pass
+
+
+class RshAgent(object):
+    """Client side of the rshagent"""
+
+    def __init__(self, config):
+        self.config = config
+        self.statedir = config['DIR']
+
+    def error(self, msg):
+        """Report error on stderr"""
+        sys.stderr.write("rshagent: %s\n" % msg)
+
+    def make_statedir(self):
+        """Create the state directory and the token"""
+        for path in [self.statedir, os.path.join(self.statedir, 'hosts')]:
+            try:
+                os.makedirs(path, 0700)
+            except OSError, err:
+                if not err.errno == errno.EEXIST:
+                    raise
+
+        tokenfn = os.path.join(self.statedir, 'token')
+        if not os.path.exists(tokenfn):
+            tmpfn = "%s.%s.tmp" % (tokenfn, os.getpid())
+            fd = os.open(tmpfn, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+            os.write(fd, os.urandom(16).encode('hex'))
+            os.close(fd)
+            try:
+                os.link(tmpfn, tokenfn)
+            except OSError:
+                # another agent was first
+                pass
+            os.remove(tmpfn)
+
+    def normalize(self, host):
+        """Normalise host like pbsssh: ip address to name, short name with local domain"""
+        if REG_IP.search(host):
+            cachefn = os.path.join(self.statedir, 'hosts', host)
+            try:
+                host = open(cachefn).read().strip()
+            except IOError:
+                try:
+                    host = socket.gethostbyaddr(host)[0]
+                    _write_atomic(cachefn, host)
+                except (socket.error, socket.herror), err:
+                    self.error("failed to lookup ip %s: %s" % (host, err))
+                    return host
+
+        localhost = socket.gethostname()
+        suffix = ''
+        if '.' in localhost:
+            suffix = localhost[localhost.index('.'):]
+        return host.split('.')[0] + suffix
+
+    def parse_args(self, args):
+        """Return tuple (options, host, command); options before and after the host are collected"""
+        options = []
+        rest = list(args)
+        while rest and rest[0].startswith('-'):
+            options.append(rest.pop(0))
+        if not rest:
+            raise ValueError("no host found in %s" % args)
+        host = rest.pop(0)
+        while rest and rest[0].startswith('-'):
+            options.append(rest.pop(0))
+
+        extraenv = ''
+        for name in os.environ.get('PBSSSHENV', '').split():
+            extraenv += "export %s=%s && " % (name, os.environ.get(name, ''))
+
+        return options, host, extraenv + ' '.join(rest)
+
+    def run_ssh(self, options, host, command):
+        """Replace this process with ssh sharing one master connection per host"""
+        controldir = "/tmp/rshagent_%s_%s" % (os.getuid(), os.path.basename(self.statedir))
+        try:
+            os.mkdir(controldir, 0700)
+        except OSError, err:
+            if not err.errno == errno.EEXIST:
+                raise
+        cmd = self.config['SSH'].split() + [
+            '-o', 'ControlMaster=auto',
+            '-o', "ControlPath=%s/%%r@%%h:%%p" % controldir,
+            '-o', "ControlPersist=%s" % self.config['IDLE'],
+        ] + options + [host, command]
+        os.execvp(cmd[0], cmd)
+
+    def get_proxy_port(self, host):
+        """Return the port of the registered proxy for host, or None"""
+        try:
+            return int(open(os.path.join(self.statedir, "proxy_%s" % host)).read().split()[0])
+        except (IOError, ValueError, IndexError):
+            return None
+
+    def start_proxy(self, host):
+        """Start the proxy on host with pbsdsh (only one agent does this), return the port or None"""
+        startfn = os.path.join(self.statedir, "proxy_%s.starting" % host)
+        timeout = self.config['START_TIMEOUT']
+        start = time.time()
+
+        try:
+            os.close(os.open(startfn, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600))
+            starter = True
+        except OSError:
+            starter = False
+            try:
+                if time.time() - os.path.getmtime(startfn) > timeout:
+                    # stale, eg the starting agent was killed
+                    os.remove(startfn)
+                    return self.start_proxy(host)
+            except OSError:
+                pass
+
+        proc = None
+        try:
+            if starter:
+                proxycmd = "%s --proxy %s %s" % (self.config['EXE'], self.statedir, host)
+                cmd = self.config['PBSDSH'].split() + [host, 'bash', '-l', '-c', proxycmd]
+                log = open(os.path.join(self.statedir, "proxy_%s.log" % host), 'a')
+                # the proxy outlives this agent
+                proc = subprocess.Popen(cmd, stdin=open(os.devnull), stdout=log, stderr=subprocess.STDOUT,
+                                        close_fds=True, preexec_fn=os.setsid)
+                log.close()
+
+            while time.time() - start < timeout:
+                port = self.get_proxy_port(host)
+                if port is not None:
+                    return port
+                if proc is not None and proc.poll() is not None:
+                    self.error("proxy on %s exited with %s, see %s" % (host, proc.returncode, log.name))
+                    return None
+                if not starter and not os.path.exists(startfn):
+                    return self.get_proxy_port(host)
+                time.sleep(0.05)
+            self.error("proxy on %s did not start in %s seconds" % (host, timeout))
+            return None
+        finally:
+            if starter:
+                os.remove(startfn)
+
+    def connect(self, host):
+        """Return socket connected to (and authenticated with) the proxy on host, or None"""
+        token = open(os.path.join(self.statedir, 'token')).read()
+        for attempt in range(2):
+            port = self.get_proxy_port(host)
+            if port is None:
+                port = self.start_proxy(host)
+                if port is None:
+                    return None
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.connect((host, port))
+                send_frame(sock, 't', token)
+                return sock
+            except socket.error, err:
+                # stale registration, eg proxy stopped after idle timeout
+                self.error("failed to connect to proxy on %s port %s: %s" % (host, port, err))
+                try:
+                    os.remove(os.path.join(self.statedir, "proxy_%s" % host))
+                except OSError:
+                    pass
+        return None
+
+    def run_proxy_command(self, host, command):
+        """Run command through the proxy on host, return the exit code"""
+        sock = self.connect(host)
+        if sock is None:
+            # pbsssh way
+            self.error("no proxy on %s, running %s with %s" % (host, command, self.config['PBSDSH']))
+            return subprocess.call(self.config['PBSDSH'].split() + [host, 'bash', '-l', '-c', command])
+
+        send_frame(sock, 'c', command)
+        outputs = {'o': sys.stdout.fileno(), 'e': sys.stderr.fileno()}
+        while True:
+            kind, data = recv_frame(sock)
+            if kind is None:
+                self.error("connection to proxy on %s lost" % host)
+                return SSH_FAILURE_EXITCODE
+            elif kind == 'x':
+                sock.close()
+                return int(data)
+            else:
+                os.write(outputs[kind], data)
+
+    def run(self, args):
+        """Run the command in ssh-like args, return the exit code"""
+        options, host, command = self.parse_args(args)
+        self.make_statedir()
+        host = self.normalize(host)
+
+        if self.config['MODE'] == 'ssh':
+            self.run_ssh(options, host, command)
+        else:
+            return self.run_proxy_command(host, command)
+
+
+def main(args=None):
+    """Main rshagent"""
+    if args is None:
+        args = sys.argv[1:]
+
+    config = get_config()
+    if args and args[0] == '--proxy':
+        run_proxy(args[1], args[2], config['IDLE'])
+        sys.exit(0)
+
+    try:
+        sys.exit(RshAgent(config).run(args))
+    except ValueError, err:
+        sys.stderr.write("rshagent: %s\n" % err)
+        sys.exit(SSH_FAILURE_EXITCODE)
@@ -0,0 +1,196 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+sshtree: ssh replacement (eg for mpdboot --rsh or the hydra launcher exec) that bounds and retries
+the remote shell connection setup
+
+    sshtree [ssh options] host command
+
+The remote command is started directly on host. The launcher calls sshtree once per host
+and builds the k-ary launch tree: mympirun sets its fan-out (option sshtreefanout,
+hydra --branch-count and mpdboot --maxbranch), so every reached node starts the remote shells of its children.
+On each node, at most concurrency remote shells are being set up at the same time (node local lock files).
+A remote shell that fails before the remote command started (eg sshd refused the connection)
+is retried with exponential backoff and jitter.
+
+Configuration is with environment variables MYMPIRUN_SSHTREE_<name> (see DEFAULTS).
+
+@author: Stijn De Weirdt
+"""
+
+import errno
+import fcntl
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ENVIRONMENT_PREFIX = 'MYMPIRUN_SSHTREE_'
+DEFAULTS = {
+    'CONCURRENCY': 16,  # max number of remote shells being set up per node
+    'RETRIES': 3,
+    'BACKOFF': 0.5,  # initial backoff in seconds, doubles with each retry
+    'RSH': 'ssh',
+    'ID': 'default',  # eg the mympirun jobid, to separate the lock files
+    'LOCKDIR': None,  # default: node local temporary directory
+}
+
+READY_MARKER = 'MYMPIRUN_SSHTREE_READY'
+SSH_FAILURE_EXITCODE = 255
+SSH_OPTIONS_WITH_ARGUMENT = 'bcDEeFIiLlmOoPpRSWw'
+
+
+def parse_args(args):
+    """Split the ssh-like args in (ssh options, host, command)"""
+    options = []
+    idx = 0
+    while idx < len(args) and args[idx].startswith('-'):
+        options.append(args[idx])
+        if args[idx][-1] in SSH_OPTIONS_WITH_ARGUMENT and len(args[idx]) == 2:
+            idx += 1
+            options.append(args[idx])
+        idx += 1
+
+    if idx >= len(args):
+        raise ValueError("no host found in %s" % args)
+
+    return options, args[idx], ' '.join(args[idx + 1:])
+
+
+def get_config(environ=None):
+    """Return the configuration dict from the environment"""
+    if environ is None:
+        environ = os.environ
+
+    config = {}
+    for name, default in DEFAULTS.items():
+        value = environ.get(ENVIRONMENT_PREFIX + name, default)
+        if isinstance(default, int):
+            value = int(value)
+        elif isinstance(default, float):
+            value = float(value)
+        config[name] = value
+
+    if config['LOCKDIR'] is None:
+        config['LOCKDIR'] = os.path.join(tempfile.gettempdir(), "sshtree_%s_%s" % (os.getuid(), config['ID']))
+    return config
+
+
+class SshTree(object):
+    """Start a command on a host with bounded concurrency and retries"""
+
+    def __init__(self, config):
+        self.config = config
+
+    def error(self, msg):
+        """Report error on stderr (stdout is the output of the remote command)"""
+        sys.stderr.write("sshtree: %s\n" % msg)
+
+    def acquire_slot(self):
+        """Return an open file with a lock on one of the concurrency slots of this node"""
+        lockdir = self.config['LOCKDIR']
+        try:
+            os.mkdir(lockdir, 0700)
+        except OSError, err:
+            if not err.errno == errno.EEXIST:
+                raise
+
+        while True:
+            for slot in range(max(self.config['CONCURRENCY'], 1)):
+                fh = open(os.path.join(lockdir, "slot_%s" % slot), 'a')
+                try:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fh
+                except IOError:
+                    fh.close()
+            time.sleep(random.uniform(0.05, 0.2))
+
+    def run_once(self, host, options, command):
+        """
+        Start command on host with the remote shell
+            return tuple (started, exitcode); started is False if the remote command did not start
+        """
+        slot = self.acquire_slot()
+        started = False
+        try:
+            cmd = self.config['RSH'].split() + options + [host, "echo %s; %s" % (READY_MARKER, command)]
+            # close_fds: the remote shell must not inherit (and hold) the lock of the slot
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, close_fds=True)
+
+            # pass output before the marker (eg banners)
+            while True:
+                line = proc.stdout.readline()
+                if not line:
+                    break
+                if line.strip() == READY_MARKER:
+                    started = True
+                    break
+                sys.stdout.write(line)
+        finally:
+            # once the remote command runs, the slot is free for the next connection
+            slot.close()
+
+        sys.stdout.flush()
+        if started:
+            while True:
+                data = os.read(proc.stdout.fileno(), 65536)
+                if not data:
+                    break
+                os.write(sys.stdout.fileno(), data)
+
+        return started, proc.wait()
+
+    def run(self, args):
+        """Run sshtree with ssh-like args, return the exit code"""
+        options, host, command = parse_args(args)
+
+        backoff = self.config['BACKOFF']
+        attempt = 0
+        while True:
+            started, ec = self.run_once(host, options, command)
+            if started or not ec == SSH_FAILURE_EXITCODE or attempt >= self.config['RETRIES']:
+                break
+            attempt += 1
+            sleep = backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            self.error("failed to connect to %s (ec %s), retry %s of %s in %.2f seconds" %
+                       (host, ec, attempt, self.config['RETRIES'], sleep))
+            time.sleep(sleep)
+
+        if not started and ec > 0:
+            self.error("failed to start command on %s (ec %s)" % (host, ec))
+        return ec
+
+
+def main(args=None):
+    """Main sshtree"""
+    if args is None:
+        args = sys.argv[1:]
+    try:
+        sys.exit(SshTree(get_config()).run(args))
+    except ValueError, err:
+        sys.stderr.write("sshtree: %s\n" % err)
+        sys.exit(SSH_FAILURE_EXITCODE)
@@ -0,0 +1,116 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Stall detection: abort an mpirun that makes no progress (eg a deadlocked MPI job)
+
+The progress signals are sampled at low frequency, cheapest first:
+    - the bytes of output of mpirun
+    - the cputime of the mpirun process tree on this node (only without new output)
+    - optionally, the cputime on the remote nodes (only without local progress)
+mpirun is stalled when none of them increased for the stall window.
+
+@author: Stijn De Weirdt
+"""
+
+import time
+
+from vsc.mympirun.proctree import tree_cputime
+
+SAMPLE_INTERVAL = 60  # seconds between the samples
+CPU_MIN_PROGRESS = 1.0  # increase of the cputime (in seconds) between 2 samples that counts as progress
+
+STALL_EXITCODE = 124  # exitcode of mympirun after aborting a stalled mpirun
+
+
+class StallException(Exception):
+    """mpirun was aborted because it made no progress"""
+    pass
+
+
+class StallDetector(object):
+    """
+    Detect a stalled mpirun from the progress samples
+        @param window: seconds without progress before mpirun is stalled
+        @param interval: seconds between the samples (at most a quarter of the window)
+        @param cputime: function with the pid of mpirun as argument, returns the cputime of its process tree
+        @param remote: function without arguments that returns the cputime on the remote nodes (None: not sampled)
+        @param clock: function that returns the current time (eg a fake clock for the tests)
+    """
+
+    def __init__(self, window, interval=SAMPLE_INTERVAL, cputime=tree_cputime, remote=None, clock=time.time,
+                 cpu_min=CPU_MIN_PROGRESS):
+        self.window = window
+        self.interval = min(interval, window / 4.0)
+        self.cputime = cputime
+        self.remote = remote
+        self.clock = clock
+        self.cpu_min = cpu_min
+        self.reset()
+
+    def reset(self):
+        """Start over for a new mpirun: the stall window starts now, the first samples are new references"""
+        self.last_sample = self.clock()
+        self.last_progress = self.last_sample
+        self.last = {}  # last value per progress signal, None if it was not sampled
+        self.samples = dict([(x, 0) for x in ('output', 'cputime', 'remote')])
+        self.stalled = False
+
+    def progress(self, name, value, minimum=0):
+        """Return True if progress signal name increased more than minimum since its last sample"""
+        last = self.last.get(name, None)
+        self.last[name] = value
+        self.samples[name] += 1
+        return last is not None and value is not None and value - last > minimum
+
+    def skip(self, name):
+        """Progress signal name is not sampled, the next sample is a new reference"""
+        self.last[name] = None
+
+    def check(self, pid, output):
+        """
+        Sample the progress signals (at most once per interval), return True if mpirun is stalled
+            @param output: total bytes of output of mpirun so far
+        """
+        now = self.clock()
+        if now - self.last_sample < self.interval:
+            return self.stalled
+        self.last_sample = now
+
+        progressed = self.progress('output', output)
+        if progressed:
+            self.skip('cputime')
+        else:
+            progressed = self.progress('cputime', self.cputime(pid), self.cpu_min)
+
+        if self.remote is not None:
+            if progressed:
+                self.skip('remote')
+            else:
+                progressed = self.progress('remote', self.remote(), self.cpu_min)
+
+        if progressed:
+            self.last_progress = now
+        self.stalled = now - self.last_progress >= self.window
+        return self.stalled
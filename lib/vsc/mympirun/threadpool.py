@@ -0,0 +1,106 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Bounded concurrency helpers (eg to resolve or probe many nodes at once)
+
+@author: Stijn De Weirdt
+"""
+
+import threading
+import time
+
+from vsc.utils.fancylogger import getLogger
+
+_log = getLogger('threadpool')
+
+DEFAULT_WORKERS = 16
+
+
+def bounded_map(func, items, workers=DEFAULT_WORKERS, stop=None, timeout=None):
+    """
+    Apply func to each element of items, using at most workers threads.
+    Returns the list of results, in the order of items.
+
+    Items are started in order, so when an item finishes, all items before it have at least started.
+        @param stop: function with arguments (item, result); when it returns True, no new items are started
+        @param timeout: total time budget in seconds; results of items that did not finish in time are None
+
+    An exception raised by func is logged, the result for that item is None.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    if len(items) == 0:
+        return results
+
+    state = {'next': 0}
+    lock = threading.Lock()
+    halt = threading.Event()
+
+    def worker():
+        while not halt.isSet():
+            lock.acquire()
+            try:
+                idx = state['next']
+                if idx >= len(items):
+                    return
+                state['next'] = idx + 1
+            finally:
+                lock.release()
+
+            try:
+                res = func(items[idx])
+            except Exception, err:
+                _log.error("bounded_map: func %s failed for item %s: %s" % (func, items[idx], err))
+                res = None
+            results[idx] = res
+
+            if stop is not None and stop(items[idx], res):
+                _log.debug("bounded_map: stop condition reached for item %s (idx %s)" % (items[idx], idx))
+                halt.set()
+
+    threads = []
+    for _ in range(min(max(workers, 1), len(items))):
+        thread = threading.Thread(target=worker)
+        thread.setDaemon(True)  # don't block exit on hanging items
+        thread.start()
+        threads.append(thread)
+
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+
+    for thread in threads:
+        if deadline is None:
+            thread.join()
+        else:
+            thread.join(max(deadline - time.time(), 0))
+
+    if [thread for thread in threads if thread.isAlive()]:
+        halt.set()
+        _log.warning("bounded_map: timeout %s seconds reached, %s of %s items started" %
+                     (timeout, state['next'], len(items)))
+
+    # copy, threads still running after a timeout can't modify the returned list
+    return results[:]
@@ -0,0 +1,257 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Node topology (sockets, cores, hyperthreads, NUMA nodes, shared caches) from sysfs
+and the pinning policies based on it
+
+@author: Stijn De Weirdt
+"""
+
+import os
+import re
+
+from vsc.utils.fancylogger import getLogger
+
+SYSFS_SYSTEM = '/sys/devices/system'
+
+PINNING_POLICIES = ['compact', 'packed', 'spread', 'cycle']
+
+
+def parse_cpulist(txt):
+    """Convert a sysfs cpulist (eg 0-3,8,10-11) in a list of ints"""
+    res = []
+    for part in [x.strip() for x in txt.strip().split(',') if len(x.strip()) > 0]:
+        if '-' in part:
+            start, end = part.split('-')
+            res.extend(range(int(start), int(end) + 1))
+        else:
+            res.append(int(part))
+    return res
+
+
+def make_cpulist(cpus):
+    """Convert a list of cpus in a comma-separated string"""
+    return ','.join(["%s" % x for x in cpus])
+
+
+class Topology(object):
+    """
+    Topology of the (allowed) cpus of a node
+
+    Each hardware thread (cpu) has a socket, a physical core, a NUMA node and a last level cache domain.
+    Missing sysfs information falls back to one socket, one NUMA node and one core per cpu.
+    """
+
+    def __init__(self, cpus=None, sysfs=SYSFS_SYSTEM):
+        """
+        @param cpus: list of allowed cpus (default: all online cpus)
+        @param sysfs: path to the sysfs system tree (eg a fake tree for testing)
+        """
+        self.log = getLogger(self.__class__.__name__)
+
+        self.sysfs = sysfs
+
+        self.socket = {}
+        self.core = {}
+        self.numa = {}
+        self.cache = {}  # cpu to last level cache domain (first cpu of the shared_cpu_list)
+
+        self.cpus = self._read_cpus(cpus)
+        self._read_topology()
+        self._read_numa()
+
+        self.log.debug("Topology for cpus %s: socket %s core %s numa %s cache %s" %
+                       (self.cpus, self.socket, self.core, self.numa, self.cache))
+
+    def _read(self, *path):
+        """Return the content of the sysfs file path (None if it does not exist)"""
+        fn = os.path.join(self.sysfs, *path)
+        try:
+            return open(fn).read().strip()
+        except IOError:
+            return None
+
+    def _read_cpus(self, cpus):
+        """Return sorted list of cpus to use"""
+        online = self._read('cpu', 'online')
+        if online is None:
+            reg = re.compile(r'^cpu(\d+)$')
+            try:
+                online = [int(r.group(1)) for r in [reg.search(x) for x in os.listdir(os.path.join(self.sysfs, 'cpu'))]
+                          if r]
+            except OSError:
+                online = []
+        else:
+            online = parse_cpulist(online)
+
+        if cpus is None:
+            res = online
+        elif len(online) == 0:
+            res = list(cpus)
+        else:
+            res = [x for x in cpus if x in online]
+
+        res.sort()
+        return res
+
+    def _read_topology(self):
+        """Read socket, core and last level cache for each cpu"""
+        for cpu in self.cpus:
+            cpudir = "cpu%s" % cpu
+
+            socket = self._read('cpu', cpudir, 'topology', 'physical_package_id')
+            core = self._read('cpu', cpudir, 'topology', 'core_id')
+            if socket is None or core is None:
+                self.socket[cpu] = 0
+                self.core[cpu] = (0, cpu)
+            else:
+                self.socket[cpu] = int(socket)
+                self.core[cpu] = (int(socket), int(core))
+
+            # highest cache level with data/unified cache
+            self.cache[cpu] = None
+            level = -1
+            index = 0
+            while True:
+                cachelevel = self._read('cpu', cpudir, 'cache', "index%s" % index, 'level')
+                if cachelevel is None:
+                    break
+                cachetype = self._read('cpu', cpudir, 'cache', "index%s" % index, 'type')
+                shared = self._read('cpu', cpudir, 'cache', "index%s" % index, 'shared_cpu_list')
+                if shared and not cachetype == 'Instruction' and int(cachelevel) > level:
+                    level = int(cachelevel)
+                    self.cache[cpu] = parse_cpulist(shared)[0]
+                index += 1
+
+            if self.cache[cpu] is None:
+                self.cache[cpu] = self.socket[cpu]
+
+    def _read_numa(self):
+        """Read the NUMA node of each cpu"""
+        reg = re.compile(r'^node(\d+)$')
+        try:
+            nodes = [int(r.group(1)) for r in [reg.search(x) for x in os.listdir(os.path.join(self.sysfs, 'node'))]
+                     if r]
+        except OSError:
+            nodes = []
+
+        for node in nodes:
+            cpulist = self._read('node', "node%s" % node, 'cpulist')
+            if cpulist is None:
+                continue
+            for cpu in parse_cpulist(cpulist):
+                if cpu in self.cpus:
+                    self.numa[cpu] = node
+
+        for cpu in self.cpus:
+            if not cpu in self.numa:
+                self.numa[cpu] = 0
+
+    def cores(self):
+        """Return list of physical cores (each a list of its allowed hardware threads), in compact order"""
+        cores = {}
+        for cpu in self.cpus:
+            cores.setdefault(self.core[cpu], []).append(cpu)
+        keys = cores.keys()
+        keys.sort()
+        return [cores[key] for key in keys]
+
+    def numa_nodes(self, cpus):
+        """Return the sorted list of NUMA nodes of cpus"""
+        res = []
+        for cpu in cpus:
+            if not self.numa[cpu] in res:
+                res.append(self.numa[cpu])
+        res.sort()
+        return res
+
+    def units(self, physcore=False):
+        """
+        Return the list of pinning units in compact order: each unit is a list of cpus
+            - physcore: a unit is a physical core (all its hardware threads)
+            - otherwise a unit is a single hardware thread (siblings are consecutive)
+        """
+        if physcore:
+            return self.cores()
+        else:
+            return [[cpu] for core in self.cores() for cpu in core]
+
+    def _spread_order(self, blocks):
+        """Reorder the blocks (lists of cpus) round robin over the last level cache domains"""
+        domains = []
+        per_domain = {}
+        for block in blocks:
+            domain = self.cache[block[0]]
+            if not domain in per_domain:
+                domains.append(domain)
+                per_domain[domain] = []
+            per_domain[domain].append(block)
+
+        res = []
+        idx = 0
+        while len(res) < len(blocks):
+            for domain in domains:
+                if idx < len(per_domain[domain]):
+                    res.append(per_domain[domain][idx])
+            idx += 1
+        return res
+
+    def rank_map(self, policy, nranks, domain=1, physcore=False):
+        """
+        Return list with for each local rank the list of cpus to pin on
+            @param policy: compact/packed, spread or cycle
+            @param domain: number of units per rank (eg for hybrid/threaded ranks)
+            @param physcore: a unit is a physical core (one rank per core) instead of a hardware thread
+
+        compact: consecutive ranks on consecutive units (hyperthread siblings first)
+        spread: ranks round robin over the last level cache domains (sockets), using all physical cores
+                before hyperthread siblings
+        cycle: as compact, with the rank modulo number of blocks (eg more ranks than cores)
+        """
+        if not policy in PINNING_POLICIES:
+            self.log.raiseException("rank_map: unsupported policy %s (supported %s)" % (policy, PINNING_POLICIES))
+
+        units = self.units(physcore=physcore)
+        if len(units) == 0:
+            self.log.raiseException("rank_map: no cpus found")
+
+        domain = max(min(domain, len(units)), 1)
+        nblocks = len(units) // domain
+
+        if policy == 'spread' and domain == 1 and not physcore:
+            # all first hardware threads of the cores, then the second ones etc
+            blocks = []
+            cores = self.cores()
+            for thread in range(max([len(core) for core in cores])):
+                blocks.extend(self._spread_order([[core[thread]] for core in cores if thread < len(core)]))
+        else:
+            blocks = [reduce(lambda x, y: x + y, units[idx * domain:(idx + 1) * domain]) for idx in range(nblocks)]
+            if policy == 'spread':
+                blocks = self._spread_order(blocks)
+
+        res = [blocks[rank % len(blocks)] for rank in range(nranks)]
+        self.log.debug("rank_map: policy %s nranks %s domain %s physcore %s: %s" %
+                       (policy, nranks, domain, physcore, res))
+        return res
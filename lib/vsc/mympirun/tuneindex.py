@@ -0,0 +1,166 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Index of the Intel MPI mpitune configuration files in a directory
+    <app>_<device>_nn_<#nodes>_np_<#processes>_ppn_<#processes/node>.conf
+
+The directory is scanned once into an index file; the index is rebuilt when the mtime of the directory changes.
+
+@author: Stijn De Weirdt
+"""
+
+import cPickle
+import os
+import re
+import stat
+
+from vsc.utils.fancylogger import getLogger
+
+TUNE_FILENAME_REGEX = re.compile(r"^(?P<app>.+)_(?P<device>[^_]+)_nn_(?P<nn>\d+)_np_(?P<np>\d+)_ppn_(?P<ppn>\d+)"
+                                 r"\.conf$")
+
+# weights of the (nn, np, ppn) differences in the distance
+DISTANCE_WEIGHTS = (1, 10, 1)
+
+
+def parse_tune_filename(filename):
+    """Return tuple ((app, device), (nn, np, ppn)) for the tuning config filename, None if it doesn't match"""
+    res = TUNE_FILENAME_REGEX.search(os.path.basename(filename))
+    if res is None:
+        return None
+    return ((res.group('app'), res.group('device')),
+            (int(res.group('nn')), int(res.group('np')), int(res.group('ppn'))))
+
+
+def tune_device_name(device):
+    """Return the device name as used in the tuning config filenames (eg shm:dapl -> shm-dapl)"""
+    return device.replace(':', '-')
+
+
+class TuneIndex(object):
+    """
+    On-disk index of the tuning config files in path, stored in indexfile:
+        dict with (app, device) as key and the list of ((nn, np, ppn), filename) as value
+    """
+
+    def __init__(self, path, indexfile):
+        """
+        @param path: directory with the mpitune config files
+        @param indexfile: filename of the index
+        """
+        self.log = getLogger(self.__class__.__name__)
+
+        self.path = path
+        self.indexfile = indexfile
+        self.index = None
+
+    def _mtime(self):
+        """Return the mtime of the tuning directory"""
+        return os.stat(self.path)[stat.ST_MTIME]
+
+    def _load(self, mtime):
+        """Return the index from the index file if it is up to date, None otherwise"""
+        if not os.path.isfile(self.indexfile):
+            return None
+
+        try:
+            fh = open(self.indexfile, 'rb')
+            try:
+                data = cPickle.load(fh)
+            finally:
+                fh.close()
+        except Exception, err:
+            self.log.warning("_load: failed to load index %s, rebuilding it: %s" % (self.indexfile, err))
+            return None
+
+        if data.get('path') == self.path and data.get('mtime') == mtime:
+            return data['index']
+
+        self.log.debug("_load: index %s is outdated" % self.indexfile)
+        return None
+
+    def scan(self):
+        """Scan the tuning directory, return the index"""
+        index = {}
+        for filename in os.listdir(self.path):
+            res = parse_tune_filename(filename)
+            if res is None:
+                continue
+            key, sizes = res
+            index.setdefault(key, []).append((sizes, filename))
+
+        for entries in index.values():
+            entries.sort()
+
+        self.log.debug("scan: found %s tuning files for %s app/device combinations in %s" %
+                       (sum([len(x) for x in index.values()]), len(index), self.path))
+        return index
+
+    def _save(self, mtime):
+        """Write the index file"""
+        tmpfn = "%s.%s.tmp" % (self.indexfile, os.getpid())
+        try:
+            dirname = os.path.dirname(self.indexfile)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            fh = open(tmpfn, 'wb')
+            try:
+                cPickle.dump({'path': self.path, 'mtime': mtime, 'index': self.index}, fh, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                fh.close()
+            # atomic replace, there might be concurrent mympiruns
+            os.rename(tmpfn, self.indexfile)
+            self.log.debug("_save: wrote index %s" % self.indexfile)
+        except (IOError, OSError), err:
+            # non-fatal, next run will scan again
+            self.log.warning("_save: failed to write index %s: %s" % (self.indexfile, err))
+
+    def get_index(self):
+        """Return the index, from the index file or by (re)scanning the tuning directory"""
+        if self.index is None:
+            mtime = self._mtime()
+            self.index = self._load(mtime)
+            if self.index is None:
+                self.index = self.scan()
+                self._save(mtime)
+        return self.index
+
+    def lookup(self, app, device, nn, np, ppn):
+        """Return the full path of the nearest tuning config file for app and device, None if there is none"""
+        entries = self.get_index().get((app, tune_device_name(device)), [])
+
+        best = None
+        for sizes, filename in entries:
+            dist = sum([weight * abs(x - y) for weight, x, y in zip(DISTANCE_WEIGHTS, sizes, (nn, np, ppn))])
+            if best is None or dist < best[0]:
+                best = (dist, filename)
+
+        if best is None:
+            self.log.debug("lookup: no tuning file for app %s device %s in %s" % (app, device, self.path))
+            return None
+
+        self.log.debug("lookup: nearest tuning file for nn %s np %s ppn %s: %s (distance %s)" %
+                       (nn, np, ppn, best[1], best[0]))
+        return os.path.join(self.path, best[1])
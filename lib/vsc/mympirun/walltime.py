@@ -0,0 +1,118 @@
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Walltime aware termination: signal the mpirun process tree before the end of the walltime
+
+Before the end of the walltime (the deadline), the process tree gets
+    - the warning signal (eg SIGUSR1, for the application to checkpoint) warning seconds before the deadline
+    - SIGTERM grace seconds before the SIGKILL
+    - SIGKILL budget seconds before the deadline, so there is time left for the cleanup
+
+@author: Stijn De Weirdt
+"""
+
+import re
+import signal
+import time
+
+from vsc.mympirun.proctree import signal_tree
+
+TERM_GRACE = 30  # seconds between SIGTERM and SIGKILL
+CLEANUP_BUDGET = 30  # seconds left after SIGKILL for the cleanup
+
+WALLTIME_EXITCODE = 125  # exitcode of mympirun when mpirun was terminated for the walltime
+
+_WALLTIME_REGEX = re.compile(r"^(?:(?:(\d+):)?(\d+):)?(\d+)$")
+
+
+class WalltimeException(Exception):
+    """mpirun was terminated (or failed after the warning signal) before the end of the walltime"""
+    pass
+
+
+def parse_walltime(txt):
+    """Return the number of seconds of walltime txt ([[HH:]MM:]SS)"""
+    res = _WALLTIME_REGEX.search(("%s" % txt).strip())
+    if res is None:
+        raise ValueError("invalid walltime %s (expected [[HH:]MM:]SS)" % txt)
+    hours, minutes, seconds = [int(x or 0) for x in res.groups()]
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def get_signal(name):
+    """Return the signal number of name (eg USR1, SIGUSR1 or 10)"""
+    if ("%s" % name).isdigit():
+        return int(name)
+    name = ("%s" % name).upper()
+    if not name.startswith('SIG'):
+        name = "SIG%s" % name
+    res = getattr(signal, name, None)
+    if res is None:
+        raise ValueError("unknown signal %s" % name)
+    return res
+
+
+class WalltimeGuard(object):
+    """
+    Signal the process tree according to the termination schedule before the deadline
+        @param clock: function that returns the current time (eg a fake clock in the tests)
+        @param send: function with pid and signal number as arguments (default: signal the process tree)
+    """
+
+    def __init__(self, deadline, warning, signum, grace=TERM_GRACE, budget=CLEANUP_BUDGET, clock=time.time,
+                 send=signal_tree):
+        self.deadline = deadline
+        self.clock = clock
+        self.send = send
+
+        self.schedule = [
+            (deadline - warning, signum, 'warning'),
+            (deadline - budget - grace, signal.SIGTERM, 'terminate'),
+            (deadline - budget, signal.SIGKILL, 'kill'),
+        ]
+        self.schedule.sort()
+        self.sent = []  # list of (time, signum, name)
+        self.killed = False
+
+    def next_step(self):
+        """Return the time of the next step (None if all steps are done)"""
+        if self.schedule:
+            return self.schedule[0][0]
+        return None
+
+    def terminated(self):
+        """Return True if SIGTERM or SIGKILL was sent"""
+        return len([x for x in self.sent if not x[2] == 'warning']) > 0
+
+    def check(self, pid):
+        """Send the signals that are due to the process tree of pid; return True once SIGKILL is sent"""
+        now = self.clock()
+        while self.schedule and self.schedule[0][0] <= now:
+            _, signum, name = self.schedule.pop(0)
+            self.send(pid, signum)
+            self.sent.append((now, signum, name))
+            if signum == signal.SIGKILL:
+                self.killed = True
+        return self.killed
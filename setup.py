@@ -41,7 +41,8 @@ PACKAGE = {
     'author': [sdw],
     'maintainer': [sdw],
     'packages': ['vsc.mympirun', 'vsc.mympirun.mpi', 'vsc.mympirun.rm', 'vsc.mympirun.external', 'vsc'],
-    'scripts': ['bin/mympirun.py', 'bin/pbsssh.sh', 'bin/sshsleep.sh', 'bin/mympisanity.py'],
+    'scripts': ['bin/mympirun.py', 'bin/pbsssh.sh', 'bin/rshagent.py', 'bin/sshsleep.sh', 'bin/sshtree.py',
+                'bin/mympisanity.py', 'bin/mympingpong.py'],
     'cmdclass': {
         "install_scripts": mympirun_vsc_install_scripts,
     },
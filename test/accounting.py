@@ -0,0 +1,120 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.accounting module and the accounting wrapper.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.accounting import format_record, parse_record, read_records, run_rank, summarize
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.mpi import MPI
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.rm.local import Local
+
+
+def make_record(rank, host, wall, cpu, maxrss, localrank=-1, exitcode=0):
+    """Return record dict (cpu is user time)"""
+    return {'rank': rank, 'host': host, 'localrank': localrank, 'wall': wall, 'utime': cpu, 'stime': 0.0,
+            'maxrss': maxrss, 'exitcode': exitcode}
+
+
+class TestAccounting(TestCase):
+    """Tests for the per rank accounting"""
+
+    def setUp(self):
+        """Make temporary directory"""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Cleanup"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_records(self):
+        """Test the record format, merging and summary"""
+        record = make_record(9999, 'node1234.cluster.example.org', 86400.0, 86000.123, 123456789, localrank=35)
+        line = format_record(record)
+        self.assertTrue(len(line) < 80)
+        self.assertEqual(parse_record(line), record)
+        self.assertEqual(parse_record("1 n1 0 broken\n"), None)
+
+        for record in [make_record(3, 'n2', 10.0, 4.0, 300), make_record(0, 'n1', 10.0, 10.0, 100),
+                       make_record(1, 'n1', 10.0, 8.0, 200), make_record(2, 'n2', 10.0, 2.0, 400, exitcode=1)]:
+            open(os.path.join(self.tmpdir, "rank_%s" % record['rank']), 'w').write(format_record(record))
+        records = read_records(self.tmpdir)
+        self.assertEqual([(x['rank'], x['localrank']) for x in records], [(0, 0), (1, 1), (2, 0), (3, 1)])
+
+        summary = summarize(records)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(summary['nodes']['n1']['maxrss'], 200)
+        self.assertEqual(summary['nodes']['n2']['totalrss'], 700)
+        self.assertEqual(summary['cpu'], (2.0, 6.0, 10.0))
+        self.assertAlmostEqual(summary['efficiency'], 0.6)
+        self.assertAlmostEqual(summary['imbalance'], 10.0 / 6.0)
+
+    def test_run_rank(self):
+        """Test recording the resource usage of a command"""
+        status = run_rank(self.tmpdir, ['sh', '-c', 'exit 3'], environ={'PMI_RANK': '5'})
+        self.assertEqual(os.WEXITSTATUS(status), 3)
+        record = read_records(self.tmpdir)[0]
+        self.assertEqual((record['rank'], record['localrank'], record['exitcode']), (5, 0, 3))
+        self.assertTrue(record['maxrss'] > 0)
+
+    def test_wrapper(self):
+        """Test the accounting wrapper and the summary at cleanup"""
+        accountingfile = os.path.join(self.tmpdir, 'accounting')
+        m = MympirunOption()
+        m.parseoptions(options_list=['--accounting', accountingfile, '--basepath', self.tmpdir, 'echo', 'foo'])
+        inst = getinstance(MPI, Local, m)
+        inst.make_mympirundir()
+        wrapper = inst.make_exe_cmd(inst.cmdargs)[0]
+
+        for rank in range(2):
+            env = os.environ.copy()
+            env['OMPI_COMM_WORLD_RANK'] = "%s" % rank
+            proc = subprocess.Popen([wrapper, 'sh', '-c', 'echo rank; kill -USR1 $$'], env=env,
+                                    stdout=subprocess.PIPE)
+            self.assertEqual(proc.communicate()[0], "rank\n")
+            # the signal is passed on
+            self.assertEqual(proc.returncode, -signal.SIGUSR1)
+
+        inst.cleanup()
+        self.assertFalse(os.path.exists(inst.mympirundir))
+        lines = open(accountingfile).read().splitlines()
+        self.assertTrue(lines[0].startswith('# 2 ranks on 1 nodes, 2 failed'))
+        self.assertEqual([parse_record(x)['rank'] for x in lines if not x.startswith('#')], [0, 1])
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestAccounting)
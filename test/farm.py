@@ -0,0 +1,133 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.farm module and the farm mode.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.farm import SlotPool, TaskFarm, parse_tasks
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.intelmpi import IntelMPI
+from vsc.mympirun.mpi.mpi import MPI
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.rm.local import Local
+
+
+class TestFarm(TestCase):
+    """Tests for the task farm"""
+
+    def setUp(self):
+        """Make temporary directory"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+
+    def tearDown(self):
+        """Cleanup"""
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_tasks(self):
+        """Test parsing the tasks file"""
+        txt = "# sweep\n4 ./a.out --x 1\n\n  16 ./a.out 'with space'\n"
+        self.assertEqual(parse_tasks(txt), [(4, ['./a.out', '--x', '1']), (16, ['./a.out', 'with space'])])
+        self.assertRaises(ValueError, parse_tasks, "./a.out\n")
+        self.assertRaises(ValueError, parse_tasks, "4\n")
+
+    def test_slot_pool(self):
+        """Test the slot allocation"""
+        pool = SlotPool([('n1', 8), ('n2', 8), ('n3', 4)])
+        self.assertEqual(pool.total, 20)
+        # best fit on one host
+        self.assertEqual(pool.allocate(4), [('n3', 4)])
+        self.assertEqual(pool.allocate(6), [('n1', 6)])
+        # spread over the hosts with the most free slots
+        self.assertEqual(pool.allocate(9), [('n2', 8), ('n1', 1)])
+        self.assertEqual(pool.allocate(2), None)
+        pool.release([('n2', 8)])
+        self.assertEqual(pool.allocate(2), [('n2', 2)])
+
+    def test_task_farm(self):
+        """Test running tasks concurrently, freed slots are filled right away"""
+        tasks = [(2, ['sleep', '1']), (2, ['sleep', '0.1']), (2, ['exit', '3']), (1, ['true']), (8, ['true'])]
+        pool = SlotPool([('n1', 4)])
+
+        def make_cmd(idx, task, allocation):
+            return " ".join(task[1])
+
+        def outputs(idx):
+            return os.path.join(self.tmpdir, "%s.out" % idx)
+
+        start = time.time()
+        results = TaskFarm(tasks, pool, make_cmd, outputs).run()
+        self.assertTrue(time.time() - start < 2)
+        self.assertEqual([x['ec'] for x in results[:4]], [0, 0, 3, 0])
+        # too large for the allocation
+        self.assertEqual(results[4], None)
+        # tasks 2 and 3 started in the slots of task 1, while task 0 was still running
+        self.assertTrue(results[2]['start'] < results[0]['end'])
+        self.assertTrue(results[3]['start'] < results[0]['end'])
+        self.assertEqual(pool.free, {'n1': 4})
+
+    def test_mpi_farm(self):
+        """Test the farm mode with the local scheduler and the dummy mpirun"""
+        tasksfile = os.path.join(self.tmpdir, 'tasks.txt')
+        open(tasksfile, 'w').write("2 ./a.out 1\n1 ./a.out 2\n3 ./a.out 3\n")
+        os.chdir(self.tmpdir)
+
+        m = MympirunOption()
+        m.parseoptions(options_list=['--farm', tasksfile, '--basepath', self.tmpdir])
+        inst = getinstance(MPI, Local, m)
+        inst.noderuns = [('localhost', 4)]
+        inst.nrnodes = 4
+        inst.set_ppn()
+        # the farm tasks make their own commands, no launch for the whole job
+        inst.mpirun_prepare_execution = lambda: self.fail("mpirun_prepare_execution called in farm mode")
+        inst.main()
+
+        self.assertEqual([x['ec'] for x in inst.farm_results], [0, 0, 0])
+        self.assertEqual(inst.farm_results[2]['allocation'], [('localhost', 3)])
+        out = open(os.path.join(self.tmpdir, 'tasks.txt.2.out')).read()
+        self.assertTrue('farm_2_nodes' in out)
+        self.assertTrue('-np 3' in out)
+        self.assertTrue(out.strip().endswith('./a.out 3'))
+        self.assertFalse(os.path.exists(inst.mympirundir))
+
+        # the mpd rings of concurrent tasks conflict
+        inst = getinstance(IntelMPI, Local, m)
+        self.assertRaises(Exception, inst.main)
+        self.assertEqual(inst.mpinoderuns, None)
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestFarm)
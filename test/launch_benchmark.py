@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+##
+# Copyright 2013 Ghent University
+#
+# This file is part of VSC-tools,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/VSC-tools
+#
+# VSC-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# VSC-tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with VSC-tools. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Launch overhead benchmark (not part of the test suite)
+
+For each MPI flavour and each number of slots, a synthetic PBS_NODEFILE is generated
+and the full getinstance(...).main() path is run against a fake mpirun
+(that records its argv and environment size, and exits).
+Each case runs in a forked process (with its own basepath, so the probe cache is cold),
+to report its own peak RSS (from wait4, not the inherited peak RSS of the benchmark process).
+
+Run with eg
+    python test/launch_benchmark.py --slots 1,100,10000 --flavours IntelHydraMPI,OpenMPI
+
+The nodes are 127.0.x.y ip addresses (127.0.0.1 is the local node), so no DNS is needed.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import cPickle
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from vsc.utils import fancylogger
+from vsc.mympirun.launchprofile import launch_profile
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.intelmpi import IntelMPI, IntelHydraMPI
+from vsc.mympirun.mpi.mpich import MVAPICH2Hydra, MPICH2Hydra
+from vsc.mympirun.mpi.openmpi import OpenMPI
+from vsc.mympirun.mpi.qlogicmpi import QLogicMPI
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.rm.pbs import PBS
+
+FLAVOURS = [IntelMPI, IntelHydraMPI, OpenMPI, MVAPICH2Hydra, MPICH2Hydra, QLogicMPI]
+SLOTS = [1, 10, 100, 1000, 10000, 100000]
+PPN = 20
+
+RECORD_VARIABLE = 'MYMPIRUN_BENCHMARK_RECORD'
+
+FAKE_MPIRUN = """#!/bin/bash
+# fake mpirun for the mympirun launch benchmark
+if [ "$1" == "-info" ]; then
+    echo "    Launchers available:                     ssh rsh fork slurm ll lsf sge manual persist"
+    echo "    Resource management kernels available:   user slurm ll lsf sge pbs cobalt"
+    exit 0
+fi
+args="$@"
+echo "$# ${#args} `env | wc -c`" > "$%s"
+""" % RECORD_VARIABLE
+
+
+def make_nodefile(path, slots, ppn=PPN):
+    """Write a synthetic PBS nodefile with slots entries, ppn slots per node; return the filename"""
+    ppn = min(ppn, slots)
+    fn = os.path.join(path, "nodefile_%s" % slots)
+    fh = open(fn, 'w')
+    for idx in range(slots // ppn):
+        # skip 127.0.0.0
+        fh.write(("127.0.%s.%s\n" % divmod(idx + 1, 256)) * ppn)
+    fh.close()
+    return fn
+
+
+def run_case(mpi, nodefile, basepath, record):
+    """Run the full launch of mpi with nodefile; return dict with the results"""
+    os.environ['PBS_NODEFILE'] = nodefile
+    os.environ['PBS_JOBID'] = 'benchmark'
+    os.environ[RECORD_VARIABLE] = record
+
+    start = time.time()
+    sys.argv = sys.argv[:1]  # MympirunOption also parses sys.argv
+    mo = MympirunOption()
+    mo.parseoptions(options_list=['--profilelaunch', '--basepath', basepath, 'true'])
+    getinstance(mpi, PBS, mo).main()
+    walltime = time.time() - start
+
+    nrargs, cmdlength, envsize = [int(x) for x in open(record).read().split()]
+    report = launch_profile.report()
+    return {
+        'walltime': walltime,
+        'nrargs': nrargs,
+        'cmdlength': cmdlength,
+        'envsize': envsize,
+        'nodefile': report['bytes_written'].get('nodefile', 0),
+        'subprocesses': report['subprocesses'],
+    }
+
+
+def run_forked(func, *args):
+    """
+    Run func with args in a forked process
+        return tuple (result or the exception as string, peak RSS in kB of the forked process)
+    """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        try:
+            res = func(*args)
+        except (Exception, SystemExit), err:
+            res = "%s" % err
+        os.write(wfd, cPickle.dumps(res))
+        os._exit(0)
+
+    os.close(wfd)
+    data = []
+    while True:
+        txt = os.read(rfd, 4096)
+        if not txt:
+            break
+        data.append(txt)
+    os.close(rfd)
+    rusage = os.wait4(pid, 0)[2]
+    return cPickle.loads(''.join(data)), rusage.ru_maxrss
+
+
+def main():
+    """Run the benchmark"""
+    parser = OptionParser()
+    parser.add_option('--slots', default=','.join([str(x) for x in SLOTS]),
+                      help="Comma-separated list of number of slots (default %default)")
+    parser.add_option('--flavours', default=','.join([x.__name__ for x in FLAVOURS]),
+                      help="Comma-separated list of MPI flavours (default %default)")
+    opts, _ = parser.parse_args()
+
+    flavours = dict([(x.__name__, x) for x in FLAVOURS])
+    tmpdir = tempfile.mkdtemp(prefix='mympirun_benchmark_')
+    fancylogger.logToScreen(enable=False)
+
+    try:
+        fake_mpirun = os.path.join(tmpdir, 'mpirun')
+        open(fake_mpirun, 'w').write(FAKE_MPIRUN)
+        os.chmod(fake_mpirun, stat.S_IRWXU)
+        os.environ['PATH'] = os.pathsep.join([tmpdir, os.environ.get('PATH', '')])
+        record = os.path.join(tmpdir, 'record')
+
+        header = "%-14s %8s %10s %10s %8s %10s %10s %6s" % ('flavour', 'slots', 'walltime', 'maxrss_kb', 'nrargs',
+                                                           'cmdlength', 'nodefile', 'nrsub')
+        print header
+        for slots in [int(x) for x in opts.slots.split(',')]:
+            nodefile = make_nodefile(tmpdir, slots)
+            for name in opts.flavours.split(','):
+                basepath = os.path.join(tmpdir, "basepath_%s_%s" % (name, slots))
+                os.mkdir(basepath)
+                res, maxrss = run_forked(run_case, flavours[name], nodefile, basepath, record)
+                if isinstance(res, basestring):
+                    print "%-14s %8s failed: %s" % (name, slots, res)
+                else:
+                    print "%-14s %8s %10.3f %10s %8s %10s %10s %6s" % (name, slots, res['walltime'], maxrss,
+                                                                       res['nrargs'], res['cmdlength'],
+                                                                       res['nodefile'], res['subprocesses'])
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
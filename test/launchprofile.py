@@ -0,0 +1,126 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.launchprofile module.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.launchprofile import LaunchProfile, count_subprocesses, json, launch_profile
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.mpi import MPI
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.rm.local import Local
+
+
+class TestLaunchProfile(TestCase):
+    """Tests for the launch profile"""
+
+    def setUp(self):
+        """Make temporary directory, reset the global launch profile"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.orig_state = launch_profile.__dict__.copy()
+        launch_profile.__init__()
+
+    def tearDown(self):
+        """Cleanup, restore the global launch profile"""
+        launch_profile.__dict__.update(self.orig_state)
+        shutil.rmtree(self.tmpdir)
+
+    def test_disabled(self):
+        """Test that nothing is recorded when the profiling is disabled"""
+        profile = LaunchProfile()
+        self.assertEqual(profile.phase('test', lambda x: x + 1, 1), 2)
+        profile.add_phase('other', 1.0)
+        profile.add_subprocess()
+        profile.add_bytes('nodefile', 10)
+        self.assertEqual(profile.report(), {'phases': [], 'subprocesses': 0, 'bytes_written': {}})
+
+    def test_enabled(self):
+        """Test the nested phases, the counters and the JSON report"""
+        profile = LaunchProfile()
+        profile.enable()
+
+        def nested():
+            profile.add_subprocess(2)
+            profile.add_phase('timed', 0.5)
+            return profile.phase('inner', lambda: 'res')
+
+        self.assertEqual(profile.phase('outer', nested), 'res')
+        self.assertRaises(ValueError, profile.phase, 'failed', int, 'x')
+        profile.add_bytes('nodefile', 10)
+        profile.add_bytes('nodefile', 5)
+
+        report = profile.report()
+        self.assertEqual([x[0] for x in report['phases']], ['outer', 'outer/timed', 'outer/inner', 'failed'])
+        self.assertTrue(min([x[1] for x in report['phases']]) >= 0)
+        self.assertEqual(report['subprocesses'], 2)
+        self.assertEqual(report['bytes_written'], {'nodefile': 15})
+        self.assertTrue(report['walltime'] >= 0)
+
+        if json is not None:
+            profile.write(self.tmpdir)
+            written = json.load(open(os.path.join(self.tmpdir, 'launch_profile.json')))
+            self.assertEqual(written['subprocesses'], 2)
+
+    def test_count_subprocesses(self):
+        """Test the wrapper that counts the subprocesses of the run functions"""
+        def run_func(cmd):
+            """Run cmd"""
+            return 0, cmd
+
+        wrapped = count_subprocesses(run_func)
+        self.assertEqual((wrapped.__name__, wrapped.__doc__), ('run_func', 'Run cmd'))
+
+        self.assertEqual(wrapped('true'), (0, 'true'))
+        self.assertEqual(launch_profile.subprocesses, 0)
+        launch_profile.enable()
+        wrapped('true')
+        self.assertEqual(launch_profile.subprocesses, 1)
+
+    def test_mympirun(self):
+        """Test the subprocesses of a (dummy) mpirun launch with --profilelaunch"""
+        output = os.path.join(self.tmpdir, 'out')
+        m = MympirunOption()
+        m.parseoptions(options_list=['--profilelaunch', '--basepath', self.tmpdir, '--output', output,
+                                     '--outputsplit', 'count', 'echo', 'foo'])
+        getinstance(MPI, Local, m).main()
+        self.assertTrue('prepare' in [x[0] for x in launch_profile.report()['phases']])
+
+        # the node probes are cached now, only the mpirun itself (through the output engine) is left
+        launch_profile.__init__()
+        getinstance(MPI, Local, m).main()
+        self.assertEqual(launch_profile.report()['subprocesses'], 1)
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestLaunchProfile)
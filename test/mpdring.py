@@ -0,0 +1,151 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.mpdring module and the persistent mpd ring.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import signal
+import stat
+import tempfile
+import time
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.mpdring import MpdRing, parse_mpdtrace, pid_alive, run_watchdog
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.intelmpi import IntelMPI
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.rm.local import Local
+
+
+class TestMpdRing(TestCase):
+    """Tests for the persistent mpd ring"""
+
+    def setUp(self):
+        """Make temporary directory"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.ringdir = os.path.join(self.tmpdir, 'ring')
+
+    def tearDown(self):
+        """Cleanup, stop the watchdogs"""
+        state = MpdRing(self.ringdir).read_state()
+        if state is not None and pid_alive(state['watchdog']):
+            os.kill(state['watchdog'], signal.SIGKILL)
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_mpdtrace(self):
+        """Test parsing mpdtrace -l output"""
+        txt = "node001_40231 (10.1.0.1)\nnode002.cluster_51234 (10.1.0.2)\n"
+        self.assertEqual(parse_mpdtrace(txt), [('node001', 40231), ('node002.cluster', 51234)])
+        self.assertEqual(parse_mpdtrace("mpdtrace: cannot connect to local mpd\n"), [])
+
+    def test_state(self):
+        """Test the state, users and idle time of the ring"""
+        ring = MpdRing(self.ringdir)
+        self.assertTrue(ring.lock())
+        self.assertEqual(ring.read_state(), None)
+        ring.write_state('123.master', ['n1', 'n2'], 4321, 99)
+        self.assertEqual(ring.read_state(), {'jobid': '123.master', 'hosts': ['n1', 'n2'], 'port': 4321,
+                                             'watchdog': 99})
+
+        ring.register()
+        ring.register(pid=2 ** 22 + 1)  # no such process
+        self.assertEqual(ring.idle(), 0)
+        ring.unregister()
+        os.utime(os.path.join(self.ringdir, 'lastused'), (time.time() - 100, time.time() - 100))
+        self.assertTrue(ring.idle() >= 100)
+        self.assertEqual(os.listdir(os.path.join(self.ringdir, 'users')), [])
+        ring.unlock()
+
+        self.assertFalse(MpdRing(os.path.join(self.tmpdir, 'doesnotexist')).lock(create=False))
+
+    def test_watchdog(self):
+        """Test the teardown of the ring by the watchdog when the job is gone"""
+        ring = MpdRing(self.ringdir)
+        ring.lock()
+        ring.register()
+        ring.unlock()
+
+        # the ring is in use, so the watchdog only stops it when the job is gone: use a finished process as job
+        stopped = os.path.join(self.tmpdir, 'stopped')
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        run_watchdog(self.ringdir, pid, 3600, "touch %s" % stopped, interval=0.1)
+        self.assertTrue(os.path.exists(stopped))
+        self.assertFalse(os.path.exists(self.ringdir))
+
+    def test_mpdring_start(self):
+        """Test booting and reusing the ring with fake mpd commands"""
+        fakebin = os.path.join(self.tmpdir, 'bin')
+        os.mkdir(fakebin)
+        boots = os.path.join(self.tmpdir, 'boots')
+        for name, txt in [('mpdboot', "echo boot >> %s" % boots), ('mpdtrace', "echo localhost_4321 '(127.0.0.1)'"),
+                          ('mpdallexit', '')]:
+            fn = os.path.join(fakebin, name)
+            open(fn, 'w').write("#!/bin/bash\n%s\n" % txt)
+            os.chmod(fn, stat.S_IRWXU)
+
+        origpath = os.environ.get('PATH', '')
+        os.environ['PATH'] = os.pathsep.join([fakebin, origpath])
+        try:
+            for idx in range(2):
+                m = MympirunOption()
+                m.parseoptions(options_list=['--mpdring', '--basepath', self.tmpdir, 'echo', 'foo'])
+                inst = getinstance(IntelMPI, Local, m)
+                inst.id = 'ringjob'
+                self.ringdir = inst.get_mpdring_dir()
+                inst.mpdboot_options = ['--file=nodes']
+                inst.mpdring_start()
+                self.assertTrue(os.path.exists(os.path.join(self.ringdir, 'users', "%s" % os.getpid())))
+                inst.mpiexec_options = ['-np 1']
+                inst.make_mpirun()
+                self.assertEqual(inst.mpirun_cmd[:2], ['mpiexec', '-np 1'])
+                inst.mpdring.unregister()
+
+            # booted once, reused the second time
+            self.assertEqual(open(boots).read(), "boot\n")
+            state = inst.mpdring.read_state()
+            self.assertEqual((state['port'], state['hosts']), (4321, inst.uniquenodes))
+            self.assertTrue(pid_alive(state['watchdog']))
+            # the watchdog tracks the session leader (eg the job script), never mympirun itself
+            jobpid = os.getsid(0)
+            if jobpid == os.getpid():
+                jobpid = os.getppid()
+            self.assertEqual(inst.get_job_pid(), jobpid)
+            cmdline = open("/proc/%s/cmdline" % state['watchdog']).read().split('\0')
+            self.assertEqual(cmdline[3], "%s" % jobpid)
+        finally:
+            os.environ['PATH'] = origpath
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestMpdRing)
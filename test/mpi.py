@@ -31,14 +31,19 @@ Tests for the vsc.utils.missing module.
 @author: Jens Timmerman (Ghent University)
 """
 import os
+import shutil
 import stat
+import tempfile
+import time
 from unittest import TestCase, TestLoader
 
 
+import vsc.mympirun.mpi.mpi as mpi
 from vsc.mympirun.mpi.factory import getinstance
-from vsc.mympirun.mpi.mpi import MPI
+from vsc.mympirun.mpi.mpi import MPI, make_variables_regex, parse_environment
 from vsc.mympirun.rm.local import Local
 from vsc.mympirun.option import MympirunOption
+from vsc.utils.run import run_simple
 
 # we wish to use the mpirun we ship
 os.environ["PATH"] += os.pathsep + os.path.realpath(__file__)
@@ -60,6 +65,135 @@ class TestMPI(TestCase):
         mpdconffn = os.path.expanduser('~/.mpd.conf')
         self.assertEqual(stat.S_IMODE(os.stat(mpdconffn).st_mode), 0400)
 
+    def test_get_localhosts(self):
+        """Test the lookup of the localhost interface in the unique nodes"""
+        addresses = {
+            '127.0.0.1': 'lo',
+            '127.0.0.2': 'docker0',
+            '127.0.0.3': 'eth0:1',
+            '127.0.0.4': 'ib0',
+            '127.0.0.5': 'bond0',
+        }
+        orig_get_local_ipv4_addresses = mpi.get_local_ipv4_addresses
+        mpi.get_local_ipv4_addresses = lambda: addresses
+        try:
+            m = MympirunOption()
+            m.args = ['echo', 'foo']
+            inst = getinstance(MPI, Local, m)
+
+            # first local match in the unique nodes order, not the docker or bond interface
+            inst.get_unique_nodes(['no.such.host.invalid', '127.0.0.2', '127.0.0.5', '127.0.0.4', '127.0.0.1'])
+            self.assertEqual(inst.get_localhosts(), [('127.0.0.4', 'ib0')])
+            inst.get_unique_nodes(['127.0.0.2', '127.0.0.3'])
+            self.assertEqual(inst.get_localhosts(), [('127.0.0.3', 'eth0:1')])
+
+            inst.get_unique_nodes(['127.0.0.2', '127.0.0.5', '127.0.0.6'])
+            self.assertRaises(Exception, inst.get_localhosts)
+        finally:
+            mpi.get_local_ipv4_addresses = orig_get_local_ipv4_addresses
+
+    def test_envfile(self):
+        """Test passing the environment with the env file and loader"""
+        basepath = tempfile.mkdtemp()
+        os.environ['MYMPIRUN_TEST_VAR'] = "it's a test"
+        try:
+            m = MympirunOption()
+            m.parseoptions(options_list=['--envfile', '--variablesprefix', 'MYMPIRUN_TEST_VAR',
+                                         '--basepath', basepath, 'echo', 'foo'])
+            inst = getinstance(MPI, Local, m)
+            inst.ENVFILE_COMMANDLINE_PREFIXES = ['PYTHON']
+            inst.mpiexec_set_global_options()
+            inst.mpiexec_set_local_pass_variable_options()
+            inst.make_envfile()
+
+            # only the excluded variables are left on the command line
+            self.assertEqual(inst.mpiexec_get_global_options(), [])
+            options = inst.mpiexec_get_local_pass_variable_options()
+            self.assertEqual([x for x in options if not x.startswith('-x PYTHON')], [])
+            self.assertEqual(inst.envfile_environment['MKL_NUM_THREADS'], '1')
+
+            ec, out = run_simple("env -i %s /usr/bin/env" % inst.envfile_loader)
+            self.assertEqual(ec, 0)
+            out = out.splitlines()
+            self.assertTrue("MYMPIRUN_TEST_VAR=it's a test" in out)
+            self.assertTrue("PATH=%s" % os.environ['PATH'] in out)
+            self.assertFalse([x for x in out if x.startswith('PYTHON')])
+        finally:
+            del os.environ['MYMPIRUN_TEST_VAR']
+            shutil.rmtree(basepath)
+
+    def test_pass_variables(self):
+        """Test the selection of the variables to pass"""
+        match = make_variables_regex(['OMP', 'MY_VAR', 'MY'])
+        self.assertTrue(match.match('OMP'))
+        self.assertTrue(match.match('OMP_NUM_THREADS'))
+        self.assertTrue(match.match('MY_VAR'))
+        self.assertFalse(match.match('OMPI_MCA'))
+        self.assertFalse(match.match('XOMP_X'))
+        self.assertFalse(make_variables_regex([]).match('OMP'))
+        self.assertEqual(parse_environment("A=1\nB=x=y\n  continued\n"), {'A': '1', 'B': 'x=y'})
+
+        basepath = tempfile.mkdtemp()
+        fake_rsh = os.path.join(basepath, 'fake_rsh')
+        open(fake_rsh, 'w').write("#!/bin/bash\necho 'PATH=%s'\necho 'OMP_NUM_THREADS=99'\n" % os.environ['PATH'])
+        os.chmod(fake_rsh, stat.S_IRWXU)
+        orig_omp = os.environ.get('OMP_NUM_THREADS', None)
+        os.environ['OMP_NUM_THREADS'] = '2'
+        try:
+            m = MympirunOption()
+            m.parseoptions(options_list=['--basepath', basepath, 'echo', 'foo'])
+            inst = getinstance(MPI, Local, m)
+            names = inst.get_pass_variables()
+            self.assertTrue('PATH' in names)
+            self.assertEqual(names.count('OMP_NUM_THREADS'), 1)
+
+            m.parseoptions(options_list=['--skiploginvariables', '--basepath', basepath, 'echo', 'foo'])
+            inst = getinstance(MPI, Local, m)
+            inst.get_rsh = lambda: fake_rsh
+            names = inst.get_pass_variables()
+            self.assertFalse('PATH' in names)
+            self.assertTrue('OMP_NUM_THREADS' in names)
+        finally:
+            if orig_omp is None:
+                del os.environ['OMP_NUM_THREADS']
+            else:
+                os.environ['OMP_NUM_THREADS'] = orig_omp
+            shutil.rmtree(basepath)
+
+    def test_exec_mpirun(self):
+        """Test replacing mympirun by the (dummy) mpirun, the cleanup hook removes the mympirundir"""
+        basepath = tempfile.mkdtemp()
+        output = os.path.join(basepath, 'out')
+        try:
+            m = MympirunOption()
+            m.parseoptions(options_list=['--execmpirun', '--output', output, '--basepath', basepath,
+                                         'echo', 'with space'])
+            inst = getinstance(MPI, Local, m)
+            inst.EXEC_CLEANUP_HOOK_INTERVAL = 0.1
+
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    inst.main()
+                finally:
+                    os._exit(1)
+            ec = os.waitpid(pid, 0)[1]
+            self.assertEqual(ec, 0)
+            out = open(output).read()
+            self.assertTrue('-np 1 ' in out)
+            self.assertTrue(out.strip().endswith('echo with space'))
+
+            # the hook removes the mympirundir shortly after mpirun exits
+            def mympirundirs():
+                return [x for x in os.listdir(os.path.join(basepath, '.mympirun')) if x.startswith(inst.id)]
+            for _ in range(50):
+                if not mympirundirs():
+                    break
+                time.sleep(0.1)
+            self.assertEqual(mympirundirs(), [])
+        finally:
+            shutil.rmtree(basepath)
+
 
 def suite():
     """ return all the tests"""
@@ -0,0 +1,128 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.mpmd module and the MPMD launches.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.intelmpi import IntelHydraMPI
+from vsc.mympirun.mpi.mpi import MPI
+from vsc.mympirun.mpi.openmpi import OpenMPI
+from vsc.mympirun.mpmd import parse_components_file, partition_nodes, split_components
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.rm.local import Local
+
+
+class TestMPMD(TestCase):
+    """Tests for the MPMD components"""
+
+    def setUp(self):
+        """Make temporary directory"""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Cleanup"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_components(self):
+        """Test parsing the components from the command line and from a file"""
+        components = split_components(['nodes=2', 'omp=4', './ocean', '-x', ':', './atmos', 'np=3'])
+        self.assertEqual([x['cmdargs'] for x in components], [['./ocean', '-x'], ['./atmos', 'np=3']])
+        self.assertEqual((components[0]['nodes'], components[0]['omp'], components[0]['np']), (2, 4, None))
+        self.assertEqual(components[1]['nodes'], None)
+
+        components = parse_components_file("# coupled\nnp=6 hybrid=2 ./ocean 'with space'\n\n./atmos\n")
+        self.assertEqual([x['cmdargs'] for x in components], [['./ocean', 'with space'], ['./atmos']])
+        self.assertEqual((components[0]['np'], components[0]['hybrid']), (6, 2))
+
+        self.assertRaises(ValueError, split_components, ['./ocean', ':'])
+        self.assertRaises(ValueError, split_components, ['nodes=0', './ocean'])
+
+    def test_partition_nodes(self):
+        """Test dividing the nodes over the components"""
+        nodes = ['n%s' % x for x in range(6)]
+        components = split_components(['np=6', 'a', ':', 'b', ':', 'nodes=1', 'c', ':', 'd'])
+        partition_nodes(nodes, components, lambda component: 4)
+        self.assertEqual([x['hosts'] for x in components], [['n0', 'n1'], ['n2', 'n3'], ['n4'], ['n5']])
+        self.assertEqual(components[0]['runs'], [('n0', 4), ('n1', 2)])
+        self.assertEqual([x['np'] for x in components], [6, 8, 4, 4])
+
+        components = split_components(['nodes=4', 'a', ':', 'nodes=3', 'b'])
+        self.assertRaises(ValueError, partition_nodes, nodes, components, lambda component: 4)
+        components = split_components(['nodes=1', 'np=5', 'a'])
+        self.assertRaises(ValueError, partition_nodes, nodes, components, lambda component: 4)
+
+    def make_instance(self, klass, args):
+        """Return instance of klass with the local scheduler on 3 fake nodes with 4 slots"""
+        m = MympirunOption()
+        m.parseoptions(options_list=['--basepath', self.tmpdir] + args)
+        inst = getinstance(klass, Local, m)
+        inst.noderuns = [('n1', 4), ('n2', 4), ('n3', 4)]
+        inst.nrnodes = 12
+        inst.get_unique_nodes()
+        inst.set_ppn()
+        inst.make_node_list()
+        inst.make_mympirundir()
+        return inst
+
+    def test_mpmd_sections(self):
+        """Test the mpirun MPMD sections of the flavours"""
+        args = ['--hybrid', '4', 'nodes=1', 'hybrid=2', './ocean', ':', './atmos', '-v']
+        inst = self.make_instance(MPI, args)
+        inst.make_mpmd()
+        self.assertEqual(inst.mpinoderuns, [('n1', 2), ('n2', 4), ('n3', 4)])
+        self.assertEqual(open(inst.mpmd_components[1]['nodefile']).read(), "n2\n" * 4 + "n3\n" * 4)
+        inst.make_mpiexec_options()
+        self.assertFalse('-np' in inst.mpiexec_options)
+        sections = inst.make_mpmd_sections()[0].split(' : ')
+        self.assertEqual(sections, ['-n 2 -host n1 -env OMP_NUM_THREADS 2 ./ocean',
+                                    '-n 4 -host n2 ./atmos -v', '-n 4 -host n3 ./atmos -v'])
+
+        inst = self.make_instance(OpenMPI, args)
+        inst.make_mpmd()
+        sections = inst.make_mpmd_sections()[0].split(' : ')
+        self.assertEqual(sections[0], '-np 2 -hostfile %s -x OMP_NUM_THREADS=2 ./ocean' %
+                         inst.mpmd_components[0]['nodefile'])
+        self.assertTrue(sections[1].endswith('mpmd_1_nodes ./atmos -v'))
+
+        inst = self.make_instance(IntelHydraMPI, args)
+        inst.make_mpmd()
+        res = inst.make_mpmd_sections()
+        configfile = os.path.join(inst.mympirundir, 'mpmd_configfile')
+        self.assertEqual(res, ['-configfile %s' % configfile])
+        self.assertEqual(len(open(configfile).read().splitlines()), 3)
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestMPMD)
@@ -0,0 +1,92 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.netinfo module.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import socket
+from unittest import TestCase, TestLoader
+
+import vsc.mympirun.netinfo as netinfo
+from vsc.mympirun.netinfo import get_local_ipv4_addresses
+
+IP_ADDR_SHOW_OUT = """1: lo    inet 127.0.0.1/8 scope host lo\\       valid_lft forever preferred_lft forever
+2: eth0    inet 10.141.10.1/16 brd 10.141.255.255 scope global eth0\\       valid_lft forever preferred_lft forever
+2: eth0    inet 10.141.20.1/16 brd 10.141.255.255 scope global eth0:1\\       valid_lft forever preferred_lft forever
+5: ib0    inet 10.143.10.1/16 brd 10.143.255.255 scope global ib0\\       valid_lft forever preferred_lft forever
+"""
+
+
+class TestNetinfo(TestCase):
+    """Tests for the local network interface information"""
+
+    def setUp(self):
+        """Save the patched functions"""
+        self.orig = (netinfo.run_simple, netinfo._ifconf_ipv4_addresses)
+
+    def tearDown(self):
+        """Restore the patched functions"""
+        netinfo.run_simple, netinfo._ifconf_ipv4_addresses = self.orig
+
+    def test_ioctl(self):
+        """Test the local addresses with the ioctl"""
+        res = get_local_ipv4_addresses()
+        self.assertEqual(res.get('127.0.0.1'), 'lo')
+        for ip, iface in res.items():
+            socket.inet_aton(ip)
+            self.assertTrue(len(iface) > 0)
+
+    def test_ip_addr_show(self):
+        """Test the fallback on the ip addr show output"""
+        cmds = []
+
+        def fake_run_simple(cmd):
+            cmds.append(cmd)
+            return 0, IP_ADDR_SHOW_OUT
+
+        def failing_ioctl():
+            raise IOError("ioctl not supported")
+
+        netinfo.run_simple = fake_run_simple
+        netinfo._ifconf_ipv4_addresses = failing_ioctl
+        self.assertEqual(get_local_ipv4_addresses(), {
+            '127.0.0.1': 'lo',
+            '10.141.10.1': 'eth0',
+            '10.141.20.1': 'eth0',
+            '10.143.10.1': 'ib0',
+        })
+        # a single run
+        self.assertEqual(cmds, [netinfo.IP_ADDR_SHOW_CMD])
+
+        netinfo.run_simple = lambda cmd: (1, 'ip: command not found')
+        self.assertRaises(Exception, get_local_ipv4_addresses)
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestNetinfo)
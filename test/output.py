@@ -0,0 +1,119 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.output module and the output engine.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import gzip
+import os
+import re
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.mpi import MPI
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.output import OutputEngine, SplitFiles, run_output
+from vsc.mympirun.rm.local import Local
+
+
+class TestOutput(TestCase):
+    """Tests for the output engine"""
+
+    def setUp(self):
+        """Make temporary directory"""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Cleanup"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_split_files(self):
+        """Test the split files with a limited number of open files, with compression"""
+        split = SplitFiles(self.tmpdir, compress=True, maxopen=2)
+        for name in ['a', 'b', 'c', 'a']:
+            split.write(name, "%s\n" % name)
+        split.close()
+        self.assertEqual(len(os.listdir(self.tmpdir)), 3)
+        self.assertEqual(gzip.open(split.filenames['a']).read(), "a\na\n")
+
+    def test_engine(self):
+        """Test demultiplexing blocks with incomplete lines"""
+        default = StringIO()
+        split = SplitFiles(self.tmpdir)
+        engine = OutputEngine(default, rank_regex=re.compile(r"^\[(\d+)\] "), split=split,
+                              sink_name=lambda rank: "rank_%s" % rank)
+        engine.feed("[0] start\n[1] sta")
+        engine.feed("rt\nlauncher message\n[0] end")
+        engine.flush()
+
+        self.assertEqual(default.getvalue(), "launcher message\n")
+        self.assertEqual(open(split.filenames['rank_0']).read(), "start\nend\n")
+        self.assertEqual(open(split.filenames['rank_1']).read(), "start\n")
+        self.assertEqual(engine.rank_bytes, {0: 10, 1: 6})
+        self.assertEqual(engine.total, 44)
+
+        # without rank prefix, the blocks are passed as is
+        default = StringIO()
+        engine = OutputEngine(default)
+        engine.feed("no newline")
+        self.assertEqual(default.getvalue(), "no newline")
+        self.assertEqual(engine.rank_bytes, {})
+
+    def test_run_output(self):
+        """Test running a command through the engine"""
+        default = StringIO()
+        ec, out = run_output("for i in $(seq 1 1000); do echo \"$((i % 4)): line $i\"; done; exit 2",
+                             engine=OutputEngine(default, rank_regex=re.compile(r"^(\d+): ")), disable_log=True)
+        self.assertEqual(ec, 2)
+        self.assertTrue(out.endswith("0: line 1000\n"))
+        self.assertEqual(len(default.getvalue().splitlines()), 1000)
+
+    def test_mpi_output_split(self):
+        """Test the per node split output of an mpi run"""
+        output = os.path.join(self.tmpdir, 'out')
+        m = MympirunOption()
+        m.parseoptions(options_list=['--outputsplit', 'node', '--outputcompress', '--output', output,
+                                     '--basepath', self.tmpdir, 'echo', 'foo'])
+        inst = getinstance(MPI, Local, m)
+        inst.mpinoderuns = [('n1', 2), ('n2', 2)]
+        inst.make_mympirundir()
+
+        ec, _ = inst.run_output("printf '0: a\\n3: b\\nlauncher\\n2: c\\n'")
+        self.assertEqual(ec, 0)
+        self.assertEqual(gzip.open("%s.gz" % output).read(), "launcher\n")
+        outputdir = os.path.join(inst.mympirundir, 'output')
+        self.assertEqual(gzip.open(os.path.join(outputdir, 'node_n2.out.gz')).read(), "b\nc\n")
+        self.assertEqual(open(os.path.join(inst.mympirundir, 'output_rank_bytes')).read(), "0 2\n2 2\n3 2\n")
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestOutput)
@@ -0,0 +1,216 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.probecache module.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import stat
+import tempfile
+from unittest import TestCase, TestLoader
+
+import vsc.mympirun.probecache as probecache
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.mpi import MPI
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.probecache import ProbeCache, make_probecache_key
+from vsc.mympirun.rm.local import Local
+
+
+class TestProbeCache(TestCase):
+    """Tests for the persistent probe cache"""
+
+    def setUp(self):
+        """Make temporary directory"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'probecache')
+        self.orig_boot_id_filename = probecache.BOOT_ID_FILENAME
+
+    def tearDown(self):
+        """Cleanup"""
+        probecache.BOOT_ID_FILENAME = self.orig_boot_id_filename
+        shutil.rmtree(self.tmpdir)
+
+    def _cache(self, key='key', **kwargs):
+        """Return a ProbeCache in the temporary directory"""
+        return ProbeCache(self.path, key, name='node', **kwargs)
+
+    def test_key(self):
+        """Test the key construction from the boot id and the mpirun executable"""
+        bootid = os.path.join(self.tmpdir, 'boot_id')
+        open(bootid, 'w').write("1234-abcd\n")
+        probecache.BOOT_ID_FILENAME = bootid
+
+        mpirun = os.path.join(self.tmpdir, 'mpirun')
+        open(mpirun, 'w').write('')
+        os.utime(mpirun, (1000, 1000))
+
+        self.assertEqual(make_probecache_key(), ('1234-abcd', None, None))
+        self.assertEqual(make_probecache_key(mpirun=mpirun), ('1234-abcd', mpirun, 1000))
+        # a new mpirun is a new key
+        os.utime(mpirun, (2000, 2000))
+        self.assertEqual(make_probecache_key(mpirun=mpirun), ('1234-abcd', mpirun, 2000))
+        self.assertEqual(make_probecache_key(mpirun='/no/such/mpirun'), ('1234-abcd', '/no/such/mpirun', None))
+
+        probecache.BOOT_ID_FILENAME = os.path.join(self.tmpdir, 'no_boot_id')
+        self.assertEqual(make_probecache_key(), ('', None, None))
+
+    def test_hits(self):
+        """Test the hit and miss counters, and storing only valid values"""
+        calls = []
+
+        def probe(value):
+            """Return the probe function with result value"""
+            def func():
+                calls.append(value)
+                return value
+            return func
+
+        cache = self._cache()
+        self.assertEqual(cache.get('a', probe(1)), 1)
+        self.assertEqual(cache.get('a', probe(2)), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # invalid values are not stored, the probe runs again
+        self.assertEqual(cache.get('b', probe((1, 'fail')), valid=lambda (ec, out): ec == 0), (1, 'fail'))
+        self.assertEqual(cache.get('b', probe((0, 'ok')), valid=lambda (ec, out): ec == 0), (0, 'ok'))
+        self.assertEqual(cache.get('b', probe((1, 'fail'))), (0, 'ok'))
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+        self.assertEqual(calls, [1, (1, 'fail'), (0, 'ok')])
+        cache.save()
+
+        # new mympirun on the same node
+        cache = self._cache()
+        self.assertEqual(cache.get('a', probe(3)), 1)
+        self.assertEqual(cache.get('b', probe(3)), (0, 'ok'))
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+        self.assertFalse(cache.dirty)
+        self.assertEqual(stat.S_IMODE(os.stat(cache.filename).st_mode), stat.S_IRUSR | stat.S_IWUSR)
+
+        # other key (eg after a reboot)
+        cache = self._cache(key='other')
+        self.assertEqual(cache.get('a', probe(4)), 4)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_ttl(self):
+        """Test that expired entries are ignored and dropped"""
+        cache = self._cache()
+        cache.get('a', lambda: 1)
+        cache.save()
+
+        cache = self._cache(ttl=3600)
+        self.assertEqual(cache.get('a', lambda: 2), 1)
+        self.assertFalse(cache.dirty)
+
+        cache = self._cache(ttl=-1)
+        self.assertEqual(cache.get('a', lambda: 2), 2)
+        self.assertEqual(cache.misses, 1)
+        self.assertTrue(cache.dirty)
+
+    def test_eviction(self):
+        """Test that only the maxentries newest entries are kept"""
+        for idx, key in enumerate(['k1', 'k2', 'k3']):
+            cache = self._cache(key=key, maxentries=2)
+            cache.get('a', lambda: key)
+            cache.entries[key]['timestamp'] -= 100 - idx
+            cache.save()
+
+        cache = self._cache(key='k3')
+        self.assertEqual(sorted(cache.entries.keys()), ['k2', 'k3'])
+        self.assertEqual(cache.get('a', lambda: None), 'k3')
+
+    def test_corrupt(self):
+        """Test that an unreadable cache file is ignored"""
+        os.makedirs(self.path)
+        open(os.path.join(self.path, 'node'), 'w').write('garbage')
+        cache = self._cache()
+        self.assertEqual(cache.entries.keys(), ['key'])
+        self.assertEqual(cache.get('a', lambda: 1), 1)
+        cache.save()
+        self.assertEqual(self._cache().get('a', lambda: 2), 1)
+
+    def test_refreshprobes(self):
+        """Test the cached probes of mympirun and --refreshprobes"""
+        def make_instance(args):
+            """Return the mympirun instance with options args"""
+            m = MympirunOption()
+            m.parseoptions(options_list=args + ['--basepath', self.tmpdir, 'echo'])
+            return getinstance(MPI, Local, m)
+
+        inst = make_instance([])
+        self.assertEqual(inst.cached_probe('test', lambda: 1), 1)
+        inst.probecache.save()
+        self.assertTrue(os.path.isdir(os.path.join(self.tmpdir, '.mympirun', 'probecache')))
+
+        inst = make_instance([])
+        self.assertEqual(inst.cached_probe('test', lambda: 2), 1)
+        self.assertEqual(inst.probecache.hits, 1)
+
+        # the cached value is ignored, the new value is stored
+        inst = make_instance(['--refreshprobes'])
+        self.assertEqual(inst.cached_probe('test', lambda: 2), 2)
+        self.assertEqual(inst.probecache.misses, 1)
+        inst.probecache.save()
+
+        inst = make_instance([])
+        self.assertEqual(inst.cached_probe('test', lambda: 3), 2)
+
+    def test_scalemp_vsmp(self):
+        """Test that a failing vsmpctl is not cached, a missing one is"""
+        bindir = os.path.join(self.tmpdir, 'bin')
+        os.mkdir(bindir)
+        vsmpctl = os.path.join(bindir, 'vsmpctl')
+        counter = os.path.join(self.tmpdir, 'counter')
+        open(vsmpctl, 'w').write("#!/bin/sh\necho run >> %s\nexit 1\n" % counter)
+        os.chmod(vsmpctl, stat.S_IRWXU)
+
+        m = MympirunOption()
+        m.parseoptions(options_list=['--basepath', self.tmpdir, 'echo'])
+        orig_path = os.environ['PATH']
+        os.environ['PATH'] = os.pathsep.join([bindir, orig_path])
+        try:
+            for _ in range(2):
+                inst = getinstance(MPI, Local, m)
+                inst.scalemp_vsmp()
+                inst.probecache.save()
+            self.assertEqual(len(open(counter).read().splitlines()), 2)
+
+            os.remove(vsmpctl)
+            for misses in [1, 0]:
+                inst = getinstance(MPI, Local, m)
+                inst.scalemp_vsmp()
+                inst.probecache.save()
+                self.assertEqual(inst.probecache.misses, misses)
+        finally:
+            os.environ['PATH'] = orig_path
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestProbeCache)
@@ -0,0 +1,118 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.resilient module and the relaunch of a failed mpirun.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.mpi import MPI
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.resilient import FAILURE_APPLICATION, FAILURE_FABRIC, FAILURE_LAUNCHER
+from vsc.mympirun.resilient import classify_failure, mentioned_nodes, plan_retry
+from vsc.mympirun.rm.local import Local
+
+
+class TestResilient(TestCase):
+    """Tests for the failure classification and the relaunch"""
+
+    def setUp(self):
+        """Make temporary directory"""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Cleanup"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_classify(self):
+        """Test the failure classification"""
+        nodes = ['n1.cluster', 'n2.cluster', 'n10.cluster']
+        self.assertEqual(mentioned_nodes(['[proxy:0:1@n10] connect to n2.cluster.'], nodes),
+                         ['n2.cluster', 'n10.cluster'])
+
+        out = "hello\nssh: connect to host n2 port 22: Connection refused\n"
+        self.assertEqual(classify_failure(255, out, nodes), (FAILURE_LAUNCHER, ['n2.cluster']))
+        self.assertEqual(classify_failure(255, '', nodes), (FAILURE_LAUNCHER, []))
+        out = "n10.cluster: ibv_open_device failed\nrank 3: MPI_Init: Other MPI error\n"
+        self.assertEqual(classify_failure(1, out, nodes), (FAILURE_FABRIC, ['n10.cluster']))
+        self.assertEqual(classify_failure(1, "Segmentation fault on n1\n", nodes), (FAILURE_APPLICATION, []))
+        self.assertEqual(classify_failure(255, "MPI_Abort on n1\n", nodes), (FAILURE_APPLICATION, []))
+
+    def test_plan(self):
+        """Test the recovery for the failures"""
+        nodes = ['n1', 'n2', 'n3']
+        self.assertEqual(plan_retry(FAILURE_APPLICATION, ['n2'], nodes, ['socket']), None)
+        self.assertEqual(plan_retry(FAILURE_LAUNCHER, ['n2'], nodes, []), ('exclude', ['n2']))
+        self.assertEqual(plan_retry(FAILURE_LAUNCHER, nodes, nodes, []), ('retry', None))
+        self.assertEqual(plan_retry(FAILURE_FABRIC, [], nodes, ['socket']), ('device', 'socket'))
+        self.assertEqual(plan_retry(FAILURE_FABRIC, [], nodes, []), None)
+
+    def test_relaunch(self):
+        """Test relaunching the (dummy) mpirun without the failed node"""
+        output = os.path.join(self.tmpdir, 'out')
+        m = MympirunOption()
+        m.parseoptions(options_list=['--resilient', '1', '--output', output, '--basepath', self.tmpdir,
+                                     'echo', 'foo'])
+        inst = getinstance(MPI, Local, m)
+        inst.noderuns = [('n1', 2), ('n2', 2), ('n3', 2)]
+        inst.nrnodes = 6
+        inst.get_unique_nodes()
+        inst.set_ppn()
+        inst.make_node_list()
+        inst.make_mympirundir()
+        inst.device = 'socket'
+        # fake nodes can't be resolved
+        inst.mpdboot_localhost_interface = ('n1', 'lo')
+        inst.mpdboot_set_localhost_interface = lambda: None
+
+        failure = "[mpiexec@n1] ssh: connect to host n2 port 22: Connection refused\n"
+        inst.execute([(lambda cmd: (255, failure), ['mpirun'])])
+        self.assertEqual(inst.excluded_nodes, ['n2'])
+        self.assertEqual(inst.mpinoderuns, [('n1', 2), ('n3', 2)])
+        self.assertEqual(open(inst.mpiexec_node_filename).read(), "n1\nn1\nn3\nn3\n")
+        self.assertTrue('-np 4 ' in open(output).read())
+
+        # a failure without identified nodes is retried as is, until the retry budget is used
+        failing = [(lambda cmd: (255, failure), ['mpirun'])]
+        inst.mpirun_prepare_execution = lambda: failing
+        self.assertRaises(Exception, inst.execute, failing)
+        self.assertEqual(inst.excluded_nodes, ['n2'])
+
+        # application failures are not retried
+        inst.excluded_nodes = []
+        self.assertRaises(Exception, inst.execute, [(lambda cmd: (1, "Segmentation fault\n"), ['mpirun'])])
+        self.assertEqual(inst.excluded_nodes, [])
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestResilient)
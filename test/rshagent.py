@@ -0,0 +1,165 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.rshagent module, with a fake pbsdsh and ssh that run locally.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import signal
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.rshagent import ENVIRONMENT_PREFIX, handle_connection, send_frame
+
+RSHAGENT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin', 'rshagent.py')
+
+# called as: pbsdsh -o -h host bash -l -c command
+FAKE_PBSDSH = """#!/bin/bash
+echo "$3" >> %(log)s
+exec bash -c "$7"
+"""
+
+FAKE_SSH = """#!/bin/bash
+echo "$@" >> %(log)s
+"""
+
+
+class TestRshAgent(TestCase):
+    """Tests for the rshagent"""
+
+    def setUp(self):
+        """Fake pbsdsh and ssh"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmpdir, 'log')
+        self.statedir = os.path.join(self.tmpdir, 'state')
+        self.host = socket.gethostname()
+
+        for name, txt in [('pbsdsh', FAKE_PBSDSH), ('ssh', FAKE_SSH)]:
+            fn = os.path.join(self.tmpdir, name)
+            open(fn, 'w').write(txt % {'log': self.log})
+            os.chmod(fn, stat.S_IRWXU)
+
+        self.env = os.environ.copy()
+        self.env.update({
+            ENVIRONMENT_PREFIX + 'DIR': self.statedir,
+            ENVIRONMENT_PREFIX + 'PBSDSH': "%s -o -h" % os.path.join(self.tmpdir, 'pbsdsh'),
+            ENVIRONMENT_PREFIX + 'SSH': os.path.join(self.tmpdir, 'ssh'),
+            ENVIRONMENT_PREFIX + 'IDLE': '60',
+            ENVIRONMENT_PREFIX + 'MODE': 'pbsdsh',
+            'PYTHONPATH': os.pathsep.join(sys.path),
+        })
+
+    def tearDown(self):
+        """Stop the proxy, cleanup"""
+        self._kill_proxy()
+        shutil.rmtree(self.tmpdir)
+
+    def _kill_proxy(self):
+        """Kill the proxy, if any"""
+        regfn = os.path.join(self.statedir, "proxy_%s" % self.host)
+        if os.path.exists(regfn):
+            pid = int(open(regfn).read().split()[1])
+            os.kill(pid, signal.SIGKILL)
+            time.sleep(0.1)
+
+    def _run(self, args):
+        """Run rshagent with args, return (exitcode, stdout, stderr)"""
+        proc = subprocess.Popen([sys.executable, RSHAGENT] + args, env=self.env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        return proc.returncode, out, err
+
+    def _log(self):
+        """Return the lines in the log of the fakes"""
+        if os.path.exists(self.log):
+            return open(self.log).read().splitlines()
+        return []
+
+    def test_proxy(self):
+        """Test the pbsdsh started proxy"""
+        self.assertEqual(self._run(['-n', self.host, 'echo', 'hello']), (0, "hello\n", ""))
+        self.assertEqual(self._run([self.host, 'echo err >&2; exit 3']), (3, "", "err\n"))
+        # one proxy started
+        self.assertEqual(self._log(), [self.host])
+        self.assertEqual(os.stat(os.path.join(self.statedir, 'token')).st_mode & 0777, 0600)
+
+        # stale registration
+        self._kill_proxy()
+        ec, out, _ = self._run([self.host, 'echo', 'again'])
+        self.assertEqual((ec, out), (0, "again\n"))
+        self.assertEqual(self._log(), [self.host] * 2)
+
+    def test_ssh(self):
+        """Test ssh mode and host normalisation"""
+        self.env[ENVIRONMENT_PREFIX + 'MODE'] = 'ssh'
+        self.assertEqual(self._run(['-x', '127.0.0.1', 'hostname'])[0], 0)
+        args = self._log()[0].split()
+        self.assertTrue('ControlMaster=auto' in args)
+        self.assertTrue('ControlPersist=60' in args)
+        suffix = ''
+        if '.' in self.host:
+            suffix = self.host[self.host.index('.'):]
+        self.assertEqual(args[-3:], ['-x', 'localhost' + suffix, 'hostname'])
+        self.assertEqual(open(os.path.join(self.statedir, 'hosts', '127.0.0.1')).read(), 'localhost')
+
+    def test_disconnect(self):
+        """Test that all processes of a command are stopped when its client is gone"""
+        pidfile = os.path.join(self.tmpdir, 'pid')
+        proxy, client = socket.socketpair()
+        thread = threading.Thread(target=handle_connection, args=(proxy, 'secret'))
+        thread.setDaemon(True)
+        thread.start()
+
+        send_frame(client, 't', 'secret')
+        # the background sleep ignores SIGTERM
+        send_frame(client, 'c', "(trap '' TERM; sleep 60) & echo $! > %s.tmp; mv %s.tmp %s; wait" %
+                   (pidfile, pidfile, pidfile))
+        for _ in range(100):
+            if os.path.exists(pidfile):
+                break
+            time.sleep(0.05)
+        pid = int(open(pidfile).read())
+
+        start = time.time()
+        client.close()
+        thread.join(20)
+        self.assertFalse(thread.isAlive())
+        self.assertTrue(time.time() - start < 15)
+        self.assertRaises(OSError, os.kill, pid, 0)
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestRshAgent)
@@ -5,12 +5,30 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 import unittest
+from test import accounting as a
+from test import farm as f
+from test import launchprofile as lp
+from test import mpdring as md
 from test import mpi as m
+from test import mpmd as mp
+from test import netinfo as ni
+from test import output as o
+from test import probecache as pc
+from test import resilient as rl
+from test import rshagent as r
+from test import sched as s
+from test import sshtree as st
+from test import stall as sl
+from test import teardown as td
+from test import threadpool as tp
+from test import topology as t
+from test import tuneindex as ti
+from test import walltime as w
 
 from vsc.utils import fancylogger
 fancylogger.logToScreen(enable=False)
 
-suite = unittest.TestSuite([x.suite() for x in (m, )])
+suite = unittest.TestSuite([x.suite() for x in (a, f, lp, md, m, mp, ni, o, pc, rl, r, s, st, sl, td, tp, t, ti, w)])
 
 try:
     import xmlrunner
@@ -0,0 +1,351 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.rm.sched module.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import stat
+import tempfile
+import time
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.intelmpi import IntelHydraMPI, IntelMPI
+from vsc.mympirun.mpi.mpi import MPI
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.rm.pbs import PBS
+from vsc.mympirun.rm.sched import rle_nodes, expand_rle
+
+
+class TestSched(TestCase):
+    """Tests for the Sched classes"""
+
+    def setUp(self):
+        """Make a fake PBS nodefile"""
+        self.nodes = ['node1'] * 4 + ['node2'] * 4 + ['node3'] * 4
+        fd, self.nodefile = tempfile.mkstemp()
+        os.write(fd, "\n".join(self.nodes + ['']))
+        os.close(fd)
+
+        os.environ['PBS_NODEFILE'] = self.nodefile
+        os.environ['PBS_JOBID'] = '123.master'
+
+    def tearDown(self):
+        """Cleanup fake nodefile"""
+        os.remove(self.nodefile)
+        del os.environ['PBS_NODEFILE']
+        del os.environ['PBS_JOBID']
+
+    def _make_instance(self, args=None, mpi=MPI):
+        """Return mpi/PBS instance with options args"""
+        if args is None:
+            args = []
+        m = MympirunOption()
+        m.parseoptions(options_list=args + ['echo', 'foo'])
+        return getinstance(mpi, PBS, m)
+
+    def test_rle(self):
+        """Test the run-length representation"""
+        runs = rle_nodes(['a', 'a', 'b', 'a'])
+        self.assertEqual(runs, [('a', 2), ('b', 1), ('a', 1)])
+        self.assertEqual(expand_rle(runs), ['a', 'a', 'b', 'a'])
+
+    def test_pbs_nodes(self):
+        """Test reading the PBS nodefile"""
+        inst = self._make_instance()
+        self.assertEqual(inst.noderuns, [('node1', 4), ('node2', 4), ('node3', 4)])
+        self.assertEqual(inst.nodes, self.nodes)
+        self.assertEqual(inst.nrnodes, 12)
+        self.assertEqual(inst.uniquenodes, ['node1', 'node2', 'node3'])
+        self.assertEqual(inst.ppn, 4)
+
+    def test_rsh(self):
+        """Test the remote shell for small and large PBS jobs"""
+        # --ssh (store_false) selects the optimised remote shell, there is none for small PBS jobs
+        for args in [[], ['--ssh']]:
+            inst = self._make_instance(args)
+            self.assertFalse(inst.is_large())
+            self.assertEqual(inst.get_rsh(), 'ssh')
+
+        # large job: all cores of 128 nodes
+        for args, rsh in [([], 'sshtree'), (['--ssh'], 'rshagent')]:
+            inst = self._make_instance(args)
+            inst.nrnodes = 128 * inst.foundppn
+            inst.ppn = inst.foundppn
+            self.assertTrue(inst.is_large())
+            self.assertEqual(inst.get_rsh(), rsh)
+
+    def test_launch_fanout(self):
+        """Test the fan-out of the launch tree in the mpdboot and hydra options"""
+        def options(args, mpi, large):
+            inst = self._make_instance(args, mpi=mpi)
+            if large:
+                inst.nrnodes = 128 * inst.foundppn
+                inst.ppn = inst.foundppn
+            inst.mpdboot_localhost_interface = ('node1', 'eth0')
+            inst.setup_rsh = lambda rsh: None
+            if mpi.HYDRA:
+                inst.get_hydra_info = lambda: None
+                inst.hydra_info = {}
+                inst.mpiexec_options = []
+                inst.mpitotalppn = inst.ppn
+                inst.make_mpiexec_hydra_options()
+                return [x for x in inst.mpiexec_options if x.startswith('--branch-count')]
+            else:
+                inst.make_mpdboot_options()
+                return [x for x in inst.mpdboot_options if x.startswith('--maxbranch')]
+
+        self.assertEqual(options([], IntelMPI, False), [])
+        self.assertEqual(options([], IntelMPI, True), ['--maxbranch=32'])
+        self.assertEqual(options(['--sshtreefanout', '8'], IntelMPI, False), ['--maxbranch=8'])
+        self.assertEqual(options([], IntelHydraMPI, False), [])
+        self.assertEqual(options([], IntelHydraMPI, True), ['--branch-count 32'])
+        self.assertEqual(options(['--sshtreefanout', '8'], IntelHydraMPI, True), ['--branch-count 8'])
+        self.assertEqual(options(['--branchcount', '4', '--sshtreefanout', '8'], IntelHydraMPI, True),
+                         ['--branch-count 4'])
+
+    def test_make_node_list(self):
+        """Test the mpi node list in the different modes"""
+        inst = self._make_instance()
+        inst.make_node_list()
+        self.assertEqual(inst.mpinodes, self.nodes)
+        self.assertEqual(inst.nrmpinodes, 12)
+
+        inst = self._make_instance(['--hybrid', '2'])
+        inst.make_node_list()
+        self.assertEqual(inst.mpinoderuns, [('node1', 2), ('node2', 2), ('node3', 2)])
+
+        inst = self._make_instance(['--double'])
+        inst.make_node_list()
+        self.assertEqual(inst.mpinodes, self.nodes * 2)
+
+        inst = self._make_instance(['--double', '--order', 'sort'])
+        inst.make_node_list()
+        self.assertEqual(inst.mpinoderuns, [('node1', 8), ('node2', 8), ('node3', 8)])
+
+        inst = self._make_instance(['--order', 'random_1'])
+        inst.make_node_list()
+        mpinodes = inst.mpinodes
+        self.assertEqual(len(mpinodes), 12)
+        mpinodes.sort()
+        self.assertEqual(mpinodes, self.nodes)
+
+    def test_node_file(self):
+        """Test the compact and expanded nodefile"""
+        inst = self._make_instance(mpi=IntelHydraMPI)
+        inst.make_node_file()
+        self.assertEqual(open(inst.mpiexec_node_filename).read(), "node1:4\nnode2:4\nnode3:4\n")
+        inst.cleanup()
+
+        # double interleaves the hosts
+        inst = self._make_instance(['--double'], mpi=IntelHydraMPI)
+        inst.make_node_file()
+        self.assertEqual(open(inst.mpiexec_node_filename).read(), "\n".join(self.nodes * 2 + ['']))
+        inst.cleanup()
+
+        # no compact format
+        inst = self._make_instance()
+        inst.make_node_file()
+        self.assertEqual(open(inst.mpiexec_node_filename).read(), "\n".join(self.nodes + ['']))
+        inst.cleanup()
+
+    def test_node_cpusets(self):
+        """Test probing the cpusets of all nodes with a fake remote shell"""
+        fake_rsh = os.path.join(os.path.dirname(self.nodefile), "fake_rsh_%s" % os.getpid())
+        open(fake_rsh, 'w').write("\n".join([
+            '#!/bin/bash',
+            'case "$1" in',
+            '    node1) echo node1.cluster; echo "Cpus_allowed_list:  0-3"; echo "Mems_allowed_list:  0";;',
+            '    node2) echo node2.cluster; echo "Cpus_allowed_list:  4,6"; echo "Mems_allowed_list:  1";;',
+            '    *) exit 1;;',
+            'esac',
+            '',
+        ]))
+        os.chmod(fake_rsh, stat.S_IRWXU)
+
+        try:
+            inst = self._make_instance()
+            inst.get_rsh = lambda: fake_rsh
+            inst.cpus = [0, 1]
+            cpusets = inst.get_node_cpusets()
+            self.assertEqual(cpusets['node1'], ('node1.cluster', [0, 1, 2, 3], [0]))
+            self.assertEqual(cpusets['node2'], ('node2.cluster', [4, 6], [1]))
+            # failed probe falls back to local cpus, the hostname is unknown
+            self.assertEqual(cpusets['node3'][:2], (None, [0, 1]))
+
+            # the remote cpusets are only probed for the pinning override
+            for args, probed in [([], False), (['--overridepin', 'compact'], True)]:
+                inst = self._make_instance(args, mpi=IntelHydraMPI)
+                inst.get_rsh = lambda: fake_rsh
+                inst.cpus = [0, 1]
+                inst.foundppn = 4
+                inst.check_usable_cpus()
+                self.assertEqual(inst.nodecpusets is not None, probed)
+                self.assertFalse('I_MPI_PIN_PROCESSOR_LIST' in inst.mpiexec_global_options)
+        finally:
+            os.remove(fake_rsh)
+
+    def test_preflight(self):
+        """Test the preflight check with a fake remote shell that runs locally"""
+        fake_rsh = os.path.join(os.path.dirname(self.nodefile), "fake_rsh_%s" % os.getpid())
+        open(fake_rsh, 'w').write("\n".join([
+            '#!/bin/bash',
+            'host=$1',
+            'shift',
+            'if [ "$host" == "node3" ]; then exit 255; fi',
+            'bash -c "$*"',
+            '',
+        ]))
+        os.chmod(fake_rsh, stat.S_IRWXU)
+        basepath = tempfile.mkdtemp()
+
+        try:
+            inst = self._make_instance(['--preflight', '--basepath', basepath])
+            inst.get_rsh = lambda: fake_rsh
+            inst.PREFLIGHT_SHM_MIN_KB = 0
+            self.assertRaises(Exception, inst.preflight)
+
+            self.assertEqual(inst.preflight_results['node3'][:2], ('FAIL', ['unreachable (ec 255)']))
+            status, _, res = inst.preflight_results['node1']
+            self.assertTrue(status in ('OK', 'WARN'))
+            self.assertTrue(len(res['hostname']) > 0)
+            self.assertTrue(res['shm_free_kb'] >= 0)
+            self.assertTrue(res['MemFree'] > 0)
+            self.assertEqual(res['dev_shm'], '1')
+
+            # missing device and full /dev/shm
+            failures, _ = inst.evaluate_preflight({'ec': 0, 'hostname': 'node1', 'dev_ib': '0', 'shm_free_kb': 0},
+                                                  {'ib': True, 'socket': True})
+            self.assertEqual(failures, ['missing /dev/infiniband'])
+            inst.PREFLIGHT_SHM_MIN_KB = 1
+            failures, _ = inst.evaluate_preflight({'ec': 0, 'hostname': 'node1', 'shm_free_kb': 0}, {})
+            self.assertEqual(failures, ['/dev/shm free 0kB'])
+
+            # the check still running on a hanging node is killed when the time budget is spent
+            hung = os.path.join(basepath, 'hung')
+            open(fake_rsh, 'w').write("#!/bin/bash\nif [ $1 == node2 ]; then echo $$ > %s; exec sleep 60; fi\n"
+                                      "shift\nbash -c \"$*\"\n" % hung)
+            inst = self._make_instance(['--preflight', '--preflighttimeout', '2', '--basepath', basepath])
+            inst.get_rsh = lambda: fake_rsh
+            inst.PREFLIGHT_SHM_MIN_KB = 0
+            start = time.time()
+            self.assertRaises(Exception, inst.preflight)
+            self.assertTrue(time.time() - start < 10)
+            self.assertEqual(inst.preflight_results['node2'][0], 'FAIL')
+            pid = int(open(hung).read())
+            for _ in range(50):
+                try:
+                    os.kill(pid, 0)
+                except OSError:
+                    break
+                time.sleep(0.1)
+            self.assertRaises(OSError, os.kill, pid, 0)
+        finally:
+            os.remove(fake_rsh)
+            shutil.rmtree(basepath)
+
+    def test_autodevice(self):
+        """Test the device selection with a fake ping-pong, and the cached result"""
+        basepath = tempfile.mkdtemp()
+        fake_mympirun = os.path.join(basepath, 'fake_mympirun')
+        counter = os.path.join(basepath, 'counter')
+        open(fake_mympirun, 'w').write("\n".join([
+            '#!/bin/bash',
+            'echo "$@" >> %s' % counter,
+            'if [ "$2" == "ib" ]; then echo "MYMPINGPONG latency_us=50.0 bandwidth_MBs=300.0"; fi',
+            'if [ "$2" == "det" ]; then exit 1; fi',
+            'if [ "$2" == "socket" ]; then echo "MYMPINGPONG latency_us=30.0 bandwidth_MBs=1100.5"; fi',
+            '',
+        ]))
+        os.chmod(fake_mympirun, stat.S_IRWXU)
+
+        try:
+            inst = self._make_instance(['--autodevice', '--basepath', basepath])
+            inst.AUTODEVICE_MYMPIRUN_CMD = fake_mympirun
+            inst.DEVICE_LOCATION_MAP = {'ib': basepath, 'det': basepath, 'shm': basepath, 'socket': None}
+            inst.set_device()
+            # IPoIB-like: the socket device is faster than the ib one; shm is not a candidate with 3 nodes
+            self.assertEqual(inst.device, 'socket')
+            self.assertEqual(inst.netmasktype, 'eth')
+            calls = open(counter).read().splitlines()
+            self.assertEqual(len(calls), 3)
+            self.assertTrue(calls[0].startswith('--device ib --hybrid 1 --universe 2 --basepath %s' % basepath))
+            self.assertTrue(calls[0].endswith('--schedtype pbs mympingpong'))
+
+            # next job on the same nodes uses the cached result
+            inst = self._make_instance(['--autodevice', '--basepath', basepath])
+            inst.AUTODEVICE_MYMPIRUN_CMD = fake_mympirun
+            inst.DEVICE_LOCATION_MAP = {'ib': basepath, 'det': basepath, 'shm': basepath, 'socket': None}
+            inst.set_device()
+            self.assertEqual(inst.device, 'socket')
+            self.assertEqual(len(open(counter).read().splitlines()), 3)
+
+            # forced device
+            inst = self._make_instance(['--device', 'ib', '--basepath', basepath])
+            inst.set_device()
+            self.assertEqual(inst.device, 'rdma')
+        finally:
+            shutil.rmtree(basepath)
+
+    def test_autodevice_timeout(self):
+        """Test that a hanging ping-pong is killed when the autodevice timeout is reached"""
+        basepath = tempfile.mkdtemp()
+        fake_mympirun = os.path.join(basepath, 'fake_mympirun')
+        pidfile = os.path.join(basepath, 'pid')
+        open(fake_mympirun, 'w').write("\n".join([
+            '#!/bin/bash',
+            'if [ "$2" == "ib" ]; then sleep 60 & echo $! > %s; wait; fi' % pidfile,
+            'if [ "$2" == "socket" ]; then echo "MYMPINGPONG latency_us=30.0 bandwidth_MBs=1100.5"; fi',
+            '',
+        ]))
+        os.chmod(fake_mympirun, stat.S_IRWXU)
+
+        try:
+            inst = self._make_instance(['--autodevice', '--basepath', basepath])
+            inst.AUTODEVICE_MYMPIRUN_CMD = fake_mympirun
+            inst.AUTODEVICE_TIMEOUT = 1
+            inst.get_unique_nodes()
+
+            start = time.time()
+            founddev, results = inst.probe_devices(['ib', 'socket'])
+            self.assertTrue(time.time() - start < 10)
+            self.assertEqual(founddev, 'socket')
+            self.assertEqual(results, {'ib': None, 'socket': 1100.5})
+
+            # the background sleep of the hanging ping-pong is gone too
+            sleeppid = int(open(pidfile).read())
+            self.assertRaises(OSError, os.kill, sleeppid, 0)
+        finally:
+            shutil.rmtree(basepath)
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestSched)
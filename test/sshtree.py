@@ -0,0 +1,118 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.sshtree module, with a fake ssh that runs the commands locally.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.sshtree import ENVIRONMENT_PREFIX, parse_args
+
+SSHTREE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin', 'sshtree.py')
+
+# log the host, fail with 255 as long as there's a fail file for the host
+FAKE_SSH = """#!/bin/bash
+while [ "${1:0:1}" == "-" ]; do shift; done
+host=$1
+shift
+echo $host >> %(log)s
+if [ -f %(tmpdir)s/fail_$host ]; then
+    rm -f %(tmpdir)s/fail_$host
+    exit 255
+fi
+bash -c "$*"
+"""
+
+
+class TestSshTree(TestCase):
+    """Tests for sshtree"""
+
+    def setUp(self):
+        """Fake ssh"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmpdir, 'log')
+
+        fake_ssh = os.path.join(self.tmpdir, 'ssh')
+        open(fake_ssh, 'w').write(FAKE_SSH % {'log': self.log, 'tmpdir': self.tmpdir})
+        os.chmod(fake_ssh, stat.S_IRWXU)
+
+        self.env = os.environ.copy()
+        self.env.update({
+            ENVIRONMENT_PREFIX + 'BACKOFF': '0.01',
+            ENVIRONMENT_PREFIX + 'RSH': fake_ssh,
+            ENVIRONMENT_PREFIX + 'LOCKDIR': os.path.join(self.tmpdir, 'locks'),
+            'PYTHONPATH': os.pathsep.join(sys.path),
+        })
+
+    def tearDown(self):
+        """Cleanup"""
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, args):
+        """Run sshtree with args, return (exitcode, output, list of hosts the fake ssh was called for)"""
+        proc = subprocess.Popen([sys.executable, SSHTREE] + args, env=self.env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out = proc.communicate()[0]
+        hosts = []
+        if os.path.exists(self.log):
+            hosts = open(self.log).read().split()
+            os.remove(self.log)
+        return proc.returncode, out, hosts
+
+    def test_args(self):
+        """Test splitting the ssh-like arguments"""
+        self.assertEqual(parse_args(['-x', '-p', '22', 'n1', 'echo', 'a b']), (['-x', '-p', '22'], 'n1', 'echo a b'))
+        self.assertEqual(parse_args(['n1', 'true']), ([], 'n1', 'true'))
+        self.assertRaises(ValueError, parse_args, ['-x'])
+
+    def test_launch(self):
+        """Test launching on the host"""
+        self.assertEqual(self._run(['-n', 'n1', 'echo', 'hello']), (0, "hello\n", ['n1']))
+        self.assertEqual(self._run(['n6', 'echo', "'hello world'"]), (0, "hello world\n", ['n6']))
+        self.assertEqual(self._run(['other', 'exit 3']), (3, "", ['other']))
+
+    def test_retry(self):
+        """Test retry of failed connections"""
+        open(os.path.join(self.tmpdir, 'fail_n6'), 'w').write('')
+        self.assertEqual(self._run(['n6', 'echo', 'hello']), (0, "hello\n", ['n6', 'n6']))
+
+        # no more retries
+        self.env[ENVIRONMENT_PREFIX + 'RETRIES'] = '0'
+        open(os.path.join(self.tmpdir, 'fail_n1'), 'w').write('')
+        self.assertEqual(self._run(['n1', 'echo', 'hello']), (255, "", ['n1']))
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestSshTree)
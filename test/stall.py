@@ -0,0 +1,214 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.stall module, with a fake clock, and the abort of a stalled mpirun.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import stat
+import tempfile
+import time
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.mpi import MPI
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.rm.local import Local
+from vsc.mympirun.stall import StallDetector, StallException
+from test.walltime import FakeClock
+
+
+class TestStall(TestCase):
+    """Tests for the stall detection"""
+
+    def setUp(self):
+        """Make temporary directory"""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Cleanup"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_detector(self):
+        """Test the progress samples with the fake clock"""
+        clock = FakeClock()
+        cpu = {'local': 0.0, 'remote': 0.0}
+        detector = StallDetector(400, interval=200, cputime=lambda pid: cpu['local'], remote=lambda: cpu['remote'],
+                                 clock=clock)
+        self.assertEqual(detector.interval, 100)
+
+        # output progress, the cputime is only sampled for the first output sample (a reference)
+        output = 0
+        for _ in range(5):
+            clock.advance(100)
+            output += 10
+            self.assertFalse(detector.check(1, output))
+        self.assertEqual(detector.samples, {'output': 5, 'cputime': 1, 'remote': 1})
+
+        # not sampled more than once per interval
+        self.assertFalse(detector.check(1, output))
+        self.assertEqual(detector.samples['output'], 5)
+
+        # no output, but computing on this node: the first cputime sample is a new reference
+        for _ in range(5):
+            clock.advance(100)
+            cpu['local'] += 50
+            self.assertFalse(detector.check(1, output))
+        self.assertEqual(detector.samples, {'output': 10, 'cputime': 6, 'remote': 2})
+
+        # only the remote nodes are computing
+        for _ in range(5):
+            clock.advance(100)
+            cpu['remote'] += 0.5 + detector.cpu_min
+            self.assertFalse(detector.check(1, output))
+
+        # nothing happens: stalled after the window
+        for _ in range(3):
+            clock.advance(100)
+            self.assertFalse(detector.check(1, output))
+        clock.advance(100)
+        self.assertTrue(detector.check(1, output))
+        self.assertTrue(detector.stalled)
+
+    def test_abort(self):
+        """Test aborting a stalled (dummy) mpirun, after the stallhook"""
+        output = os.path.join(self.tmpdir, 'out')
+        hookout = os.path.join(self.tmpdir, 'hookout')
+        hook = os.path.join(self.tmpdir, 'hook.sh')
+        open(hook, 'w').write("#!/bin/sh\necho \"$@\" > %s\n" % hookout)
+        os.chmod(hook, stat.S_IRWXU)
+
+        m = MympirunOption()
+        m.parseoptions(options_list=['--output', output, '--basepath', self.tmpdir, '--stallhook', hook,
+                                     '--teardowngrace', '1', 'echo'])
+        inst = getinstance(MPI, Local, m)
+        inst.make_mympirundir()
+        inst.mpirun_cmd = ["echo started; trap '' TERM; sleep 60"]
+        inst.stall_detector = StallDetector(1, interval=0)
+
+        start = time.time()
+        self.assertRaises(StallException, inst.execute, inst.mpirun_prepare_execution())
+        self.assertTrue(time.time() - start < 10)
+        self.assertEqual(open(output).read(), "started\n")
+        # the hook gets the mpirun pid and the nodefile
+        args = open(hookout).read().split()
+        self.assertEqual(len(args), 2)
+        self.assertTrue(args[0].isdigit())
+        self.assertFalse(os.path.exists(inst.mympirundir))
+
+    def test_remote_samples(self):
+        """Test the remote cputime samples in the background, a hanging sample is killed"""
+        rsh = os.path.join(self.tmpdir, 'rsh')
+        hung = os.path.join(self.tmpdir, 'hung')
+        open(rsh, 'w').write("#!/bin/bash\nif [ $1 == n3 ]; then echo $$ > %s; exec sleep 60; fi\necho 5 7\n" % hung)
+        os.chmod(rsh, stat.S_IRWXU)
+
+        m = MympirunOption()
+        m.parseoptions(options_list=['--basepath', self.tmpdir, 'echo', 'foo'])
+        inst = getinstance(MPI, Local, m)
+        inst.uniquenodes = ['n1', 'n2', 'n3']
+        inst.mpdboot_localhost_interface = ('n1', 'lo')
+        inst.STALL_REMOTE_TIMEOUT = 1
+
+        def wait(fn):
+            """Wait until fn returns True"""
+            for _ in range(100):
+                if fn():
+                    return
+                time.sleep(0.1)
+
+        # no blocking, no finished samples yet
+        start = time.time()
+        self.assertEqual(inst.remote_cputime(rsh), 0)
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(sorted(inst.stall_remote_samples.keys()), ['n2', 'n3'])
+        wait(lambda: inst.stall_remote_samples['n2']['done'] and os.path.exists(hung))
+
+        # n3 still has a sample running: no new one
+        n3 = inst.stall_remote_samples['n3']
+        self.assertEqual(inst.remote_cputime(rsh), 12)
+        self.assertTrue(inst.stall_remote_samples['n3'] is n3)
+        self.assertFalse(n3['expired'])
+
+        # killed after the timeout
+        time.sleep(1.5)
+        pid = int(open(hung).read())
+        self.assertEqual(inst.remote_cputime(rsh), 12)
+        self.assertTrue(n3['expired'])
+        wait(lambda: n3['done'])
+        self.assertTrue(n3['done'])
+        self.assertRaises(OSError, os.kill, pid, 0)
+
+        states = inst.stall_remote_samples.values()
+        inst.stop_remote_samples()
+        self.assertEqual(inst.stall_remote_samples, {})
+        wait(lambda: not [x for x in states if not x['done']])
+
+    def test_relaunch(self):
+        """Test that a relaunch with --resilient gets a new stall window"""
+        m = MympirunOption()
+        m.parseoptions(options_list=['--resilient', '1', '--basepath', self.tmpdir, 'echo', 'foo'])
+        inst = getinstance(MPI, Local, m)
+        inst.noderuns = [('n1', 2), ('n2', 2)]
+        inst.nrnodes = 4
+        inst.get_unique_nodes()
+        inst.set_ppn()
+        inst.make_node_list()
+        inst.make_mympirundir()
+        inst.device = 'socket'
+        # fake nodes can't be resolved
+        inst.mpdboot_localhost_interface = ('n1', 'lo')
+        inst.mpdboot_set_localhost_interface = lambda: None
+
+        clock = FakeClock()
+        inst.stall_detector = StallDetector(400, interval=0, cputime=lambda pid: 0.0, clock=clock)
+        checks = []
+
+        def failed(cmd):
+            """Launcher failure after a long time without progress"""
+            inst.stall_detector.check(1, 100)
+            clock.advance(1000)
+            return 255, "[mpiexec@n1] ssh: connect to host n2 port 22: Connection refused\n"
+
+        def relaunched(cmd):
+            """The output of the relaunch starts at 0 again"""
+            checks.append(inst.stall_detector.check(1, 0))
+            return 0, ''
+
+        inst.mpirun_prepare_execution = lambda: [(relaunched, ['mpirun'])]
+        inst.execute([(failed, ['mpirun'])])
+        self.assertEqual(inst.excluded_nodes, ['n2'])
+        self.assertEqual(checks, [False])
+        self.assertEqual(inst.stall_detector.last_progress, clock())
+        self.assertEqual(inst.stall_detector.samples['output'], 1)
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestStall)
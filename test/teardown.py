@@ -0,0 +1,129 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the signal forwarding to the mpirun process group and the teardown.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import errno
+import os
+import shutil
+import signal
+import tempfile
+import time
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.mpi import MPI, TeardownException
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.proctree import group_alive
+from vsc.mympirun.rm.local import Local
+
+
+class TestTeardown(TestCase):
+    """Tests for the signal handling of a running mpirun"""
+
+    def setUp(self):
+        """Make basepath"""
+        self.basepath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Cleanup"""
+        shutil.rmtree(self.basepath)
+
+    def run_signalled(self, script, signums, options):
+        """
+        Run script as mpirun in a forked mympirun, send the signals to mympirun once script started
+            return tuple (exitcode of mympirun (the signal number of the TeardownException), output, pid of script,
+                          seconds after the last signal, mympirundir)
+        """
+        output = os.path.join(self.basepath, 'out')
+        m = MympirunOption()
+        m.parseoptions(options_list=['--output', output, '--basepath', self.basepath] + options + ['echo'])
+        inst = getinstance(MPI, Local, m)
+        inst.make_mympirundir()
+        inst.mpirun_cmd = ["echo started $$; %s" % script]
+
+        pid = os.fork()
+        if pid == 0:
+            ec = 1
+            try:
+                try:
+                    inst.execute(inst.mpirun_prepare_execution())
+                    ec = 0
+                except TeardownException, err:
+                    ec = err.signum
+                except Exception:
+                    ec = 2
+            finally:
+                os._exit(ec)
+
+        for _ in range(100):
+            if os.path.exists(output) and 'started' in open(output).read():
+                break
+            time.sleep(0.05)
+        mpirun_pid = int(open(output).read().split()[1])
+
+        for signum in signums:
+            os.kill(pid, signum)
+            time.sleep(0.3)
+        start = time.time()
+        ec = os.waitpid(pid, 0)[1]
+        return os.WEXITSTATUS(ec), open(output).read(), mpirun_pid, time.time() - start, inst.mympirundir
+
+    def test_forward(self):
+        """Test forwarding USR1 and TERM, mpirun exits within the grace period"""
+        script = "trap 'echo usr1' USR1; trap 'echo term; exit 3' TERM; while true; do sleep 0.1; done"
+        ec, out, mpirun_pid, seconds, mympirundir = self.run_signalled(script, [signal.SIGUSR1, signal.SIGTERM],
+                                                                       ['--teardowngrace', '5'])
+        self.assertEqual(ec, signal.SIGTERM)
+        self.assertTrue('usr1\n' in out)
+        self.assertTrue('term\n' in out)
+        self.assertTrue(seconds < 3)
+        self.assertFalse(group_alive(mpirun_pid))
+        self.assertFalse(os.path.exists(mympirundir))
+
+    def test_kill(self):
+        """Test killing the mpirun process group that ignores SIGINT after the grace period"""
+        ec, out, mpirun_pid, seconds, mympirundir = self.run_signalled("trap '' INT; sleep 60", [signal.SIGINT],
+                                                                       ['--teardowngrace', '1'])
+        self.assertEqual(ec, signal.SIGINT)
+        self.assertTrue(seconds < 5)
+        self.assertFalse(group_alive(mpirun_pid))
+        self.assertFalse(os.path.exists(mympirundir))
+
+        # the pid is gone too
+        try:
+            os.kill(mpirun_pid, 0)
+            self.fail("mpirun %s still running" % mpirun_pid)
+        except OSError, err:
+            self.assertEqual(err.errno, errno.ESRCH)
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestTeardown)
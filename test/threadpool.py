@@ -0,0 +1,97 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.threadpool module.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import threading
+import time
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.threadpool import bounded_map
+
+
+class TestThreadpool(TestCase):
+    """Tests for bounded_map"""
+
+    def test_results(self):
+        """Test the order of the results, failing items and the bound on the number of threads"""
+        state = {'running': 0, 'max': 0}
+        lock = threading.Lock()
+
+        def func(x):
+            lock.acquire()
+            state['running'] += 1
+            state['max'] = max(state['max'], state['running'])
+            lock.release()
+            time.sleep(0.01 * (x % 3))
+            lock.acquire()
+            state['running'] -= 1
+            lock.release()
+            if x == 5:
+                raise ValueError("item 5")
+            return x * 2
+
+        res = bounded_map(func, range(20), workers=4)
+        self.assertEqual(res, [x * 2 for x in range(5)] + [None] + [x * 2 for x in range(6, 20)])
+        self.assertTrue(state['max'] <= 4)
+        self.assertEqual(bounded_map(func, []), [])
+
+    def test_stop(self):
+        """Test that no new items are started after the stop condition"""
+        started = []
+
+        def func(x):
+            started.append(x)
+            return x
+
+        res = bounded_map(func, range(10), workers=1, stop=lambda item, res: res == 3)
+        self.assertEqual(started, [0, 1, 2, 3])
+        self.assertEqual(res, [0, 1, 2, 3] + [None] * 6)
+
+    def test_timeout(self):
+        """Test that the results of the items that did not finish in time are None"""
+        def func(x):
+            if x == 1:
+                time.sleep(5)
+            return x
+
+        start = time.time()
+        res = bounded_map(func, range(4), workers=2, timeout=0.5)
+        self.assertTrue(time.time() - start < 2)
+        self.assertEqual(res[0], 0)
+        self.assertEqual(res[1], None)
+
+        # the returned list is not changed by the items that are still running
+        time.sleep(0.1)
+        self.assertEqual(res[1], None)
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestThreadpool)
@@ -0,0 +1,213 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.topology module, using fake sysfs trees.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import stat
+import tempfile
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.intelmpi import IntelMPI
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.rm.local import Local
+from vsc.mympirun.topology import Topology, parse_cpulist, make_cpulist
+
+
+def make_fake_sysfs(path, sockets=2, cores=2, threads=2):
+    """
+    Make a fake sysfs system tree: one NUMA node and L3 cache per socket
+    Linux numbering: all first hardware threads first, then the hyperthread siblings
+    """
+    ncores = sockets * cores
+    ncpus = ncores * threads
+
+    def write(txt, *names):
+        fn = os.path.join(path, *names)
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        open(fn, 'w').write("%s\n" % txt)
+
+    write("0-%s" % (ncpus - 1), 'cpu', 'online')
+    socketcpus = dict([(x, []) for x in range(sockets)])
+    for cpu in range(ncpus):
+        socket, core = divmod(cpu % ncores, cores)
+        socketcpus[socket].append(cpu)
+        cpudir = "cpu%s" % cpu
+        write(socket, 'cpu', cpudir, 'topology', 'physical_package_id')
+        write(core, 'cpu', cpudir, 'topology', 'core_id')
+
+    for socket, cpus in socketcpus.items():
+        write(make_cpulist(cpus), 'node', "node%s" % socket, 'cpulist')
+        for cpu in cpus:
+            cachedir = os.path.join('cpu', "cpu%s" % cpu, 'cache')
+            siblings = [x for x in range(ncpus) if x % ncores == cpu % ncores]
+            for index, (level, cachetype, shared) in enumerate([(1, 'Data', siblings),
+                                                                 (1, 'Instruction', siblings),
+                                                                 (2, 'Unified', siblings),
+                                                                 (3, 'Unified', cpus)]):
+                write(level, cachedir, "index%s" % index, 'level')
+                write(cachetype, cachedir, "index%s" % index, 'type')
+                write(make_cpulist(shared), cachedir, "index%s" % index, 'shared_cpu_list')
+
+
+class TestTopology(TestCase):
+    """Tests for the Topology class and the pinning policies"""
+
+    def setUp(self):
+        """Make fake sysfs tree: 2 sockets, 2 cores per socket, 2 hyperthreads per core"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.sysfs = os.path.join(self.tmpdir, 'system')
+        make_fake_sysfs(self.sysfs)
+
+    def tearDown(self):
+        """Cleanup"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_cpulist(self):
+        """Test the cpulist parsing"""
+        self.assertEqual(parse_cpulist("0-3,8,10-11\n"), [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(make_cpulist([0, 4]), "0,4")
+
+    def test_topology(self):
+        """Test reading the fake sysfs"""
+        topo = Topology(sysfs=self.sysfs)
+        self.assertEqual(topo.cpus, range(8))
+        self.assertEqual(topo.cores(), [[0, 4], [1, 5], [2, 6], [3, 7]])
+        self.assertEqual(topo.numa_nodes([0, 1, 4]), [0])
+        self.assertEqual(topo.numa_nodes([0, 2]), [0, 1])
+        self.assertEqual(topo.cache[5], 0)
+        self.assertEqual(topo.cache[6], 2)
+
+        # restricted cpuset
+        topo = Topology(cpus=[2, 3, 6, 9], sysfs=self.sysfs)
+        self.assertEqual(topo.cores(), [[2, 6], [3]])
+
+        # no topology information
+        topo = Topology(cpus=[0, 1, 2], sysfs=os.path.join(self.tmpdir, 'doesnotexist'))
+        self.assertEqual(topo.cores(), [[0], [1], [2]])
+        self.assertEqual(topo.numa_nodes([0, 1, 2]), [0])
+
+    def test_rank_map(self):
+        """Test the pinning policies"""
+        topo = Topology(sysfs=self.sysfs)
+
+        self.assertEqual(topo.rank_map('compact', 4), [[0], [4], [1], [5]])
+        self.assertEqual(topo.rank_map('compact', 4, domain=2), [[0, 4], [1, 5], [2, 6], [3, 7]])
+        # no hyperthread siblings as long as there are free cores
+        self.assertEqual(topo.rank_map('spread', 4), [[0], [2], [1], [3]])
+        self.assertEqual(topo.rank_map('spread', 6), [[0], [2], [1], [3], [4], [6]])
+        self.assertEqual(topo.rank_map('spread', 2, domain=2), [[0, 4], [2, 6]])
+        self.assertEqual(topo.rank_map('cycle', 10)[8:], [[0], [4]])
+
+        # one rank per physical core
+        self.assertEqual(topo.rank_map('compact', 2, physcore=True), [[0, 4], [1, 5]])
+        self.assertEqual(topo.rank_map('spread', 2, physcore=True), [[0, 4], [2, 6]])
+        self.assertEqual(topo.rank_map('compact', 2, domain=2, physcore=True), [[0, 4, 1, 5], [2, 6, 3, 7]])
+
+        self.assertRaises(Exception, topo.rank_map, 'random', 2)
+
+    def test_pinning_override(self):
+        """Test the generated pinning wrapper"""
+        fakebin = os.path.join(self.tmpdir, 'bin')
+        os.mkdir(fakebin)
+        fake_numactl = os.path.join(fakebin, 'numactl')
+        open(fake_numactl, 'w').write("#!/bin/bash\n")
+        os.chmod(fake_numactl, stat.S_IRWXU)
+
+        origpath = os.environ.get('PATH', '')
+        os.environ['PATH'] = os.pathsep.join([fakebin, origpath])
+        try:
+            m = MympirunOption()
+            m.parseoptions(options_list=['--overridepin', 'spreadpin', '--overridepinmembind',
+                                         '--basepath', self.tmpdir, 'echo', 'foo'])
+            inst = getinstance(IntelMPI, Local, m)
+            inst.SYSFS_SYSTEM = self.sysfs
+            inst.cpus = range(8)
+            inst.ppn = inst.foundppn = 8
+            inst.mpitotalppn = 4
+            inst.nodecpusets = {'n1': ('n1.cluster', range(8), [0, 1])}
+            inst.make_mympirundir()
+
+            wrapper = inst.pinning_override()
+            txt = open(wrapper).read()
+            self.assertTrue("MYMPIRUN_LOCALRANK_MAP=(0 2 1 3)\n" in txt)
+            self.assertTrue("MYMPIRUN_LOCALRANK_MEMMAP=(0 1 0 1)\n" in txt)
+            index = '$((MYMPIRUN_LOCALRANK % ${#MYMPIRUN_LOCALRANK_MAP[@]}))'
+            self.assertTrue('--physcpubind="${MYMPIRUN_LOCALRANK_MAP[%s]}"' % index in txt)
+            self.assertTrue('--membind="${MYMPIRUN_LOCALRANK_MEMMAP[%s]}"' % index in txt)
+            self.assertFalse('case' in txt)
+
+            # different cpusets per node
+            inst.nodecpusets = {
+                'n1': ('n1.cluster', range(8), [0, 1]),
+                'n2': ('n2.cluster', [0, 1, 4, 5], [0]),
+                'n3': ('n3.cluster', range(8), [0, 1]),
+            }
+            inst.mpinoderuns = [('n1', 4), ('n2', 4), ('n3', 4)]
+            txt = open(inst.pinning_override()).read()
+            self.assertTrue(('    n2.cluster)\n'
+                             '        MYMPIRUN_LOCALRANK_MAP=(0 1 4 5)\n'
+                             '        MYMPIRUN_LOCALRANK_MEMMAP=(0 0 0 0)\n'
+                             '        ;;\n'
+                             '    *)\n'
+                             '        MYMPIRUN_LOCALRANK_MAP=(0 2 1 3)\n') in txt)
+
+            # nodes that could not be probed (unknown hostname) use the default maps
+            inst.nodecpusets['n4'] = (None, [0, 1, 4, 5], [0])
+            inst.nodecpusets['n5'] = (None, range(8), [0, 1])
+            inst.mpinoderuns.append(('n4', 4))
+            inst.mpinoderuns.append(('n5', 4))
+            txt = open(inst.pinning_override()).read()
+            self.assertTrue(('    n2.cluster)\n'
+                             '        MYMPIRUN_LOCALRANK_MAP=(0 1 4 5)\n'
+                             '        MYMPIRUN_LOCALRANK_MEMMAP=(0 0 0 0)\n'
+                             '        ;;\n'
+                             '    *)\n'
+                             '        MYMPIRUN_LOCALRANK_MAP=(0 2 1 3)\n') in txt)
+            self.assertFalse('None' in txt)
+
+            inst.nodecpusets['n5'] = (None, [0, 1, 4, 5], [0])
+            txt = open(inst.pinning_override()).read()
+            self.assertTrue(('    n1.cluster|n3.cluster)\n'
+                             '        MYMPIRUN_LOCALRANK_MAP=(0 2 1 3)\n') in txt or
+                            ('    n3.cluster|n1.cluster)\n'
+                             '        MYMPIRUN_LOCALRANK_MAP=(0 2 1 3)\n') in txt)
+            self.assertTrue(('    *)\n'
+                             '        MYMPIRUN_LOCALRANK_MAP=(0 1 4 5)\n') in txt)
+            self.assertFalse('n2.cluster' in txt)
+        finally:
+            os.environ['PATH'] = origpath
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestTopology)
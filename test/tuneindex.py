@@ -0,0 +1,115 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.tuneindex module and the Intel MPI tuning option.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.intelmpi import IntelHydraMPI
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.rm.local import Local
+from vsc.mympirun.tuneindex import TuneIndex, parse_tune_filename
+
+
+class TestTuneIndex(TestCase):
+    """Tests for the index of mpitune config files"""
+
+    def setUp(self):
+        """Make a fake tuning directory"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.tunedir = os.path.join(self.tmpdir, 'etc64')
+        os.mkdir(self.tunedir)
+        for name in ['mpiexec_shm-dapl_nn_1_np_8_ppn_8.conf', 'mpiexec_shm-dapl_nn_4_np_32_ppn_8.conf',
+                     'mpiexec_shm-dapl_nn_16_np_256_ppn_16.conf', 'mpiexec_shm-sock_nn_4_np_32_ppn_8.conf',
+                     'my_app_shm-dapl_nn_2_np_16_ppn_8.conf', 'README']:
+            open(os.path.join(self.tunedir, name), 'w').write('')
+        self.indexfile = os.path.join(self.tmpdir, 'index', 'etc64')
+
+    def tearDown(self):
+        """Cleanup"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse(self):
+        """Test parsing the tuning config filenames"""
+        self.assertEqual(parse_tune_filename('/x/my_app_shm-dapl_nn_2_np_16_ppn_8.conf'),
+                         (('my_app', 'shm-dapl'), (2, 16, 8)))
+        self.assertEqual(parse_tune_filename('README'), None)
+
+    def test_lookup(self):
+        """Test the nearest neighbour lookup and the rebuild of the index"""
+        index = TuneIndex(self.tunedir, self.indexfile)
+        self.assertEqual(index.lookup('mpiexec', 'shm:dapl', 4, 32, 8),
+                         os.path.join(self.tunedir, 'mpiexec_shm-dapl_nn_4_np_32_ppn_8.conf'))
+        self.assertEqual(os.path.basename(index.lookup('mpiexec', 'shm:dapl', 8, 64, 8)),
+                         'mpiexec_shm-dapl_nn_4_np_32_ppn_8.conf')
+        self.assertEqual(os.path.basename(index.lookup('mpiexec', 'shm:dapl', 12, 192, 16)),
+                         'mpiexec_shm-dapl_nn_16_np_256_ppn_16.conf')
+        self.assertEqual(os.path.basename(index.lookup('my_app', 'shm:dapl', 1, 8, 8)),
+                         'my_app_shm-dapl_nn_2_np_16_ppn_8.conf')
+        self.assertEqual(index.lookup('mpiexec', 'det', 1, 8, 8), None)
+        self.assertTrue(os.path.isfile(self.indexfile))
+
+        # the index file is used as long as the directory is unchanged
+        index = TuneIndex(self.tunedir, self.indexfile)
+        index.scan = None
+        self.assertEqual(os.path.basename(index.lookup('mpiexec', 'shm:dapl', 8, 64, 8)),
+                         'mpiexec_shm-dapl_nn_4_np_32_ppn_8.conf')
+
+        # new tuning file: rebuild
+        open(os.path.join(self.tunedir, 'mpiexec_shm-dapl_nn_8_np_64_ppn_8.conf'), 'w').write('')
+        mtime = time.time() + 10
+        os.utime(self.tunedir, (mtime, mtime))
+        index = TuneIndex(self.tunedir, self.indexfile)
+        self.assertEqual(os.path.basename(index.lookup('mpiexec', 'shm:dapl', 8, 64, 8)),
+                         'mpiexec_shm-dapl_nn_8_np_64_ppn_8.conf')
+
+    def test_gettuning(self):
+        """Test the -tune option of Intel MPI"""
+        m = MympirunOption()
+        m.parseoptions(options_list=['--impi-tune', '--impi-tunedir', self.tunedir, '--basepath', self.tmpdir,
+                                     'echo', 'foo'])
+        inst = getinstance(IntelHydraMPI, Local, m)
+        inst.device = 'shm:dapl'
+        inst.nruniquenodes = 1
+        inst.mpitotalppn = 8
+        self.assertEqual(inst.gettuning(), "-tune %s" % os.path.join(self.tunedir,
+                                                                     'mpiexec_shm-dapl_nn_1_np_8_ppn_8.conf'))
+
+        inst.options.impi_tune = False
+        self.assertEqual(inst.gettuning(), None)
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestTuneIndex)
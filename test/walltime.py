@@ -0,0 +1,156 @@
+##
+#
+# Copyright 2013 Ghent University
+#
+# This file is part of vsc-mympirun,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://vscentrum.be/nl/en),
+# the Hercules foundation (http://www.herculesstichting.be/in_English)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# http://github.com/hpcugent/vsc-mympirun
+#
+# vsc-mympirun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-mympirun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-mympirun. If not, see <http://www.gnu.org/licenses/>.
+##
+"""
+Tests for the vsc.mympirun.walltime and vsc.mympirun.proctree modules, with a fake clock.
+
+@author: Stijn De Weirdt (Ghent University)
+"""
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+from StringIO import StringIO
+from unittest import TestCase, TestLoader
+
+from vsc.mympirun.mpi.factory import getinstance
+from vsc.mympirun.mpi.mpi import MPI
+from vsc.mympirun.option import MympirunOption
+from vsc.mympirun.output import OutputEngine, run_output
+from vsc.mympirun.proctree import descendants, process_table, signal_tree, tree_cputime
+from vsc.mympirun.rm.local import Local
+from vsc.mympirun.walltime import WalltimeException, WalltimeGuard, get_signal, parse_walltime
+
+
+class FakeClock(object):
+    """Clock that only moves when told so"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class TestWalltime(TestCase):
+    """Tests for the walltime aware termination"""
+
+    def test_parse(self):
+        """Test parsing the walltime and signal names"""
+        self.assertEqual(parse_walltime('72:00:00'), 72 * 3600)
+        self.assertEqual(parse_walltime('5:30'), 330)
+        self.assertEqual(parse_walltime(' 90 '), 90)
+        self.assertRaises(ValueError, parse_walltime, '1h')
+        self.assertEqual(get_signal('usr1'), signal.SIGUSR1)
+        self.assertEqual(get_signal('SIGTERM'), signal.SIGTERM)
+        self.assertEqual(get_signal('12'), 12)
+        self.assertRaises(ValueError, get_signal, 'USR3')
+
+    def test_timeline(self):
+        """Test the termination schedule with the fake clock"""
+        clock = FakeClock()
+        sent = []
+        guard = WalltimeGuard(clock() + 3600, 600, signal.SIGUSR1, grace=30, budget=20, clock=clock,
+                              send=lambda pid, signum: sent.append((clock(), pid, signum)))
+
+        timeline = []
+        while not guard.check(123):
+            timeline.append(clock())
+            clock.advance(10)
+
+        self.assertEqual(sent, [(4000.0, 123, signal.SIGUSR1), (4550.0, 123, signal.SIGTERM),
+                                (4580.0, 123, signal.SIGKILL)])
+        # checked every 10 seconds until the kill, 20 seconds left for the cleanup
+        self.assertEqual(timeline[-1], 4570.0)
+        self.assertEqual(guard.deadline - clock(), 20)
+        self.assertEqual(guard.next_step(), None)
+
+        # late start: all steps that are due at once
+        clock = FakeClock()
+        sent = []
+        guard = WalltimeGuard(clock() + 10, 600, signal.SIGUSR1, clock=clock,
+                              send=lambda pid, signum: sent.append(signum))
+        self.assertTrue(guard.check(123))
+        self.assertEqual(sent, [signal.SIGUSR1, signal.SIGTERM, signal.SIGKILL])
+
+    def test_proctree(self):
+        """Test the process tree helpers"""
+        proc = subprocess.Popen("sleep 60 & sleep 60; wait", shell=True)
+        try:
+            time.sleep(0.2)
+            pids = descendants(proc.pid, process_table())
+            self.assertEqual(len(pids), 3)
+            self.assertTrue(tree_cputime(proc.pid) >= 0)
+            self.assertEqual(len(signal_tree(proc.pid, signal.SIGKILL)), 3)
+            self.assertEqual(proc.wait(), -signal.SIGKILL)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+
+    def test_supervised_run(self):
+        """Test the termination of an mpirun past its walltime"""
+        m = MympirunOption()
+        m.parseoptions(options_list=['--walltime', '0', 'echo', 'foo'])
+        inst = getinstance(MPI, Local, m)
+        inst.make_walltime_guard()
+        self.assertTrue(inst.supervised())
+
+        start = time.time()
+        ec, _ = run_output("trap '' USR1 TERM; sleep 60", engine=OutputEngine(StringIO()), tick=inst.supervise,
+                           disable_log=True)
+        self.assertEqual(ec, -signal.SIGKILL)
+        self.assertTrue(time.time() - start < 10)
+        self.assertEqual([x[2] for x in inst.walltime_guard.sent], ['warning', 'terminate', 'kill'])
+
+    def test_supervised_execute(self):
+        """Test that an mpirun terminated for the walltime is a failure of mympirun"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            m = MympirunOption()
+            m.parseoptions(options_list=['--walltime', '62', '--walltimewarning', '0', '--basepath', tmpdir,
+                                         '--output', os.path.join(tmpdir, 'out'), 'echo', 'foo'])
+            inst = getinstance(MPI, Local, m)
+            inst.make_mympirundir()
+            inst.make_walltime_guard()
+            inst.mpirun_cmd = ['sleep 60']
+
+            start = time.time()
+            self.assertRaises(WalltimeException, inst.execute, inst.mpirun_prepare_execution())
+            self.assertTrue(time.time() - start < 10)
+            self.assertEqual([x[2] for x in inst.walltime_guard.sent], ['terminate'])
+            self.assertFalse(os.path.exists(inst.mympirundir))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+def suite():
+    """ return all the tests"""
+    return TestLoader().loadTestsFromTestCase(TestWalltime)